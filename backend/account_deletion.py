@@ -0,0 +1,308 @@
+"""HavenApp Backend - Account deletion
+
+DELETE /api/user deactivates the account straight away, which locks every
+token out, and records an account_deletions job. A background runner then
+removes the user's rows table by table. Each chunk selects the primary keys
+of the next ACCOUNT_DELETION_CHUNK_SIZE rows, deletes them by key and
+commits together with the job's progress. Memory therefore stays at one
+chunk of keys, and no lock is held for longer than one small DELETE, however
+many signals the user has. The users row goes last, once nothing references
+it.
+
+A runner holds a job through a lease that each chunk renews. If the worker
+dies mid-job the lease runs out and any runner, including `flask
+delete-accounts`, resumes the job at the table it was on. Deleting rows that
+are already gone is a no-op, so nothing depends on exactly where it stopped.
+A chunk committed by a runner that has lost its lease is rolled back.
+
+With sharding on, the user's rows are deleted on their shard (users.shard)
+and the job's progress is recorded on the primary; the leftovers are
+committed on the shard before the users row goes.
+"""
+import logging
+import os
+import threading
+import uuid
+from datetime import datetime, timedelta
+from flask import current_app
+from sqlalchemy import delete, or_, select, tuple_, update
+
+from consent import invalidate_consent
+from database import on_shard
+from ids import generate_id
+from models import (
+    db, User, Signal, SignalBucket, SignalRollup, Alert, RiskState, EmergencyContact, ConsentRecord, AuditLog,
+    AccountDeletion,
+)
+from user_cache import invalidate_user
+from versions import RESOURCES, bump_versions
+
+logger = logging.getLogger(__name__)
+
+# Every table with a user_id referencing users, in deletion order; audit
+# logs go last so the account's trail outlasts the data it describes
+STEPS = (
+    ('signals', Signal.__table__),
+    ('signal_buckets', SignalBucket.__table__),
+    ('signal_rollups', SignalRollup.__table__),
+    ('alerts', Alert.__table__),
+    ('risk_states', RiskState.__table__),
+    ('emergency_contacts', EmergencyContact.__table__),
+    ('consent_records', ConsentRecord.__table__),
+    ('audit_logs', AuditLog.__table__),
+)
+
+ACTIVE = ('pending', 'running')
+
+
+class LeaseLost(Exception):
+    """Another runner has taken over the job"""
+
+
+def request_deletion(user):
+    """Deactivate user and record their deletion job; returns the job, reusing one still in progress"""
+    job = AccountDeletion.query.filter(
+        AccountDeletion.user_id == user.id, AccountDeletion.status.in_(ACTIVE)
+    ).first()
+    if job is None:
+        job = AccountDeletion(id=generate_id(), user_id=user.id, status='pending', deleted={}, attempts=0)
+        db.session.add(job)
+    user.is_active = False
+    user.updated_at = datetime.utcnow()
+    db.session.commit()
+    return job
+
+
+def _key_columns(table):
+    return list(table.primary_key.columns)
+
+
+class DeletionRunner:
+    """Claims and runs account deletion jobs in a background thread"""
+
+    def __init__(self, app):
+        self.app = app
+        config = app.config
+        self.chunk_size = config.get('ACCOUNT_DELETION_CHUNK_SIZE', 1000)
+        self.pause = config.get('ACCOUNT_DELETION_CHUNK_PAUSE', 0.01)
+        self.lease = timedelta(seconds=config.get('ACCOUNT_DELETION_LEASE_SECONDS', 60))
+        self.poll = config.get('ACCOUNT_DELETION_POLL_SECONDS', 30)
+        self.max_attempts = config.get('ACCOUNT_DELETION_MAX_ATTEMPTS', 5)
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._lock = threading.Lock()
+        self._thread = None
+        self._pid = None
+        self._shared_connection = None
+        self.running = 0
+        self.completed = 0
+        self.failed = 0
+        self.retried = 0
+        self.leases_lost = 0
+        self.rows_deleted = 0
+
+    def ensure_started(self):
+        # Threads don't survive a fork, so each gunicorn worker starts its own
+        if self._thread is not None and self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._thread is not None and self._pid == os.getpid():
+                return
+            engine = db.engine
+            # In-memory SQLite is one connection; a second thread must not use it
+            self._shared_connection = engine.dialect.name == 'sqlite' and engine.url.database in (None, '', ':memory:')
+            self._pid = os.getpid()
+            if self._shared_connection:
+                self._thread = False
+                return
+            self._thread = threading.Thread(target=self._run, name='account-deletion', daemon=True)
+            self._thread.start()
+
+    def submit(self):
+        """Have the runner look for claimable jobs now"""
+        self.ensure_started()
+        if self._shared_connection:
+            self.run_pending()
+        else:
+            self._wake.set()
+
+    def _run(self):
+        # Polling also picks up jobs whose runner died and whose lease has run out
+        while not self._stop.is_set():
+            with self.app.app_context():
+                try:
+                    self.run_pending()
+                except Exception as e:
+                    db.session.rollback()
+                    logger.error(f'Account deletion runner failed: {str(e)}')
+                finally:
+                    db.session.remove()
+            self._wake.wait(self.poll)
+            self._wake.clear()
+
+    def run_pending(self):
+        """Run claimable jobs until none are left; returns how many finished"""
+        finished = 0
+        while True:
+            claimed = self._claim()
+            if claimed is None:
+                return finished
+            if self._process(*claimed):
+                finished += 1
+
+    def _claim(self):
+        now = datetime.utcnow()
+        table = AccountDeletion.__table__
+        claimable = (table.c.status.in_(ACTIVE), or_(table.c.lease_until.is_(None), table.c.lease_until < now))
+        job_id = db.session.execute(
+            select(table.c.id).where(*claimable).order_by(table.c.created_at).limit(1)
+        ).scalar()
+        if job_id is None:
+            db.session.rollback()
+            return None
+        runner = str(uuid.uuid4())
+        result = db.session.execute(
+            update(table).where(table.c.id == job_id, *claimable)
+            .values(status='running', runner=runner, lease_until=now + self.lease,
+                    attempts=table.c.attempts + 1, updated_at=now)
+        )
+        db.session.commit()
+        # Lost the race to another runner: look again
+        return (job_id, runner) if result.rowcount == 1 else self._claim()
+
+    def _save(self, job_id, claim, **values):
+        """Record progress in the current transaction; raises LeaseLost if the job is no longer claimed by claim"""
+        now = datetime.utcnow()
+        values.setdefault('lease_until', now + self.lease)
+        table = AccountDeletion.__table__
+        result = db.session.execute(
+            update(table).where(table.c.id == job_id, table.c.runner == claim).values(updated_at=now, **values)
+        )
+        if result.rowcount != 1:
+            raise LeaseLost(job_id)
+
+    def _delete_chunk(self, table, user_id):
+        key = _key_columns(table)
+        rows = db.session.execute(select(*key).where(table.c.user_id == user_id).limit(self.chunk_size)).all()
+        if not rows:
+            return 0, True
+        if len(key) == 1:
+            condition = key[0].in_([row[0] for row in rows])
+        else:
+            condition = tuple_(*key).in_([tuple(row) for row in rows])
+        deleted = db.session.execute(delete(table).where(condition)).rowcount
+        return deleted, len(rows) < self.chunk_size
+
+    def _process(self, job_id, runner):
+        job = db.session.get(AccountDeletion, job_id)
+        user_id, deleted = job.user_id, dict(job.deleted or {})
+        shard = db.session.execute(select(User.shard).where(User.id == user_id)).scalar()
+        names = [name for name, _ in STEPS]
+        start = names.index(job.step) if job.step in names else 0
+        db.session.rollback()
+        with self._lock:
+            self.running += 1
+        try:
+            with on_shard(shard):
+                for name, table in STEPS[start:]:
+                    while True:
+                        count, done = self._delete_chunk(table, user_id)
+                        deleted[name] = deleted.get(name, 0) + count
+                        self._save(job_id, runner, step=name, deleted=deleted)
+                        db.session.commit()
+                        with self._lock:
+                            self.rows_deleted += count
+                        if done:
+                            break
+                        if self.pause:
+                            self._stop.wait(self.pause)
+
+                # Rows written while the job ran (e.g. queued audit entries) go with the user
+                for name, table in STEPS:
+                    count = db.session.execute(delete(table).where(table.c.user_id == user_id)).rowcount
+                    deleted[name] = deleted.get(name, 0) + count
+                if shard is not None:
+                    # On another database than users: gone for certain before the users row is
+                    self._save(job_id, runner, deleted=deleted)
+                    db.session.commit()
+            db.session.execute(delete(User.__table__).where(User.__table__.c.id == user_id))
+            self._save(job_id, runner, status='done', step=None, deleted=deleted, runner=None,
+                       lease_until=None, error=None, finished_at=datetime.utcnow())
+            db.session.commit()
+        except LeaseLost:
+            db.session.rollback()
+            with self._lock:
+                self.leases_lost += 1
+            logger.warning(f'Account deletion {job_id} was taken over by another runner')
+            return False
+        except Exception as e:
+            db.session.rollback()
+            self._fail(job_id, runner, e)
+            return False
+        finally:
+            with self._lock:
+                self.running -= 1
+
+        invalidate_user(user_id)
+        invalidate_consent(user_id)
+        bump_versions(user_id, *RESOURCES)
+        with self._lock:
+            self.completed += 1
+        logger.info(f'Account {user_id} deleted: {deleted}')
+        return True
+
+    def _fail(self, job_id, runner, error):
+        job = db.session.get(AccountDeletion, job_id)
+        final = job is not None and job.attempts >= self.max_attempts
+        try:
+            # Retried by whichever runner claims it once this backoff has passed
+            self._save(job_id, runner, status='failed' if final else 'running', error=str(error)[:1000],
+                       lease_until=datetime.utcnow() + self.lease * (job.attempts if job else 1))
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+        with self._lock:
+            if final:
+                self.failed += 1
+            else:
+                self.retried += 1
+        logger.error(f'Account deletion {job_id} failed{"" if final else ", will retry"}: {str(error)}')
+
+    def stop(self):
+        self._stop.set()
+        self._wake.set()
+
+    def stats(self):
+        with self._lock:
+            return {
+                'running': self.running,
+                'completed': self.completed,
+                'failed': self.failed,
+                'retried': self.retried,
+                'leases_lost': self.leases_lost,
+                'rows_deleted': self.rows_deleted,
+            }
+
+
+def retry_failed():
+    """Make failed jobs claimable again; returns how many"""
+    table = AccountDeletion.__table__
+    result = db.session.execute(
+        update(table).where(table.c.status == 'failed').values(status='pending', attempts=0, lease_until=None)
+    )
+    db.session.commit()
+    return result.rowcount
+
+
+def init_account_deletion(app):
+    runner = DeletionRunner(app)
+    app.extensions['account_deletion'] = runner
+    # Started from the first request so CLI commands and the gunicorn master stay thread-free;
+    # running, it also resumes jobs left behind by a worker that died
+    app.before_request(runner.ensure_started)
+    return runner
+
+
+def account_deletion_stats():
+    runner = current_app.extensions.get('account_deletion')
+    return runner.stats() if runner else {}
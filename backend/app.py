@@ -1,40 +1,217 @@
+import time
+
+_import_started = time.perf_counter()
+
 import os
-from flask import Flask, jsonify, request
+import click
+from flask import Flask, Response, jsonify, request, stream_with_context
 from flask_cors import CORS
-from flask_jwt_extended import JWTManager, jwt_required, get_jwt_identity
-from datetime import datetime
+from flask_jwt_extended import JWTManager, create_access_token, decode_token, get_jwt, get_jwt_identity, jwt_required
+from datetime import datetime, timedelta, timezone
+from sqlalchemy.exc import IntegrityError
 
 from config import config
-from models import db, User, Signal, Alert, ConsentRecord, EmergencyContact, AuditLog
-from auth import authenticate_user, create_tokens, register_user, generate_id
+from database import init_database, read_only, use_primary, each_shard, on_shard, shard_engine
+from models import (
+    db, User, Alert, ConsentRecord, EmergencyContact, AccountDeletion, ALERT_SHAPE, SIGNAL_SHAPE,
+    CONTACT_SHAPE, USER_SHAPE, CONSENT_SHAPE
+)
+from audit import init_audit, record_audit, audit_stats
+from events import init_events, publish_alert_event, event_stream, event_stats
+from auth import authenticate_user, create_tokens, register_user, get_current_user, load_current_user
+from ids import generate_id
+from export import iter_export
+import idempotency
+from idempotency import init_idempotency, IdempotencyConflict
+from priority import init_priority
+from metrics import init_metrics, stats_gauge
+from compression import init_compression, compression_stats
+from notifications import init_notifications, notify_contacts, notification_stats
+from passwords import init_password_hashing, password_hashing_stats, PasswordHashingBusy
+from user_cache import init_user_cache, invalidate_user, user_cache_stats
+from revocation import init_revocation, revoke_token, revocation_stats
+from consent import (
+    init_consent_cache, consent_snapshot, missing_scope, default_consent, invalidate_consent, consent_cache_stats
+)
+from versions import init_versions, bump_versions, resource_etag, etag_headers, not_modified, RESOURCES
+from pagination import parse_page_args, keyset_page, page_headers
+from retention import init_retention, purge_expired, POLICIES as RETENTION_POLICIES
+from account_deletion import init_account_deletion, request_deletion, retry_failed, account_deletion_stats
+from scoring import record_signals, rescore_all
+from signal_store import init_signal_store, signal_store, pack_signal_rows
+import rollups
+from sharding import ShardMoveInProgress, move_user, abort_move, rebalance
 from schemas import (
-    user_schema, login_schema, register_schema, signal_schema, signals_schema,
-    alert_schema, alerts_schema, panic_alert_schema
+    login_schema, register_schema, signal_schema, signals_schema,
+    alert_schema, consent_schema, emergency_contact_schema
 )
+from serializers import FastJSONProvider, parse_fields
+import migrations
+
+_import_seconds = time.perf_counter() - _import_started
 
 
 def create_app(config_name='development'):
+    started = time.perf_counter()
     app = Flask(__name__)
     app.config.from_object(config[config_name])
+    app.json = FastJSONProvider(app)
     
     # Initialize extensions
-    db.init_app(app)
-    CORS(app)
+    init_database(app, db)
+    init_signal_store(app)
+    CORS(app, expose_headers=['X-Next-Cursor', 'ETag'])
     jwt = JWTManager(app)
+    init_revocation(app, jwt)
+    init_audit(app)
+    init_user_cache(app)
+    # Consent snapshots are only as coherent as the version store they check
+    init_versions(app)
+    init_consent_cache(app)
+    init_events(app)
+    init_idempotency(app)
+    notifications = init_notifications(app)
+    init_password_hashing(app)
+    init_retention(app)
+    deletions = init_account_deletion(app)
+    metrics = init_metrics(app)
+    # After metrics, so shed requests are still counted
+    priority_gate = init_priority(app)
+    # Also after metrics: after_request hooks run in reverse, so sizes are recorded compressed
+    init_compression(app)
+    if metrics:
+        notifications.latency_observers.append(
+            lambda seconds, channel: metrics.registry.observe(
+                'havenapp_notification_delivery_seconds', (('channel', channel),), seconds)
+        )
+        metrics.gauge_sources += [
+            stats_gauge('havenapp_audit_writer', 'Audit writer counters (this worker)', audit_stats),
+            stats_gauge('havenapp_user_cache', 'Authenticated user cache counters (this worker)', user_cache_stats),
+            stats_gauge('havenapp_revocations', 'Token revocation list counters (this worker)', revocation_stats),
+            stats_gauge('havenapp_consent_cache', 'Consent snapshot cache counters (this worker)', consent_cache_stats),
+            stats_gauge('havenapp_password_pool', 'Password hashing pool counters (this worker)',
+                        password_hashing_stats),
+            stats_gauge('havenapp_event_stream', 'Alert event stream counters (this worker)', event_stats),
+            stats_gauge('havenapp_notifications', 'Contact notification dispatcher counters (this worker)',
+                        notification_stats),
+            stats_gauge('havenapp_account_deletion', 'Account deletion runner counters (this worker)',
+                        account_deletion_stats),
+            stats_gauge('havenapp_compression', 'Response compression counters (this worker)', compression_stats),
+            stats_gauge('havenapp_priority_gate', 'Request priority gate counters (this worker)',
+                        lambda: priority_gate.stats() if priority_gate else {}),
+            stats_gauge('havenapp_startup_seconds', 'Module import and create_app time (this worker)',
+                        lambda: app.extensions['startup']),
+        ]
+    
+    def schema_engines():
+        """The primary's engine, then each shard's, marked for migrations.is_shard()"""
+        return [db.engine] + [migrations.for_shard(shard_engine(db, shard)) for shard in each_shard()[1:]]
     
-    with app.app_context():
-        db.create_all()
+    if app.config.get('SCHEMA_AUTO_MIGRATE'):
+        with app.app_context():
+            for engine in schema_engines():
+                migrations.upgrade(engine)
     
-    # Helper function to get current user
-    def get_current_user():
+    @app.cli.command('migrate')
+    @click.option('--status', is_flag=True, help='List pending migrations and model drift without applying.')
+    @click.option('--target', type=int, default=None, help='Stop after this migration version.')
+    def migrate_command(status, target):
+        """Apply pending schema migrations."""
+        engines = schema_engines()
+        for shard, engine in zip(each_shard(), engines):
+            prefix = f'shard {shard}: ' if shard is not None else ''
+            if status:
+                for version, name in migrations.pending(engine):
+                    print(f'{prefix}pending: {name}')
+                for item in migrations.drift(engine, db.metadata):
+                    print(f'{prefix}missing from database: {item}')
+                continue
+            applied = migrations.upgrade(engine, target=target, log=print)
+            if not applied:
+                print(f'{prefix}Schema is up to date')
+    
+    @app.cli.command('rescore-risk')
+    def rescore_risk_command():
+        """Recompute every user's risk state from the signals table."""
+        users = signals = 0
+        for shard in each_shard():
+            with on_shard(shard):
+                shard_users, shard_signals = rescore_all()
+            users += shard_users
+            signals += shard_signals
+        print(f'Rescored {users} users from {signals} signals')
+    
+    @app.cli.command('pack-signals')
+    def pack_signals_command():
+        """Move signals rows into signal_buckets (SIGNAL_STORAGE = 'buckets'). Signals get new ids."""
+        store = signal_store()
+        if store.name != 'buckets':
+            raise click.ClickException("Set SIGNAL_STORAGE = 'buckets' first")
+        moved = 0
+        for shard in each_shard():
+            with on_shard(shard):
+                moved += pack_signal_rows(store)
+        print(f'Packed {moved} signals')
+    
+    @app.cli.command('rebuild-rollups')
+    @click.option('--since', type=click.DateTime(), default=None,
+                  help='Replace buckets from this UTC time on (default: the oldest stored signal).')
+    @click.option('--batch-size', type=int, default=100, help='Users rebuilt per transaction.')
+    def rebuild_rollups_command(since, batch_size):
+        """Recompute signal_rollups from the stored signals, keeping buckets older than them."""
+        signals = 0
+        for shard in each_shard():
+            with on_shard(shard):
+                signals += rollups.rebuild(signal_store(), since=since, users_per_batch=batch_size)
+        print(f'Rebuilt rollups from {signals} signals')
+    
+    @app.cli.command('purge-expired')
+    @click.option('--only', 'policies', multiple=True, type=click.Choice(list(RETENTION_POLICIES)),
+                  help='Run only the named policy (repeatable).')
+    @click.option('--batch-size', type=int, default=None, help='Rows deleted per transaction.')
+    def purge_expired_command(policies, batch_size):
+        """Delete signals, acknowledged alerts and audit logs past their retention windows."""
+        report = purge_expired(policies or None, batch_size=batch_size)
+        for name, result in report.items():
+            print(f"{name}: removed {result['deleted']} rows in {result['batches']} batches "
+                  f"({result['seconds']:.2f}s)")
+    
+    @app.cli.command('delete-accounts')
+    @click.option('--retry-failed', 'retry_failed_jobs', is_flag=True, help='Retry jobs that ran out of attempts first.')
+    def delete_accounts_command(retry_failed_jobs):
+        """Run pending account deletions, including ones abandoned by a worker that died."""
+        if retry_failed_jobs:
+            print(f'Retrying {retry_failed()} failed deletions')
+        finished = deletions.run_pending()
+        print(f'Deleted {finished} accounts')
+    
+    @app.cli.command('move-user')
+    @click.argument('user')
+    @click.argument('shard', type=int)
+    @click.option('--abort', is_flag=True, help="Abort the user's unfinished move instead.")
+    def move_user_command(user, shard, abort):
+        """Move USER (id or email) and their rows to SHARD online, resuming an interrupted move."""
+        found = User.query.filter((User.id == user) | (User.email == user)).first()
+        if found is None:
+            raise click.ClickException(f'No user {user}')
         try:
-            user_id = get_jwt_identity()
-            user = User.query.get(user_id)
-            if user and user.is_active:
-                return user
-        except:
-            pass
-        return None
+            if abort:
+                move = abort_move(found.id, log=print)
+                print(f'Aborted move to shard {move.target}' if move else 'No move in progress')
+                return
+            move = move_user(found.id, shard, log=print)
+        except ValueError as e:
+            raise click.ClickException(str(e))
+        print(f'Moved to shard {shard}: {move.copied}' if move else f'Already on shard {shard}')
+    
+    @app.cli.command('rebalance-shards')
+    @click.option('--limit', type=int, default=None, help='Move at most this many users.')
+    @click.option('--batch-size', type=int, default=50, help='Users moved together, sharing each settle wait.')
+    @click.option('--dry-run', is_flag=True, help='List the users that would move without moving them.')
+    def rebalance_shards_command(limit, batch_size, dry_run):
+        """Move users whose shard differs from the placement for the configured shards."""
+        moved = rebalance(limit=limit, batch_size=batch_size, dry_run=dry_run, log=print)
+        print(f'{"Would move" if dry_run else "Moved"} {moved} users')
     
     # Auth endpoints
     @app.route('/api/auth/register', methods=['POST'])
@@ -48,10 +225,15 @@ def create_app(config_name='development'):
         except Exception as e:
             return jsonify({'error': str(e)}), 400
         
-        user, error = register_user(data['email'], data['password'], data.get('name'))
+        try:
+            user, error = register_user(data['email'], data['password'], data.get('name'))
+        except PasswordHashingBusy:
+            return jsonify({'error': 'Server busy, please retry'}), 503, {'Retry-After': '1'}
         if error:
             return jsonify({'error': error}), 400
         
+        # Also keeps the new user's first reads on the primary
+        bump_versions(user.id, 'user')
         access_token, refresh_token = create_tokens(user.id)
         app.logger.info(f'User registered: {user.email}')
         
@@ -72,7 +254,10 @@ def create_app(config_name='development'):
         except Exception as e:
             return jsonify({'error': str(e)}), 400
         
-        user = authenticate_user(data['email'], data['password'])
+        try:
+            user = authenticate_user(data['email'], data['password'])
+        except PasswordHashingBusy:
+            return jsonify({'error': 'Server busy, please retry'}), 503, {'Retry-After': '1'}
         if not user:
             return jsonify({'error': 'Invalid credentials'}), 401
         
@@ -85,21 +270,76 @@ def create_app(config_name='development'):
             'user': user.to_dict(),
         }), 200
     
+    @app.route('/api/auth/refresh', methods=['POST'])
+    @jwt_required(refresh=True)
+    def refresh():
+        # Refresh tokens outlive access tokens; a deactivated or deleted account gets no new ones
+        if load_current_user() is None:
+            return jsonify({'error': 'Unauthorized'}), 401
+        access_token = create_access_token(
+            identity=get_jwt_identity(),
+            expires_delta=timedelta(hours=app.config.get('JWT_ACCESS_TOKEN_EXPIRES', 1)),
+        )
+        return jsonify({'access_token': access_token}), 200
+    
+    def body_refresh_token():
+        """Decoded refresh_token from the JSON body: None if absent, False if not a valid refresh token"""
+        data = request.get_json(silent=True)
+        encoded = data.get('refresh_token') if isinstance(data, dict) else None
+        if not encoded:
+            return None
+        try:
+            payload = decode_token(encoded)
+        except Exception:
+            return False
+        return payload if payload.get('type') == 'refresh' else False
+    
     @app.route('/api/auth/logout', methods=['POST'])
     def logout():
-        # Token is invalidated on client side (removed from secure storage)
-        return jsonify({'message': 'Logged out successfully'}), 200
+        # The client also drops its tokens; revoking them stops copies working elsewhere.
+        # Either token is enough on its own: the bearer token (access or refresh) and a
+        # refresh_token in the body are each revoked if still valid, so a refresh token
+        # can still be revoked once its access token has expired. Clients log out
+        # unconditionally, so this always answers 200 and says how many were revoked.
+        payloads = []
+        auth_header = request.headers.get('Authorization', '')
+        if auth_header.startswith('Bearer '):
+            try:
+                payloads.append(decode_token(auth_header[len('Bearer '):].strip()))
+            except Exception:
+                pass
+        refresh_payload = body_refresh_token()
+        if refresh_payload:
+            payloads.append(refresh_payload)
+        revoked = sum(1 for payload in payloads if revoke_token(payload))
+        if not revoked:
+            return jsonify({'message': 'Logged out; no token was revoked', 'revoked': 0}), 200
+        app.logger.info(f'{revoked} token(s) revoked for user {payloads[0].get("sub")}')
+        return jsonify({'message': 'Logged out successfully', 'revoked': revoked}), 200
     
     # Alert endpoints
     @app.route('/api/alerts', methods=['GET'])
     @jwt_required()
+    @read_only
     def get_alerts():
         user = get_current_user()
         if not user:
             return jsonify({'error': 'Unauthorized'}), 401
         
-        alerts = Alert.query.filter_by(user_id=user.id).order_by(Alert.created_at.desc()).all()
-        return jsonify(alerts_schema.dump(alerts)), 200
+        try:
+            limit, position = parse_page_args(request.args)
+            shape = parse_fields(request.args, ALERT_SHAPE)
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        
+        etag = resource_etag(user.id, 'alerts')
+        cached = not_modified(etag)
+        if cached:
+            return cached
+        
+        query = Alert.query.with_entities(*shape.columns_with('created_at', 'id')).filter_by(user_id=user.id)
+        rows, next_cursor = keyset_page(query, Alert, limit, position)
+        return jsonify(shape.dump_rows(rows)), 200, {**page_headers(next_cursor), **etag_headers(etag)}
     
     @app.route('/api/alerts', methods=['POST'])
     @jwt_required()
@@ -110,11 +350,11 @@ def create_app(config_name='development'):
         
         data = request.get_json()
         
+        if isinstance(data, dict) and data.get('type') == 'panic':
+            return raise_panic_alert(user, data)
+        
         try:
-            if data.get('type') == 'panic':
-                errors = panic_alert_schema.validate(data)
-            else:
-                errors = alert_schema.validate(data)
+            errors = alert_schema.validate(data)
             if errors:
                 return jsonify({'error': errors}), 400
         except Exception as e:
@@ -129,36 +369,139 @@ def create_app(config_name='development'):
         )
         
         db.session.add(alert)
+        record_audit(user.id, 'created_alert', 'alert', alert.id,
+                     {'type': alert.alert_type, 'risk_level': alert.risk_level})
         db.session.commit()
+        bump_versions(user.id, 'alerts')
+        publish_alert_event(user.id, 'alert', alert)
+        notify_contacts(user.id, alert)
         
-        # Log the action
-        audit = AuditLog(
-            id=generate_id(),
+        app.logger.info(f'Alert created for user {user.email}: {alert.alert_type}')
+        
+        return jsonify(alert.to_dict()), 201
+    
+    @app.route('/api/alerts/stream', methods=['GET'])
+    @jwt_required()
+    def stream_alerts():
+        user = get_current_user()
+        if not user:
+            return jsonify({'error': 'Unauthorized'}), 401
+        
+        broker = app.extensions['event_broker']
+        if broker.connections >= broker.max_connections:
+            return jsonify({'error': 'Too many open streams, please retry'}), 503, {'Retry-After': '5'}
+        
+        last_event_id = request.headers.get('Last-Event-ID') or request.args.get('lastEventId')
+        revocations = app.extensions.get('revocations')
+        claims = get_jwt()
+        stream = event_stream(
+            broker, user.id, last_event_id,
+            heartbeat=app.config.get('STREAM_HEARTBEAT_SECONDS', 15),
+            expires_at=claims.get('exp'),
+            revoked=(lambda: revocations.is_revoked(claims['jti'])) if revocations else None,
+        )
+        # The stream never touches the database; don't hold a connection open for it
+        db.session.close()
+        
+        return Response(stream, mimetype='text/event-stream', headers={
+            'Cache-Control': 'no-cache',
+            'X-Accel-Buffering': 'no',
+        })
+    
+    @app.route('/api/alerts/panic', methods=['POST'])
+    @jwt_required()
+    def create_panic_alert():
+        user = get_current_user()
+        if not user:
+            return jsonify({'error': 'Unauthorized'}), 401
+        
+        data = request.get_json(silent=True)
+        return raise_panic_alert(user, data if isinstance(data, dict) else {})
+    
+    def raise_panic_alert(user, data):
+        """Panic fast path: inline validation, alert and audit row in one commit, idempotent retries"""
+        # Defaults as declared by PanicAlertSchema
+        risk_level = data.get('riskLevel', 0.95)
+        signals = data.get('signals', ['manual_activation'])
+        if isinstance(risk_level, bool) or not isinstance(risk_level, (int, float)) or not 0.0 <= risk_level <= 1.0:
+            return jsonify({'error': {'riskLevel': ['Must be a number between 0.0 and 1.0.']}}), 400
+        if not isinstance(signals, list) or not all(isinstance(s, str) for s in signals):
+            return jsonify({'error': {'signals': ['Must be a list of strings.']}}), 400
+        
+        key = request.headers.get('Idempotency-Key')
+        if not idempotency.valid_key(key):
+            return jsonify({'error': 'Idempotency-Key must be 1-255 characters'}), 400
+        if key:
+            try:
+                earlier = idempotency.begin(user.id, key)
+            except IdempotencyConflict:
+                return jsonify({'error': 'A request with this Idempotency-Key is in progress'}), 409, {'Retry-After': '1'}
+            if earlier is not None:
+                return Response(earlier, 201, mimetype='application/json', headers={'Idempotent-Replayed': 'true'})
+        
+        now = datetime.utcnow()
+        alert = Alert(
+            id=idempotency.idempotent_id(user.id, key) if key else generate_id(),
             user_id=user.id,
-            action=f'created_alert',
-            resource_type='alert',
-            resource_id=alert.id,
-            details={'type': alert.alert_type, 'risk_level': alert.risk_level},
+            risk_level=float(risk_level),
+            alert_type='panic',
+            signals=signals,
+            created_at=now,
+            updated_at=now,
         )
-        db.session.add(audit)
-        db.session.commit()
+        replayed = False
+        try:
+            db.session.add(alert)
+            record_audit(user.id, 'created_alert', 'alert', alert.id,
+                         {'type': 'panic', 'risk_level': alert.risk_level}, durability='transaction')
+            db.session.commit()
+        except IntegrityError:
+            # Another worker committed this key's alert first
+            db.session.rollback()
+            alert = db.session.get(Alert, alert.id)
+            if alert is None or alert.user_id != user.id:
+                if key:
+                    idempotency.abandon(user.id, key)
+                raise
+            replayed = True
+        except Exception:
+            db.session.rollback()
+            if key:
+                idempotency.abandon(user.id, key)
+            raise
         
-        app.logger.info(f'Alert created for user {user.email}: {alert.alert_type}')
+        body = app.json.dumps(alert.to_dict())
+        if key:
+            idempotency.finish(user.id, key, body)
+        if replayed:
+            return Response(body, 201, mimetype='application/json', headers={'Idempotent-Replayed': 'true'})
         
-        return jsonify(alert.to_dict()), 201
+        bump_versions(user.id, 'alerts')
+        publish_alert_event(user.id, 'alert', alert)
+        notify_contacts(user.id, alert)
+        # Arguments rather than an f-string: formatted only if the record is emitted
+        app.logger.warning('Panic alert %s raised for user %s', alert.id, user.id)
+        
+        return Response(body, 201, mimetype='application/json')
     
     @app.route('/api/alerts/<alert_id>', methods=['GET'])
     @jwt_required()
+    @read_only
     def get_alert(alert_id):
         user = get_current_user()
         if not user:
             return jsonify({'error': 'Unauthorized'}), 401
         
-        alert = Alert.query.filter_by(id=alert_id, user_id=user.id).first()
-        if not alert:
+        try:
+            shape = parse_fields(request.args, ALERT_SHAPE)
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        
+        row = Alert.query.with_entities(*shape.columns).filter_by(id=alert_id, user_id=user.id).first()
+        if not row:
             return jsonify({'error': 'Alert not found'}), 404
         
-        return jsonify(alert.to_dict()), 200
+        return jsonify(shape.dump_row(row)), 200
     
     @app.route('/api/alerts/<alert_id>/acknowledge', methods=['PUT'])
     @jwt_required()
@@ -173,7 +516,10 @@ def create_app(config_name='development'):
         
         alert.acknowledged = True
         alert.updated_at = datetime.utcnow()
+        record_audit(user.id, 'acknowledged_alert', 'alert', alert.id)
         db.session.commit()
+        bump_versions(user.id, 'alerts')
+        publish_alert_event(user.id, 'acknowledged', alert)
         
         return jsonify(alert.to_dict()), 200
     
@@ -187,6 +533,11 @@ def create_app(config_name='development'):
         
         data = request.get_json()
         
+        # Refused before validation; unknown categories fail validation below
+        scope = missing_scope(consent_snapshot(user.id), data.get('category') if isinstance(data, dict) else None)
+        if scope:
+            return jsonify({'error': f'No consent for {scope}'}), 403
+        
         try:
             errors = signal_schema.validate(data)
             if errors:
@@ -194,51 +545,197 @@ def create_app(config_name='development'):
         except Exception as e:
             return jsonify({'error': str(e)}), 400
         
-        signal = Signal(
-            id=generate_id(),
-            user_id=user.id,
-            category=data.get('category'),
-            signal_type=data.get('type'),
-            confidence=data.get('confidence', 0.0),
-            metadata=data.get('metadata'),
-        )
-        
-        db.session.add(signal)
+        row = signal_store().add(user.id, [data], datetime.utcnow())[0]
+        rollups.add_signals(user.id, [row])
+        passive_alert = record_signals(user.id, [(row[0], row[1], row[3], row[5])])
         db.session.commit()
+        bump_versions(user.id, 'signals', *(['alerts'] if passive_alert else []))
+        
+        if passive_alert:
+            publish_alert_event(user.id, 'alert', passive_alert)
+            notify_contacts(user.id, passive_alert)
+            app.logger.info(f'Passive alert raised for user {user.email}: {passive_alert.risk_level}')
         
-        app.logger.info(f'Signal created for user {user.email}: {signal.signal_type}')
+        app.logger.info(f'Signal created for user {user.email}: {row[2]}')
         
-        return jsonify(signal.to_dict()), 201
+        return jsonify(SIGNAL_SHAPE.dump_row(row)), 201
+    
+    @app.route('/api/signals/batch', methods=['POST'])
+    @jwt_required()
+    def create_signals_batch():
+        user = get_current_user()
+        if not user:
+            return jsonify({'error': 'Unauthorized'}), 401
+        
+        data = request.get_json(silent=True) or {}
+        items = data.get('signals') if isinstance(data, dict) else None
+        if not isinstance(items, list) or not items:
+            return jsonify({'error': 'signals must be a non-empty list'}), 400
+        
+        max_batch = app.config.get('SIGNAL_BATCH_MAX', 500)
+        if len(items) > max_batch:
+            return jsonify({'error': f'At most {max_batch} signals per batch'}), 400
+        
+        granted = consent_snapshot(user.id)
+        errors, allowed = {}, []
+        for index, item in enumerate(items):
+            scope = missing_scope(granted, item.get('category') if isinstance(item, dict) else None)
+            if scope:
+                errors[index] = {'category': [f'No consent for {scope}']}
+            else:
+                allowed.append((index, item))
+        if not allowed:
+            return jsonify({'error': errors}), 403
+        
+        try:
+            invalid = signals_schema.validate([item for _, item in allowed])
+        except Exception as e:
+            return jsonify({'error': str(e)}), 400
+        
+        valid = []
+        for position, (index, item) in enumerate(allowed):
+            if position in invalid:
+                errors[index] = invalid[position]
+            else:
+                valid.append(item)
+        if not valid:
+            return jsonify({'error': errors}), 400
+        
+        try:
+            rows = signal_store().add(user.id, valid, datetime.utcnow())
+            rollups.add_signals(user.id, rows)
+            passive_alert = record_signals(user.id, [(row[0], row[1], row[3], row[5]) for row in rows])
+            db.session.commit()
+            bump_versions(user.id, 'signals', *(['alerts'] if passive_alert else []))
+        except Exception as e:
+            db.session.rollback()
+            app.logger.error(f'Signal batch insert failed for user {user.id}: {str(e)}')
+            return jsonify({'error': 'Could not store signals'}), 500
+        
+        app.logger.info(f'{len(rows)} signals created for user {user.email}')
+        if passive_alert:
+            publish_alert_event(user.id, 'alert', passive_alert)
+            notify_contacts(user.id, passive_alert)
+            app.logger.info(f'Passive alert raised for user {user.email}: {passive_alert.risk_level}')
+        
+        return jsonify({
+            'created': [row[0] for row in rows],
+            'errors': {str(index): error for index, error in sorted(errors.items())},
+        }), 201
     
     @app.route('/api/signals', methods=['GET'])
     @jwt_required()
+    @read_only
     def get_signals():
         user = get_current_user()
         if not user:
             return jsonify({'error': 'Unauthorized'}), 401
         
-        signals = Signal.query.filter_by(user_id=user.id).order_by(Signal.created_at.desc()).all()
-        return jsonify(signals_schema.dump(signals)), 200
+        try:
+            limit, position = parse_page_args(request.args)
+            shape = parse_fields(request.args, SIGNAL_SHAPE)
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        
+        etag = resource_etag(user.id, 'signals')
+        cached = not_modified(etag)
+        if cached:
+            return cached
+        
+        rows, next_cursor = signal_store().page(user.id, limit, position, shape)
+        return jsonify(shape.dump_rows(rows)), 200, {**page_headers(next_cursor), **etag_headers(etag)}
+    
+    @app.route('/api/signals/summary', methods=['GET'])
+    @jwt_required()
+    @read_only
+    def get_signal_summary():
+        user = get_current_user()
+        if not user:
+            return jsonify({'error': 'Unauthorized'}), 401
+        
+        granularity = request.args.get('bucket', 'hour')
+        if granularity not in rollups.GRANULARITIES:
+            return jsonify({'error': 'bucket must be hour or day'}), 400
+        try:
+            end = parse_summary_time(request.args.get('to')) or datetime.utcnow()
+            start = parse_summary_time(request.args.get('from'))
+        except ValueError:
+            return jsonify({'error': 'from and to must be ISO 8601 timestamps'}), 400
+        if start is None:
+            start = end - (timedelta(days=1) if granularity == 'hour' else timedelta(days=30))
+        start = rollups.bucket_start(start, granularity)
+        if start >= end:
+            return jsonify({'error': 'from must be before to'}), 400
+        if granularity == 'hour':
+            max_range = timedelta(hours=app.config.get('SUMMARY_MAX_HOURS', 744))
+        else:
+            max_range = timedelta(days=app.config.get('SUMMARY_MAX_DAYS', 366))
+        if end - start > max_range:
+            return jsonify({'error': f'At most {max_range.days} days per {granularity} summary'}), 400
+        
+        # Without from/to the window moves with the clock: tag the buckets it covers
+        window = f'{start.isoformat()}/{rollups.bucket_start(end, granularity).isoformat()}'
+        etag = resource_etag(user.id, 'signals', window)
+        cached = not_modified(etag)
+        if cached:
+            return cached
+        
+        buckets = {}
+        for bucket, category, count, confidence_sum in rollups.summary(user.id, granularity, start, end):
+            entry = buckets.setdefault(bucket, {'start': bucket.isoformat(), 'count': 0, 'meanConfidence': 0.0,
+                                                'categories': {}})
+            entry['categories'][category] = {'count': count, 'meanConfidence': round(confidence_sum / count, 4)}
+            entry['meanConfidence'] += confidence_sum
+            entry['count'] += count
+        for entry in buckets.values():
+            entry['meanConfidence'] = round(entry['meanConfidence'] / entry['count'], 4)
+        
+        return jsonify({
+            'bucket': granularity,
+            'from': start.isoformat(),
+            'to': end.isoformat(),
+            'buckets': list(buckets.values()),
+        }), 200, etag_headers(etag)
+    
+    def parse_summary_time(value):
+        """Naive UTC datetime from an ISO 8601 query parameter (None if absent)"""
+        if not value:
+            return None
+        moment = datetime.fromisoformat(value)
+        if moment.tzinfo is not None:
+            moment = moment.astimezone(timezone.utc).replace(tzinfo=None)
+        return moment
     
     # User consent endpoints
     @app.route('/api/user/consent', methods=['GET'])
     @jwt_required()
+    @read_only
     def get_consent():
         user = get_current_user()
         if not user:
             return jsonify({'error': 'Unauthorized'}), 401
         
+        try:
+            shape = parse_fields(request.args, CONSENT_SHAPE)
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        
+        etag = resource_etag(user.id, 'consent')
+        cached = not_modified(etag)
+        if cached:
+            return cached
+        
         consent = ConsentRecord.query.filter_by(user_id=user.id).first()
         if not consent:
-            # Create default consent record
-            consent = ConsentRecord(
-                id=generate_id(),
-                user_id=user.id,
-            )
-            db.session.add(consent)
-            db.session.commit()
+            # The replica may just be behind; only the primary can say it's missing
+            use_primary()
+            consent = ConsentRecord.query.filter_by(user_id=user.id).first()
+        if not consent:
+            # Registration creates the record; report the defaults without writing one
+            consent = default_consent(user.id)
+            consent.id = None
         
-        return jsonify(consent.to_dict()), 200
+        return jsonify(shape.dump(consent)), 200, etag_headers(etag)
     
     @app.route('/api/user/consent', methods=['PUT'])
     @jwt_required()
@@ -251,10 +748,7 @@ def create_app(config_name='development'):
         
         consent = ConsentRecord.query.filter_by(user_id=user.id).first()
         if not consent:
-            consent = ConsentRecord(
-                id=generate_id(),
-                user_id=user.id,
-            )
+            consent = default_consent(user.id)
             db.session.add(consent)
         
         if 'passive_detection' in data:
@@ -267,7 +761,11 @@ def create_app(config_name='development'):
             consent.emergency_sharing = data['emergency_sharing']
         
         consent.updated_at = datetime.utcnow()
+        record_audit(user.id, 'updated_consent', 'consent', consent.id, consent_schema.dump(consent))
         db.session.commit()
+        # The version bump also retires other workers' consent snapshots
+        invalidate_consent(user.id)
+        bump_versions(user.id, 'consent')
         
         app.logger.info(f'Consent updated for user {user.email}')
         
@@ -276,12 +774,23 @@ def create_app(config_name='development'):
     # User profile endpoints
     @app.route('/api/user', methods=['GET'])
     @jwt_required()
+    @read_only
     def get_user():
         user = get_current_user()
         if not user:
             return jsonify({'error': 'Unauthorized'}), 401
         
-        return jsonify(user.to_dict()), 200
+        try:
+            shape = parse_fields(request.args, USER_SHAPE)
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        
+        etag = resource_etag(user.id, 'user')
+        cached = not_modified(etag)
+        if cached:
+            return cached
+        
+        return jsonify(shape.dump(user)), 200, etag_headers(etag)
     
     @app.route('/api/user', methods=['PUT'])
     @jwt_required()
@@ -296,27 +805,253 @@ def create_app(config_name='development'):
             user.name = data['name']
         
         user.updated_at = datetime.utcnow()
+        record_audit(user.id, 'updated_profile', 'user', user.id)
         db.session.commit()
+        invalidate_user(user.id)
+        bump_versions(user.id, 'user')
         
         app.logger.info(f'User profile updated: {user.email}')
         
         return jsonify(user.to_dict()), 200
     
+    @app.route('/api/user', methods=['DELETE'])
+    @jwt_required()
+    def delete_user():
+        user = get_current_user()
+        if not user:
+            return jsonify({'error': 'Unauthorized'}), 401
+        
+        # A borrowed or stolen session must not be enough to wipe the account
+        data = request.get_json(silent=True)
+        password = data.get('password') if isinstance(data, dict) else None
+        if not password:
+            return jsonify({'error': 'password is required'}), 400
+        try:
+            if not user.check_password(password):
+                return jsonify({'error': 'Invalid credentials'}), 401
+        except PasswordHashingBusy:
+            return jsonify({'error': 'Server busy, please retry'}), 503, {'Retry-After': '1'}
+        
+        user_id, email = user.id, user.email
+        refresh_payload = body_refresh_token()
+        if refresh_payload is False or (refresh_payload and refresh_payload.get('sub') != user.id):
+            return jsonify({'error': 'Invalid refresh token'}), 400
+        
+        job = request_deletion(user)
+        revoke_token(get_jwt())
+        if refresh_payload:
+            revoke_token(refresh_payload)
+        # Inactive from here on, so every other token is refused too
+        invalidate_user(user_id)
+        invalidate_consent(user_id)
+        bump_versions(user_id, *RESOURCES)
+        deletions.submit()
+        
+        app.logger.info(f'Account deletion {job.id} requested for user {email}')
+        
+        return jsonify(job.to_dict()), 202, {'Location': f'/api/user/deletions/{job.id}'}
+    
+    @app.route('/api/user/deletions/<job_id>', methods=['GET'])
+    def get_account_deletion(job_id):
+        # Unauthenticated: the account can't sign in any more. The id is unguessable
+        # and the response carries only progress, no personal data
+        job = db.session.get(AccountDeletion, job_id)
+        if not job:
+            return jsonify({'error': 'Deletion not found'}), 404
+        return jsonify(job.to_dict()), 200
+    
+    # Emergency contact endpoints
+    @app.route('/api/contacts', methods=['GET'])
+    @jwt_required()
+    @read_only
+    def get_contacts():
+        user = get_current_user()
+        if not user:
+            return jsonify({'error': 'Unauthorized'}), 401
+        
+        try:
+            shape = parse_fields(request.args, CONTACT_SHAPE)
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        
+        etag = resource_etag(user.id, 'contacts')
+        cached = not_modified(etag)
+        if cached:
+            return cached
+        
+        rows = (
+            EmergencyContact.query.with_entities(*shape.columns)
+            .filter_by(user_id=user.id)
+            .order_by(EmergencyContact.created_at, EmergencyContact.id)
+            .all()
+        )
+        return jsonify(shape.dump_rows(rows)), 200, etag_headers(etag)
+    
+    @app.route('/api/contacts', methods=['POST'])
+    @jwt_required()
+    def create_contact():
+        user = get_current_user()
+        if not user:
+            return jsonify({'error': 'Unauthorized'}), 401
+        
+        data = request.get_json()
+        
+        try:
+            errors = emergency_contact_schema.validate(data)
+            if errors:
+                return jsonify({'error': errors}), 400
+        except Exception as e:
+            return jsonify({'error': str(e)}), 400
+        if not data.get('phone') and not data.get('email'):
+            return jsonify({'error': 'A contact needs a phone number or an email address'}), 400
+        
+        max_contacts = app.config.get('CONTACTS_MAX', 10)
+        if EmergencyContact.query.filter_by(user_id=user.id).count() >= max_contacts:
+            return jsonify({'error': f'At most {max_contacts} emergency contacts'}), 400
+        
+        contact = EmergencyContact(
+            id=generate_id(),
+            user_id=user.id,
+            name=data['name'],
+            phone=data.get('phone'),
+            email=data.get('email'),
+            relationship=data.get('relationship'),
+            is_advocate=data.get('is_advocate', False),
+        )
+        
+        db.session.add(contact)
+        record_audit(user.id, 'created_contact', 'emergency_contact', contact.id)
+        db.session.commit()
+        bump_versions(user.id, 'contacts')
+        
+        app.logger.info(f'Emergency contact added for user {user.email}')
+        
+        return jsonify(contact.to_dict()), 201
+    
+    @app.route('/api/contacts/<contact_id>', methods=['GET'])
+    @jwt_required()
+    @read_only
+    def get_contact(contact_id):
+        user = get_current_user()
+        if not user:
+            return jsonify({'error': 'Unauthorized'}), 401
+        
+        try:
+            shape = parse_fields(request.args, CONTACT_SHAPE)
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        
+        row = EmergencyContact.query.with_entities(*shape.columns).filter_by(id=contact_id, user_id=user.id).first()
+        if not row:
+            return jsonify({'error': 'Contact not found'}), 404
+        
+        return jsonify(shape.dump_row(row)), 200
+    
+    @app.route('/api/contacts/<contact_id>', methods=['PUT'])
+    @jwt_required()
+    def update_contact(contact_id):
+        user = get_current_user()
+        if not user:
+            return jsonify({'error': 'Unauthorized'}), 401
+        
+        data = request.get_json()
+        
+        try:
+            errors = emergency_contact_schema.validate(data, partial=True)
+            if errors:
+                return jsonify({'error': errors}), 400
+        except Exception as e:
+            return jsonify({'error': str(e)}), 400
+        
+        contact = EmergencyContact.query.filter_by(id=contact_id, user_id=user.id).first()
+        if not contact:
+            return jsonify({'error': 'Contact not found'}), 404
+        
+        for field in ('name', 'phone', 'email', 'relationship', 'is_advocate'):
+            if field in data:
+                setattr(contact, field, data[field])
+        if not contact.phone and not contact.email:
+            db.session.rollback()
+            return jsonify({'error': 'A contact needs a phone number or an email address'}), 400
+        
+        record_audit(user.id, 'updated_contact', 'emergency_contact', contact.id)
+        db.session.commit()
+        bump_versions(user.id, 'contacts')
+        
+        return jsonify(contact.to_dict()), 200
+    
+    @app.route('/api/contacts/<contact_id>', methods=['DELETE'])
+    @jwt_required()
+    def delete_contact(contact_id):
+        user = get_current_user()
+        if not user:
+            return jsonify({'error': 'Unauthorized'}), 401
+        
+        contact = EmergencyContact.query.filter_by(id=contact_id, user_id=user.id).first()
+        if not contact:
+            return jsonify({'error': 'Contact not found'}), 404
+        
+        db.session.delete(contact)
+        record_audit(user.id, 'deleted_contact', 'emergency_contact', contact_id)
+        db.session.commit()
+        bump_versions(user.id, 'contacts')
+        
+        return jsonify({'message': 'Contact deleted'}), 200
+    
+    @app.route('/api/user/export', methods=['GET'])
+    @jwt_required()
+    def export_user_data():
+        user = get_current_user()
+        if not user:
+            return jsonify({'error': 'Unauthorized'}), 401
+        
+        compress = request.args.get('gzip', '').lower() in ('1', 'true', 'yes')
+        filename = 'havenapp-export.ndjson.gz' if compress else 'havenapp-export.ndjson'
+        chunks = iter_export(user, app.config.get('EXPORT_CHUNK_SIZE', 1000), compress)
+        
+        app.logger.info(f'Data export started for user {user.email}')
+        
+        return Response(
+            stream_with_context(chunks),
+            mimetype='application/gzip' if compress else 'application/x-ndjson',
+            headers={'Content-Disposition': f'attachment; filename={filename}'},
+        )
+    
     # Health check
     @app.route('/api/health', methods=['GET'])
     def health_check():
-        return jsonify({'status': 'healthy', 'timestamp': datetime.utcnow().isoformat()}), 200
+        return jsonify({
+            'status': 'healthy',
+            'timestamp': datetime.utcnow().isoformat(),
+            'audit': audit_stats(),
+            'user_cache': user_cache_stats(),
+            'consent_cache': consent_cache_stats(),
+            'revocations': revocation_stats(),
+            'password_hashing': password_hashing_stats(),
+            'event_stream': event_stats(),
+            'notifications': notification_stats(),
+            'account_deletion': account_deletion_stats(),
+            'compression': compression_stats(),
+        }), 200
     
     # Error handlers
     @app.errorhandler(404)
     def not_found(error):
         return jsonify({'error': 'Not found'}), 404
     
+    @app.errorhandler(ShardMoveInProgress)
+    def shard_move_in_progress(error):
+        return jsonify({'error': 'Account data is being moved, please retry shortly'}), 503, {'Retry-After': '5'}
+    
     @app.errorhandler(500)
     def internal_error(error):
         app.logger.error(f'Internal server error: {str(error)}')
         return jsonify({'error': 'Internal server error'}), 500
     
+    app.extensions['startup'] = {
+        'import': round(_import_seconds, 4),
+        'create_app': round(time.perf_counter() - started, 4),
+    }
     return app
 
 
@@ -0,0 +1,244 @@
+"""HavenApp Backend - Audit logging
+
+Routes call record_audit() for every mutating action. How the row reaches
+the database is set by AUDIT_DURABILITY:
+
+- 'transaction': added to the caller's session and committed atomically with
+  the change it describes (no extra round trip)
+- 'sync': written and committed in its own transaction as soon as the
+  caller's commit succeeds, before the response
+- 'async': queued, once the caller's commit succeeds, for a background
+  writer that flushes multi-row inserts when AUDIT_BATCH_SIZE rows are
+  waiting or every AUDIT_FLUSH_INTERVAL seconds, whichever comes first
+
+'sync' and 'async' rows wait in the caller's session until its after_commit
+event and are dropped if it rolls back instead, so an entry never records a
+change that didn't happen.
+
+audit_logs is sharded (see database.py): rows go to the shard chosen for the
+request, and the async writer queues each row with its shard and flushes one
+insert per shard.
+"""
+import atexit
+import logging
+import os
+import queue
+import threading
+import time
+from datetime import datetime
+from flask import current_app
+from sqlalchemy import event, insert
+from sqlalchemy.orm import Session
+
+from models import db, AuditLog
+from database import current_shard, shard_bind, shard_engine
+from ids import generate_id
+
+DURABILITY_MODES = ('sync', 'transaction', 'async')
+
+# Queued by stop() to wake the writer thread without waiting out its timeout
+_WAKE = object()
+
+logger = logging.getLogger(__name__)
+
+
+class AuditWriter:
+    """Bounded in-process queue drained by a background thread in batches"""
+
+    def __init__(self, batch_size=200, flush_interval=1.0, max_queue=10000):
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._lock = threading.Lock()
+        self._stopping = threading.Event()
+        self._thread = None
+        self._pid = None
+        self._engines = {}
+        self.enqueued = 0
+        self.written = 0
+        self.dropped = 0
+        self.failed = 0
+        self.flushes = 0
+
+    def submit(self, row, shard=None):
+        """Queue one audit row for shard; returns False (and counts a drop) if the queue is full"""
+        self._ensure_started()
+        try:
+            self._queue.put_nowait((shard, row))
+        except queue.Full:
+            with self._lock:
+                self.dropped += 1
+            return False
+        with self._lock:
+            self.enqueued += 1
+        return True
+
+    def _ensure_started(self):
+        # Threads don't survive a fork, so each gunicorn worker starts its own
+        if self._thread is not None and self._pid == os.getpid() and self._thread.is_alive():
+            return
+        with self._lock:
+            if self._thread is not None and self._pid == os.getpid() and self._thread.is_alive():
+                return
+            self._engines = dict(db.engines)
+            self._pid = os.getpid()
+            self._stopping.clear()
+            self._thread = threading.Thread(target=self._run, name='audit-writer', daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        while not (self._stopping.is_set() and self._queue.empty()):
+            try:
+                item = self._queue.get(timeout=self.flush_interval)
+            except queue.Empty:
+                continue
+            if item is _WAKE:
+                continue
+
+            # Collect until the batch is full or the first row has waited flush_interval
+            batch = [item]
+            deadline = time.monotonic() + self.flush_interval
+            while len(batch) < self.batch_size:
+                remaining = 0 if self._stopping.is_set() else deadline - time.monotonic()
+                try:
+                    item = self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                if item is not _WAKE:
+                    batch.append(item)
+            self._flush(batch)
+
+    def _flush(self, batch):
+        by_shard = {}
+        for shard, row in batch:
+            by_shard.setdefault(shard, []).append(row)
+        for shard, rows in by_shard.items():
+            try:
+                with self._engines[shard_bind(shard)].begin() as conn:
+                    conn.execute(insert(AuditLog.__table__), rows)
+            except Exception as e:
+                logger.error(f'Audit flush of {len(rows)} rows failed: {str(e)}')
+                with self._lock:
+                    self.failed += len(rows)
+                continue
+            with self._lock:
+                self.written += len(rows)
+                self.flushes += 1
+
+    def stop(self, timeout=5.0):
+        """Flush everything still queued and stop the writer thread"""
+        thread = self._thread
+        if thread is None or self._pid != os.getpid():
+            return
+        self._stopping.set()
+        try:
+            self._queue.put_nowait(_WAKE)
+        except queue.Full:
+            pass
+        thread.join(timeout)
+        # Anything that arrived after the thread exited is flushed inline
+        leftover = []
+        while True:
+            try:
+                item = self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if item is not _WAKE:
+                leftover.append(item)
+        if leftover:
+            self._flush(leftover)
+        self._thread = None
+
+    def stats(self):
+        with self._lock:
+            return {
+                'queue_depth': self._queue.qsize(),
+                'enqueued': self.enqueued,
+                'written': self.written,
+                'dropped': self.dropped,
+                'failed': self.failed,
+                'flushes': self.flushes,
+            }
+
+
+def init_audit(app):
+    """Attach the audit writer for this app and drain it at interpreter exit"""
+    mode = app.config.get('AUDIT_DURABILITY', 'transaction')
+    if mode not in DURABILITY_MODES:
+        raise ValueError(f'AUDIT_DURABILITY must be one of {", ".join(DURABILITY_MODES)}')
+
+    writer = AuditWriter(
+        batch_size=app.config.get('AUDIT_BATCH_SIZE', 200),
+        flush_interval=app.config.get('AUDIT_FLUSH_INTERVAL', 1.0),
+        max_queue=app.config.get('AUDIT_QUEUE_SIZE', 10000),
+    )
+    app.extensions['audit_writer'] = writer
+    atexit.register(writer.stop)
+    return writer
+
+
+def _write_pending(session):
+    pending = session.info.pop('audit_pending', None)
+    for write in pending or ():
+        try:
+            write()
+        except Exception as e:
+            # The change itself is committed; failing its request now would misreport it
+            logger.error(f'Audit write after commit failed: {str(e)}')
+
+
+def _drop_pending(session):
+    session.info.pop('audit_pending', None)
+
+
+_listening = False
+
+
+def _listen_for_commits():
+    global _listening
+    if not _listening:
+        event.listen(Session, 'after_commit', _write_pending)
+        event.listen(Session, 'after_rollback', _drop_pending)
+        _listening = True
+
+
+def _on_commit(write):
+    """Run write() once the caller's current transaction commits"""
+    _listen_for_commits()
+    db.session().info.setdefault('audit_pending', []).append(write)
+
+
+def _write_sync(engine, row):
+    with Session(engine) as session:
+        session.execute(insert(AuditLog), [row])
+        session.commit()
+
+
+def record_audit(user_id, action, resource_type=None, resource_id=None, details=None, durability=None):
+    """Record an audit entry for a mutating action using the configured (or given) durability mode"""
+    row = {
+        'id': generate_id(),
+        'user_id': user_id,
+        'action': action,
+        'resource_type': resource_type,
+        'resource_id': resource_id,
+        'details': details,
+        'timestamp': datetime.utcnow(),
+    }
+    mode = durability or current_app.config.get('AUDIT_DURABILITY', 'transaction')
+
+    if mode == 'async':
+        writer, shard = current_app.extensions['audit_writer'], current_shard()
+        _on_commit(lambda: writer.submit(row, shard))
+    elif mode == 'sync':
+        engine = shard_engine(db, current_shard())
+        _on_commit(lambda: _write_sync(engine, row))
+    else:
+        db.session.add(AuditLog(**row))
+    return row['id']
+
+
+def audit_stats():
+    """Counters for the current app's audit writer"""
+    writer = current_app.extensions.get('audit_writer')
+    return writer.stats() if writer else {}
@@ -1,23 +1,40 @@
-import uuid
 from datetime import datetime, timedelta
 from functools import wraps
 from flask import request, jsonify, current_app
 from flask_jwt_extended import create_access_token, create_refresh_token, jwt_required, get_jwt_identity
+from sqlalchemy.orm import make_transient_to_detached
 from models import User, db
+from consent import default_consent
+from ids import generate_id
+from passwords import hash_password, needs_rehash, PasswordHashingBusy
+from user_cache import get_cached_user, cache_user
+from database import use_shard
+from sharding import placement, route_user
 
 
-def generate_id():
-    """Generate a UUID for database records"""
-    return str(uuid.uuid4())
+def get_current_user():
+    """Get the currently authenticated user from JWT token, and route the request to their shard"""
+    user = load_current_user()
+    if user is not None:
+        # Outside the try below: a move holding the user's writes must reach the error handler
+        route_user(user)
+    return user
 
 
-def get_current_user():
-    """Get the currently authenticated user from JWT token"""
+def load_current_user():
+    """The JWT's user if still active, without routing to their shard"""
     try:
-        from flask_jwt_extended import get_jwt_identity
         user_id = get_jwt_identity()
-        user = User.query.get(user_id)
+        values = get_cached_user(user_id)
+        if values is not None:
+            # Attach the cached snapshot to the session without a SELECT
+            user = User(**values)
+            make_transient_to_detached(user)
+            user = db.session.merge(user, load=False)
+            return user if user.is_active else None
+        user = db.session.get(User, user_id)
         if user and user.is_active:
+            cache_user(user)
             return user
     except:
         pass
@@ -43,14 +60,21 @@ def register_user(email, password, name=None):
     if User.query.filter_by(email=email).first():
         return None, 'User already exists'
 
+    # Hash before the try block so PasswordHashingBusy reaches the route
+    password_hash = hash_password(password)
+
     try:
         user = User(
             id=generate_id(),
             email=email,
             name=name,
+            password_hash=password_hash,
         )
-        user.set_password(password)
+        user.shard = placement(user.id)
+        use_shard(user.shard)
         db.session.add(user)
+        # Created with the user so reading consent never has to write
+        db.session.add(default_consent(user.id))
         db.session.commit()
         return user, None
     except Exception as e:
@@ -61,6 +85,14 @@ def register_user(email, password, name=None):
 def authenticate_user(email, password):
     """Authenticate user with email and password"""
     user = User.query.filter_by(email=email).first()
-    if user and user.check_password(password):
+    # Deactivated accounts, e.g. ones being deleted, can't sign in
+    if user and user.is_active and user.check_password(password):
+        if needs_rehash(user.password_hash):
+            # Upgrade hashes made with an older method or cost while we have the password
+            try:
+                user.set_password(password)
+                db.session.commit()
+            except PasswordHashingBusy:
+                pass
         return user
     return None
@@ -0,0 +1,136 @@
+"""HavenApp Backend - Account deletion: ORM cascade vs chunked job
+
+Seeds one user with many signals (plus alerts) in a SQLite file, then
+deletes the account two ways while another user keeps posting signals:
+
+- ORM cascade: db.session.delete(user), which loads every child row and
+  deletes it in one transaction
+- the DELETE /api/user job (account_deletion.py): key-chunked DELETEs,
+  each committed with the job's progress
+
+Reports wall time, peak Python memory (tracemalloc), the longest single
+transaction and the other user's worst signal-write latency meanwhile,
+which is how long the deletion held SQLite's write lock at a stretch
+(writes that outwait the busy timeout fail and are counted).
+
+Usage: python benchmarks/bench_account_deletion.py [signals] [orm_signals]
+    e.g. python benchmarks/bench_account_deletion.py 1000000 200000
+"""
+import logging
+import os
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+
+from common import make_client, auth_headers
+import config as app_config
+from models import db, User
+from account_deletion import DeletionRunner, request_deletion
+from seed import seed_signals, seed_alerts
+
+VICTIM = 'victim@example.com'
+
+
+def build_app(db_path):
+    app_config.config['bench-deletion'] = type('BenchConfig', (app_config.TestingConfig,), {
+        'SQLALCHEMY_DATABASE_URI': f'sqlite:///{db_path}',
+        'PASSWORD_HASH_METHOD': 'pbkdf2:sha256:1000',
+        'ACCOUNT_DELETION_CHUNK_PAUSE': 0,
+    })
+    app, client = make_client('bench-deletion')
+    auth_headers(client, VICTIM)
+    return app, client, auth_headers(client, 'writer@example.com')
+
+
+def probe_writes(client, headers, stop, samples, failures):
+    while not stop.is_set():
+        started = time.perf_counter()
+        try:
+            response = client.post('/api/signals', json={'category': 'self_report', 'type': 'probe'}, headers=headers)
+            ok = response.status_code == 201
+        except Exception:
+            # e.g. 'database is locked' once SQLite's busy timeout runs out
+            ok = False
+        samples.append(time.perf_counter() - started)
+        if not ok:
+            failures.append(samples[-1])
+        time.sleep(0.005)
+
+
+def measure(label, client, headers, fn):
+    stop, samples, failures = threading.Event(), [], []
+    prober = threading.Thread(target=probe_writes, args=(client, headers, stop, samples, failures))
+    tracemalloc.start()
+    prober.start()
+    started = time.perf_counter()
+    longest = fn()
+    elapsed = time.perf_counter() - started
+    stop.set()
+    prober.join()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    print(f'{label:22} {elapsed:8.2f}s  peak {peak / 2 ** 20:8.1f} MiB  longest transaction {longest * 1000:9.1f} ms'
+          f'  concurrent write max {max(samples) * 1000:8.1f} ms ({len(samples)} writes, {len(failures)} failed)')
+
+
+def orm_cascade(app, signals):
+    with app.app_context():
+        user = User.query.filter_by(email=VICTIM).first()
+        seed_signals([user.id], signals)
+        seed_alerts([user.id], 1000)
+
+    def run():
+        with app.app_context():
+            started = time.perf_counter()
+            db.session.delete(User.query.filter_by(email=VICTIM).first())
+            db.session.commit()
+            return time.perf_counter() - started
+    return run
+
+
+def chunked_job(app, signals):
+    with app.app_context():
+        user = User.query.filter_by(email=VICTIM).first()
+        seed_signals([user.id], signals)
+        seed_alerts([user.id], 1000)
+        request_deletion(user)
+
+    class TimedRunner(DeletionRunner):
+        """Times each chunk's transaction as the gap between chunk starts (no pause is configured)"""
+        longest = 0.0
+        last = None
+
+        def _delete_chunk(self, table, user_id):
+            now = time.perf_counter()
+            if self.last is not None:
+                self.longest = max(self.longest, now - self.last)
+            self.last = now
+            return super()._delete_chunk(table, user_id)
+
+    runner = TimedRunner(app)
+
+    def run():
+        with app.app_context():
+            assert runner.run_pending() == 1 and User.query.filter_by(email=VICTIM).count() == 0
+            return runner.longest
+    return run
+
+
+def main():
+    logging.getLogger('app').setLevel(logging.ERROR)
+    signals = int(sys.argv[1]) if len(sys.argv) > 1 else 1000000
+    orm_signals = int(sys.argv[2]) if len(sys.argv) > 2 else min(signals, 200000)
+
+    scenarios = [('ORM cascade', orm_cascade, orm_signals), ('chunked job', chunked_job, orm_signals)]
+    if signals != orm_signals:
+        scenarios.append(('chunked job', chunked_job, signals))
+    for label, scenario, count in scenarios:
+        with tempfile.TemporaryDirectory() as tmp:
+            app, client, headers = build_app(os.path.join(tmp, 'bench.db'))
+            measure(f'{label} {count}', client, headers, scenario(app, count))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,268 @@
+"""HavenApp Backend - Endpoint benchmark suite
+
+Builds the app through create_app, seeds synthetic users, signals and alerts
+at each requested scale, then drives every route in app.py through the
+Flask test client and records throughput and p50/p95/p99 latency. A route
+answering anything but 2xx or 304 stops the run: its timings would measure
+the error path.
+
+Results are written as JSON. Given a baseline (an earlier results file) any
+route whose p95 grew by more than --threshold is flagged as a regression and
+the script exits non-zero.
+
+Usage:
+    python benchmarks/bench_endpoints.py --scales 1000,100000,1000000
+    python benchmarks/bench_endpoints.py --scales 1000 --save-baseline
+    python benchmarks/bench_endpoints.py --scales 1000 --baseline benchmarks/results/baseline.json
+"""
+import argparse
+import json
+import logging
+import os
+import platform
+import statistics
+import sys
+import time
+from datetime import datetime
+
+from common import make_client, auth_headers
+import config as app_config
+from models import User, Alert
+import rollups
+from seed import seed_users, seed_signals, seed_alerts
+from signal_store import signal_store
+
+RESULTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'results')
+DEFAULT_BASELINE = os.path.join(RESULTS_DIR, 'baseline.json')
+
+EMAIL = 'bench@example.com'
+PASSWORD = 'benchmark-password'
+
+
+WARMUP = 3
+CONTACT = {'name': 'Bench Contact', 'email': 'contact@example.com', 'relationship': 'friend'}
+
+
+class BenchConfig(app_config.TestingConfig):
+    # Keep hashing cheap so auth routes measure the app, not PBKDF2
+    PASSWORD_HASH_METHOD = 'pbkdf2:sha256:1000'
+    # Room for every contact the run creates
+    CONTACTS_MAX = 100000
+
+
+def percentile(samples, pct):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(round((len(ordered) - 1) * pct / 100.0)))]
+
+
+def login(client, email=EMAIL, password=PASSWORD):
+    """Fresh (access, refresh) Authorization headers for email"""
+    tokens = client.post('/api/auth/login', json={'email': email, 'password': password}).get_json()
+    return ({'Authorization': f"Bearer {tokens['access_token']}"},
+            {'Authorization': f"Bearer {tokens['refresh_token']}"})
+
+
+def build_cases(ctx):
+    """(name, method, path, json body or None, iterations[, headers]) for every route.
+
+    headers, when given, is called with the request index outside the timed
+    part, for routes that use up their token (logout) or need another one.
+    """
+    n = ctx['iterations']
+    client = ctx['client']
+    signal = {'category': 'device', 'type': 'bench', 'confidence': 0.2, 'metadata': {'k': 'v'}}
+    return [
+        ('GET /api/health', 'get', lambda i: '/api/health', None, n),
+        ('GET /api/metrics', 'get', lambda i: '/api/metrics', None, n),
+        ('POST /api/auth/register', 'post', lambda i: '/api/auth/register',
+         lambda i: {'email': f'reg{ctx["scale"]}-{i}@example.com', 'password': PASSWORD}, max(n // 5, 5)),
+        ('POST /api/auth/login', 'post', lambda i: '/api/auth/login',
+         lambda i: {'email': EMAIL, 'password': PASSWORD}, max(n // 5, 5)),
+        ('POST /api/auth/refresh', 'post', lambda i: '/api/auth/refresh', None, n,
+         lambda i: ctx['refresh_headers']),
+        # Logout revokes the token it is sent with, so each request gets a throwaway login
+        ('POST /api/auth/logout', 'post', lambda i: '/api/auth/logout', None, n,
+         lambda i: login(client)[0]),
+        ('GET /api/alerts', 'get', lambda i: '/api/alerts', None, n),
+        ('GET /api/alerts/stream', 'stream', lambda i: '/api/alerts/stream', None, n),
+        ('GET /api/alerts/<id>', 'get', lambda i: f'/api/alerts/{ctx["alert_ids"][i % len(ctx["alert_ids"])]}', None, n),
+        ('POST /api/alerts', 'post', lambda i: '/api/alerts', lambda i: {'type': 'manual', 'riskLevel': 0.3}, n),
+        # A fresh Idempotency-Key each time, or every request after the first is a replay
+        ('POST /api/alerts/panic', 'post', lambda i: '/api/alerts/panic', lambda i: {}, n,
+         lambda i: {**ctx['headers'], 'Idempotency-Key': f'bench-{ctx["scale"]}-{i}'}),
+        ('PUT /api/alerts/<id>/acknowledge', 'put',
+         lambda i: f'/api/alerts/{ctx["alert_ids"][i % len(ctx["alert_ids"])]}/acknowledge', None, n),
+        ('GET /api/signals', 'get', lambda i: '/api/signals', None, n),
+        ('POST /api/signals', 'post', lambda i: '/api/signals', lambda i: signal, n),
+        ('POST /api/signals/batch', 'post', lambda i: '/api/signals/batch',
+         lambda i: {'signals': [signal] * 100}, max(n // 5, 5)),
+        ('GET /api/signals/summary?bucket=hour', 'get', lambda i: '/api/signals/summary?bucket=hour', None, n),
+        ('GET /api/signals/summary?bucket=day', 'get', lambda i: '/api/signals/summary?bucket=day', None, n),
+        ('GET /api/user/consent', 'get', lambda i: '/api/user/consent', None, n),
+        ('PUT /api/user/consent', 'put', lambda i: '/api/user/consent', lambda i: {'journaling': i % 2 == 0}, n),
+        ('GET /api/user', 'get', lambda i: '/api/user', None, n),
+        ('PUT /api/user', 'put', lambda i: '/api/user', lambda i: {'name': f'Bench {i}'}, n),
+        ('GET /api/user/export', 'get', lambda i: '/api/user/export', None, max(n // 20, 3)),
+        ('GET /api/contacts', 'get', lambda i: '/api/contacts', None, n),
+        ('POST /api/contacts', 'post', lambda i: '/api/contacts', lambda i: CONTACT, n),
+        ('GET /api/contacts/<id>', 'get', lambda i: f'/api/contacts/{ctx["contact_ids"][i % 5]}', None, n),
+        ('PUT /api/contacts/<id>', 'put', lambda i: f'/api/contacts/{ctx["contact_ids"][i % 5]}',
+         lambda i: {'phone': f'+1555{i:07d}'}, n),
+        # Each request removes a contact of its own, seeded past the five the others use
+        ('DELETE /api/contacts/<id>', 'delete', lambda i: f'/api/contacts/{ctx["contact_ids"][5 + i]}', None, n),
+        # Each deletion is of an account registered for it
+        ('DELETE /api/user', 'delete', lambda i: '/api/user', lambda i: {'password': PASSWORD}, max(n // 5, 5),
+         lambda i: auth_headers(client, f'del{ctx["scale"]}-{i}@example.com', PASSWORD)),
+        ('GET /api/user/deletions/<id>', 'get', lambda i: f'/api/user/deletions/{ctx["deletion_id"]}', None, n),
+    ]
+
+
+class UnexpectedStatus(Exception):
+    """A benchmarked route answered with an error"""
+
+
+def check(response):
+    if not (200 <= response.status_code < 300 or response.status_code == 304):
+        raise UnexpectedStatus(f'{response.status_code} {response.get_data(as_text=True)[:200]}')
+
+
+def open_stream(client):
+    """A GET that reads a streamed response up to its first chunk, then closes it"""
+    def call(path, json=None, headers=None):
+        response = client.get(path, headers=headers, buffered=False)
+        next(response.iter_encoded(), None)
+        response.close()
+        return response
+    return call
+
+
+def measure(client, headers, method, path, body, iterations, warmup=WARMUP):
+    # 'stream' times an event stream up to its first chunk, as it never ends
+    call = open_stream(client) if method == 'stream' else getattr(client, method)
+    headers_for = headers if callable(headers) else lambda i: headers
+    # Warm-up requests use indices past the measured range so generated bodies stay unique
+    for i in range(iterations, iterations + warmup):
+        check(call(path(i), json=body(i) if body else None, headers=headers_for(i)))
+
+    samples = []
+    statuses = set()
+    setup = 0.0
+    started = time.perf_counter()
+    for i in range(iterations):
+        t0 = time.perf_counter()
+        request_headers = headers_for(i)
+        setup += time.perf_counter() - t0
+        t0 = time.perf_counter()
+        response = call(path(i), json=body(i) if body else None, headers=request_headers)
+        response.get_data()
+        samples.append(time.perf_counter() - t0)
+        statuses.add(response.status_code)
+        check(response)
+    elapsed = time.perf_counter() - started - setup
+
+    return {
+        'n': iterations,
+        'rps': round(iterations / elapsed, 2),
+        'p50_ms': round(percentile(samples, 50) * 1000, 3),
+        'p95_ms': round(percentile(samples, 95) * 1000, 3),
+        'p99_ms': round(percentile(samples, 99) * 1000, 3),
+        'mean_ms': round(statistics.fmean(samples) * 1000, 3),
+        'statuses': sorted(statuses),
+    }
+
+
+def run_scale(scale, users, iterations):
+    app_config.config['bench-endpoints'] = BenchConfig
+    app, client = make_client('bench-endpoints')
+    headers = auth_headers(client, EMAIL, PASSWORD)
+
+    with app.app_context():
+        bench_user = User.query.filter_by(email=EMAIL).first().id
+        user_ids = [bench_user] + seed_users(max(users - 1, 0))
+        started = time.perf_counter()
+        seed_signals(user_ids, scale)
+        # Seeding bypasses the signal writes that keep the summary's rollups
+        rollups.rebuild(signal_store())
+        seed_alerts(user_ids, max(scale // 10, 1))
+        seed_seconds = time.perf_counter() - started
+        alert_ids = [a.id for a in Alert.query.filter_by(user_id=bench_user).limit(100)]
+    contact_ids = [client.post('/api/contacts', json=CONTACT, headers=headers).get_json()['id']
+                   for _ in range(5 + iterations + WARMUP)]
+
+    print(f'scale {scale:>9}: seeded {scale} signals / {max(scale // 10, 1)} alerts over '
+          f'{len(user_ids)} users in {seed_seconds:.1f}s', file=sys.stderr)
+
+    deletion_id = client.delete('/api/user', json={'password': PASSWORD},
+                                headers=auth_headers(client, f'deleted{scale}@example.com', PASSWORD)).get_json()['id']
+
+    ctx = {'scale': scale, 'iterations': iterations, 'alert_ids': alert_ids, 'contact_ids': contact_ids,
+           'deletion_id': deletion_id, 'client': client, 'headers': headers, 'refresh_headers': login(client)[1]}
+    results = {}
+    for name, method, path, body, count, *case_headers in build_cases(ctx):
+        try:
+            results[name] = measure(client, case_headers[0] if case_headers else headers, method, path, body, count)
+        except UnexpectedStatus as e:
+            sys.exit(f'{name} at scale {scale} answered {e}')
+        r = results[name]
+        print(f'  {name:38} {r["rps"]:9.1f} req/s  p50 {r["p50_ms"]:8.2f}  p95 {r["p95_ms"]:8.2f}'
+              f'  p99 {r["p99_ms"]:8.2f} ms  {r["statuses"]}', file=sys.stderr)
+    return results
+
+
+def compare(current, baseline, threshold):
+    """List (scale, route, baseline p95, current p95) where p95 regressed beyond threshold"""
+    regressions = []
+    for scale, routes in current['scales'].items():
+        for route, result in routes.items():
+            before = baseline.get('scales', {}).get(scale, {}).get(route)
+            if before and before['p95_ms'] > 0 and result['p95_ms'] > before['p95_ms'] * (1 + threshold):
+                regressions.append((scale, route, before['p95_ms'], result['p95_ms']))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--scales', default='1000,100000,1000000',
+                        help='Comma-separated signal row counts to seed (alerts are 1/10th)')
+    parser.add_argument('--users', type=int, default=100, help='Users the seeded rows are spread over')
+    parser.add_argument('--iterations', type=int, default=200, help='Requests per route')
+    parser.add_argument('--output', default=None, help='Results file (default results/<timestamp>.json)')
+    parser.add_argument('--baseline', default=None, help='Results file to compare against')
+    parser.add_argument('--threshold', type=float, default=0.2, help='Allowed p95 growth, e.g. 0.2 = 20%%')
+    parser.add_argument('--save-baseline', action='store_true', help=f'Also write results to {DEFAULT_BASELINE}')
+    args = parser.parse_args()
+    # Every panic alert logs a warning
+    logging.getLogger('app').setLevel(logging.ERROR)
+
+    scales = [int(s) for s in args.scales.split(',') if s]
+    current = {
+        'created_at': datetime.utcnow().isoformat(),
+        'python': platform.python_version(),
+        'machine': platform.machine(),
+        'iterations': args.iterations,
+        'users': args.users,
+        'scales': {str(scale): run_scale(scale, args.users, args.iterations) for scale in scales},
+    }
+
+    os.makedirs(RESULTS_DIR, exist_ok=True)
+    output = args.output or os.path.join(RESULTS_DIR, f'{datetime.utcnow():%Y%m%dT%H%M%S}.json')
+    targets = [output] + ([DEFAULT_BASELINE] if args.save_baseline else [])
+    for target in targets:
+        with open(target, 'w') as f:
+            json.dump(current, f, indent=2)
+        print(f'wrote {target}', file=sys.stderr)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        regressions = compare(current, baseline, args.threshold)
+        for scale, route, before, after in regressions:
+            print(f'REGRESSION scale {scale} {route}: p95 {before:.2f} ms -> {after:.2f} ms '
+                  f'(+{(after / before - 1) * 100:.0f}%)')
+        if regressions:
+            sys.exit(1)
+        print(f'no p95 regressions above {args.threshold:.0%} against {args.baseline}')
+
+
+if __name__ == '__main__':
+    main()
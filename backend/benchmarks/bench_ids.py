@@ -0,0 +1,105 @@
+"""HavenApp Backend - Primary key scheme: random uuid4 vs time-ordered UUIDv7
+
+Inserts the same signals-shaped rows into one table per id scheme, in
+batches like POST /api/signals/batch, and reports insert throughput over the
+first and last tenth of the run and the size of the primary key index. Random
+keys split pages all over the index, which leaves them half full and, once
+the index outgrows the page cache, makes every insert read a cold page;
+UUIDv7 keys only ever append to its right-hand edge.
+
+On SQLite (the default, a file in a temporary directory) both schemes are
+36-character strings. Pass a PostgreSQL URL to also compare the native uuid
+column that UUIDString uses there.
+
+Usage: python benchmarks/bench_ids.py [rows] [batch_size] [database_url]
+    e.g. python benchmarks/bench_ids.py 1000000 500
+"""
+import os
+import random
+import sys
+import tempfile
+import time
+import uuid
+from datetime import datetime, timedelta
+from sqlalchemy import Column, DateTime, Float, MetaData, String, Table, create_engine, insert, text
+from sqlalchemy.dialects.postgresql import UUID
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from ids import generate_id  # noqa: E402
+
+
+def make_table(metadata, name, id_type):
+    return Table(
+        name, metadata,
+        Column('id', id_type, primary_key=True),
+        Column('user_id', String(36), nullable=False),
+        Column('category', String(50), nullable=False),
+        Column('confidence', Float),
+        Column('created_at', DateTime, nullable=False),
+    )
+
+
+def index_bytes(connection, table):
+    if connection.dialect.name == 'postgresql':
+        return connection.execute(text(f"SELECT pg_relation_size('{table.name}_pkey')")).scalar()
+    return connection.execute(
+        text('SELECT sum(pgsize) FROM dbstat WHERE name = :name'), {'name': f'sqlite_autoindex_{table.name}_1'}
+    ).scalar()
+
+
+def run(engine, table, make_id, rows, batch_size):
+    users = [str(uuid.uuid4()) for _ in range(100)]
+    started_at = datetime.utcnow()
+    timings = []
+    for start in range(0, rows, batch_size):
+        values = [{
+            'id': make_id(),
+            'user_id': random.choice(users),
+            'category': 'device',
+            'confidence': random.random(),
+            'created_at': started_at + timedelta(milliseconds=start + i),
+        } for i in range(min(batch_size, rows - start))]
+        began = time.perf_counter()
+        with engine.begin() as connection:
+            connection.execute(insert(table), values)
+        timings.append((len(values), time.perf_counter() - began))
+
+    tenth = max(1, len(timings) // 10)
+    rate = lambda part: sum(n for n, _ in part) / sum(seconds for _, seconds in part)  # noqa: E731
+    with engine.connect() as connection:
+        size = index_bytes(connection, table)
+    print(f'{table.name:14} first 10% {rate(timings[:tenth]):9.0f} rows/s  last 10% {rate(timings[-tenth:]):9.0f} rows/s'
+          f'  overall {rate(timings):9.0f} rows/s  pk index {size / 2 ** 20:7.1f} MiB ({size / rows:5.1f} B/row)')
+
+
+def main():
+    rows = int(sys.argv[1]) if len(sys.argv) > 1 else 1000000
+    batch_size = int(sys.argv[2]) if len(sys.argv) > 2 else 500
+    url = sys.argv[3] if len(sys.argv) > 3 else None
+
+    with tempfile.TemporaryDirectory() as tmp:
+        engine = create_engine(url or f'sqlite:///{os.path.join(tmp, "ids.db")}')
+        metadata = MetaData()
+        variants = [
+            (make_table(metadata, 'ids_uuid4', String(36)), lambda: str(uuid.uuid4())),
+            (make_table(metadata, 'ids_uuid7', String(36)), generate_id),
+        ]
+        if engine.dialect.name == 'postgresql':
+            variants += [
+                (make_table(metadata, 'ids_uuid4_native', UUID(as_uuid=False)), lambda: str(uuid.uuid4())),
+                (make_table(metadata, 'ids_uuid7_native', UUID(as_uuid=False)), generate_id),
+            ]
+        metadata.drop_all(engine)
+        metadata.create_all(engine)
+        try:
+            print(f'{rows} rows in batches of {batch_size} on {engine.dialect.name}')
+            for table, make_id in variants:
+                run(engine, table, make_id, rows, batch_size)
+        finally:
+            metadata.drop_all(engine)
+            engine.dispose()
+
+
+if __name__ == '__main__':
+    main()
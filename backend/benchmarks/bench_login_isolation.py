@@ -0,0 +1,109 @@
+"""HavenApp Backend - Non-auth latency while logins saturate the server
+
+Serves the app from a threaded WSGI server and measures GET /api/alerts
+latency, first idle and then while several threads hammer
+POST /api/auth/login, with password hashing inline and offloaded to the
+process pool.
+
+Usage: python benchmarks/bench_login_isolation.py [login_threads] [seconds]
+"""
+import logging
+import os
+import statistics
+import sys
+import tempfile
+import threading
+import time
+
+import requests
+from werkzeug.serving import make_server
+
+from common import make_client, auth_headers
+import config as app_config
+
+EMAIL = 'bench@example.com'
+PASSWORD = 'benchmark-password'
+
+
+def percentile(samples, pct):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))]
+
+
+def build_app(offload, db_path):
+    name = f'bench-login-{offload}'
+    app_config.config[name] = type('BenchConfig', (app_config.TestingConfig,), {
+        'SQLALCHEMY_DATABASE_URI': f'sqlite:///{db_path}',
+        'PASSWORD_HASH_OFFLOAD': offload,
+        'PASSWORD_HASH_WORKERS': 1,
+        'PASSWORD_HASH_MAX_PENDING': 2,
+    })
+    app, client = make_client(name)
+    return app, auth_headers(client, EMAIL, PASSWORD)
+
+
+def sample_latency(base_url, headers, stop, samples):
+    session = requests.Session()
+    while not stop.is_set():
+        start = time.perf_counter()
+        session.get(f'{base_url}/api/alerts', headers=headers)
+        samples.append(time.perf_counter() - start)
+        time.sleep(0.01)
+
+
+def hammer_login(base_url, stop, outcomes):
+    session = requests.Session()
+    while not stop.is_set():
+        response = session.post(f'{base_url}/api/auth/login', json={'email': EMAIL, 'password': PASSWORD})
+        outcomes.append(response.status_code)
+        if response.status_code == 503:
+            # Well-behaved clients back off as told
+            stop.wait(float(response.headers.get('Retry-After', 1)))
+
+
+def run(offload, login_threads, seconds):
+    with tempfile.TemporaryDirectory() as tmp:
+        app, headers = build_app(offload, os.path.join(tmp, 'bench.db'))
+        server = make_server('127.0.0.1', 0, app, threaded=True)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        base_url = f'http://127.0.0.1:{server.server_port}'
+
+        results = {}
+        for phase, logins in (('idle', 0), ('login burst', login_threads)):
+            stop = threading.Event()
+            samples, outcomes = [], []
+            threads = [threading.Thread(target=sample_latency, args=(base_url, headers, stop, samples))]
+            threads += [threading.Thread(target=hammer_login, args=(base_url, stop, outcomes)) for _ in range(logins)]
+            for thread in threads:
+                thread.start()
+            time.sleep(seconds)
+            stop.set()
+            for thread in threads:
+                thread.join()
+            results[phase] = (samples, outcomes)
+
+        server.shutdown()
+        pool = app.extensions.get('password_pool')
+        if pool:
+            pool.shutdown()
+
+    label = 'offloaded' if offload else 'inline'
+    for phase, (samples, outcomes) in results.items():
+        line = (f'{label:9} {phase:12} GET /api/alerts  p50 {statistics.median(samples) * 1000:7.1f} ms'
+                f'  p99 {percentile(samples, 99) * 1000:7.1f} ms  ({len(samples)} requests)')
+        if outcomes:
+            ok = outcomes.count(200)
+            line += f'  | logins {ok / seconds:5.1f}/s ok, {outcomes.count(503)} shed with 503'
+        print(line)
+
+
+def main():
+    logging.getLogger('werkzeug').setLevel(logging.ERROR)
+    login_threads = int(sys.argv[1]) if len(sys.argv) > 1 else 8
+    seconds = float(sys.argv[2]) if len(sys.argv) > 2 else 5
+    run(False, login_threads, seconds)
+    run(True, login_threads, seconds)
+
+
+if __name__ == '__main__':
+    main()
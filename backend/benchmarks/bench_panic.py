@@ -0,0 +1,185 @@
+"""HavenApp Backend - Panic alert latency under mixed load
+
+Serves the app from a WSGI server with a fixed pool of request threads,
+like one gunicorn gthread worker, while load threads keep it saturated with
+alert/signal reads, signal batches and data exports. One client raises an
+alert every 50 ms and its latency is reported on its own, for:
+
+- the generic path (POST /api/alerts, type 'manual')
+- the panic fast path (POST /api/alerts/panic with an Idempotency-Key)
+- the fast path with a thread reserved for panic alerts (priority gate)
+
+Every tenth panic is sent twice with the same key to check retries are
+deduplicated. Each line also gives the alert's p50 with the server idle,
+measured first: its service time alone.
+
+Without the gate an alert waits in the server's FIFO queue behind the load
+requests that arrived first, exports among them, and that wait is nearly all
+of its latency. The paths' service times (the idle p50s) are a few
+milliseconds and within one of each other, far inside the run-to-run spread
+of a queue wait of a hundred or more with a few dozen samples. So the two
+ungated loaded p50s don't rank the paths, and either may come out ahead;
+only the reserved thread takes the alert out of the queue.
+
+Usage: python benchmarks/bench_panic.py [load_threads] [seconds] [worker_threads]
+"""
+import logging
+import os
+import statistics
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from werkzeug.serving import BaseWSGIServer
+
+from common import make_client, auth_headers
+import config as app_config
+from models import User, Alert
+from seed import seed_signals, seed_alerts
+
+EMAIL = 'bench@example.com'
+PASSWORD = 'benchmark-password'
+
+
+class PooledWSGIServer(BaseWSGIServer):
+    """Werkzeug server handling requests on a fixed thread pool, queueing the rest"""
+
+    def __init__(self, host, port, app, threads):
+        super().__init__(host, port, app)
+        self._pool = ThreadPoolExecutor(threads)
+
+    def process_request(self, request, client_address):
+        self._pool.submit(self._handle, request, client_address)
+
+    def _handle(self, request, client_address):
+        try:
+            self.finish_request(request, client_address)
+        except Exception:
+            self.handle_error(request, client_address)
+        finally:
+            self.shutdown_request(request)
+
+
+def percentile(samples, pct):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))]
+
+
+def build_app(db_path, worker_threads, gate):
+    name = f'bench-panic-{gate}'
+    app_config.config[name] = type('BenchConfig', (app_config.TestingConfig,), {
+        'SQLALCHEMY_DATABASE_URI': f'sqlite:///{db_path}',
+        'PASSWORD_HASH_METHOD': 'pbkdf2:sha256:1000',
+        'WORKER_THREADS': worker_threads if gate else None,
+    })
+    app, client = make_client(name)
+    headers = auth_headers(client, EMAIL, PASSWORD)
+    with app.app_context():
+        user_id = User.query.filter_by(email=EMAIL).first().id
+        seed_signals([user_id], 5000)
+        seed_alerts([user_id], 500)
+    return app, headers
+
+
+def load(base_url, headers, stop, counts):
+    session = requests.Session()
+    batch = {'signals': [{'category': 'device', 'type': 'bench', 'confidence': 0.1}] * 50}
+    requests_cycle = [
+        ('get', '/api/alerts?limit=200', None),
+        ('get', '/api/signals?limit=200', None),
+        ('post', '/api/signals/batch', batch),
+        ('get', '/api/signals?limit=200', None),
+        ('get', '/api/user/export', None),
+    ]
+    i = 0
+    while not stop.is_set():
+        method, path, body = requests_cycle[i % len(requests_cycle)]
+        response = getattr(session, method)(f'{base_url}{path}', json=body, headers=headers)
+        counts[response.status_code] = counts.get(response.status_code, 0) + 1
+        if response.status_code == 503:
+            stop.wait(0.05)
+        i += 1
+
+
+def alert_request(mode):
+    """(path, body, extra headers) for one alert through mode's path"""
+    if mode == 'generic':
+        return '/api/alerts', {'type': 'manual', 'riskLevel': 0.9}, {}
+    return '/api/alerts/panic', {}, {'Idempotency-Key': str(uuid.uuid4())}
+
+
+def idle_p50(base_url, headers, mode, count=30):
+    session = requests.Session()
+    samples = []
+    for _ in range(count):
+        path, body, extra = alert_request(mode)
+        start = time.perf_counter()
+        response = session.post(f'{base_url}{path}', json=body, headers={**headers, **extra})
+        samples.append(time.perf_counter() - start)
+        assert response.status_code == 201, response.status_code
+    return statistics.median(samples)
+
+
+def raise_alerts(base_url, headers, stop, mode, samples, ids):
+    session = requests.Session()
+    i = 0
+    while not stop.is_set():
+        path, body, extra = alert_request(mode)
+        start = time.perf_counter()
+        response = session.post(f'{base_url}{path}', json=body, headers={**headers, **extra})
+        samples.append(time.perf_counter() - start)
+        assert response.status_code == 201, response.status_code
+        ids.append(response.json()['id'])
+        if extra and i % 10 == 0:
+            retry = session.post(f'{base_url}{path}', json=body, headers={**headers, **extra})
+            assert retry.json()['id'] == ids[-1] and retry.headers.get('Idempotent-Replayed') == 'true'
+        i += 1
+        stop.wait(0.05)
+
+
+def run(label, mode, gate, load_threads, seconds, worker_threads):
+    with tempfile.TemporaryDirectory() as tmp:
+        app, headers = build_app(os.path.join(tmp, 'bench.db'), worker_threads, gate)
+        server = PooledWSGIServer('127.0.0.1', 0, app, worker_threads)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        base_url = f'http://127.0.0.1:{server.server_port}'
+        idle = idle_p50(base_url, headers, mode)
+
+        stop = threading.Event()
+        samples, ids, counts = [], [], {}
+        threads = [threading.Thread(target=load, args=(base_url, headers, stop, counts)) for _ in range(load_threads)]
+        threads.append(threading.Thread(target=raise_alerts, args=(base_url, headers, stop, mode, samples, ids)))
+        for thread in threads:
+            thread.start()
+        time.sleep(seconds)
+        stop.set()
+        for thread in threads:
+            thread.join()
+        server.shutdown()
+
+        with app.app_context():
+            stored = Alert.query.filter(Alert.id.in_(ids)).count()
+
+    served = sum(n for status, n in counts.items() if status < 500)
+    print(f'{label:30} idle p50 {idle * 1000:5.1f}  p50 {statistics.median(samples) * 1000:7.1f}  p95 {percentile(samples, 95) * 1000:7.1f}'
+          f'  p99 {percentile(samples, 99) * 1000:7.1f} ms  ({len(samples)} alerts, {stored} stored)'
+          f'  | load {served / seconds:6.1f} req/s served, {counts.get(503, 0)} shed')
+
+
+def main():
+    logging.getLogger('werkzeug').setLevel(logging.ERROR)
+    logging.getLogger('app').setLevel(logging.ERROR)
+    load_threads = int(sys.argv[1]) if len(sys.argv) > 1 else 8
+    seconds = float(sys.argv[2]) if len(sys.argv) > 2 else 10
+    worker_threads = int(sys.argv[3]) if len(sys.argv) > 3 else 4
+    run('generic create_alert', 'generic', False, load_threads, seconds, worker_threads)
+    run('panic fast path', 'panic', False, load_threads, seconds, worker_threads)
+    run('panic fast path + reserved', 'panic', True, load_threads, seconds, worker_threads)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,120 @@
+"""HavenApp Backend - Dashboard payloads: sparse fieldsets and compression
+
+Seeds one user with signals carrying typical client metadata, alerts and
+contacts, then fetches the requests a dashboard makes on open, as full
+objects and narrowed with ?fields=, each with no Content-Encoding, gzip and
+(when installed) brotli. Indented output, which JSON_PRETTYPRINT turns on,
+is measured once per request as the old development-style baseline.
+
+For each variant it reports the body size, the median server time through
+the test client (serialization and compression included) and an end-to-end
+estimate for a poor mobile link: server time + one round trip + body size
+at the given bandwidth.
+
+Usage: python benchmarks/bench_payloads.py [signals] [kbit_per_second] [rtt_ms]
+    e.g. python benchmarks/bench_payloads.py 2000 1000 300
+"""
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+
+from common import make_client, auth_headers
+import config as app_config
+from compression import brotli
+
+EMAIL = 'dashboard@example.com'
+
+# (name, full request, the fields a list view actually shows)
+REQUESTS = [
+    ('alerts', '/api/alerts?limit=50', 'id,riskLevel,acknowledged,timestamp'),
+    ('signals', '/api/signals?limit=200', 'id,category,type,timestamp'),
+    ('contacts', '/api/contacts', 'id,name,is_advocate'),
+    ('user', '/api/user', 'name'),
+]
+
+
+def build_app(name, db_path, **settings):
+    app_config.config[name] = type(name, (app_config.TestingConfig,), {
+        'SQLALCHEMY_DATABASE_URI': f'sqlite:///{db_path}',
+        'PASSWORD_HASH_METHOD': 'pbkdf2:sha256:1000',
+        **settings,
+    })
+    app, client = make_client(name)
+    return client, auth_headers(client, EMAIL)
+
+
+def seed(client, headers, signals):
+    rng = random.Random(3)
+    assert client.put('/api/user/consent', json={'location_tracking': True}, headers=headers).status_code == 200
+    kinds = [('communication', 'message_sentiment'), ('device', 'screen_time'), ('movement', 'location_change')]
+    for start in range(0, signals, 500):
+        batch = []
+        for i in range(start, min(signals, start + 500)):
+            category, signal_type = rng.choice(kinds)
+            batch.append({'category': category, 'type': signal_type, 'confidence': round(rng.random(), 3),
+                          'metadata': {
+                              'source': 'passive',
+                              'app': rng.choice(['messages', 'calls', 'maps', 'browser']),
+                              'duration_seconds': rng.randint(1, 3600),
+                              'device': {'os': 'android', 'version': '14', 'battery': rng.randint(5, 100)},
+                              'location': {'lat': round(rng.uniform(-90, 90), 6), 'lng': round(rng.uniform(-180, 180), 6),
+                                           'accuracy_m': rng.randint(3, 50)},
+                              'sequence': i,
+                          }})
+        assert client.post('/api/signals/batch', json={'signals': batch}, headers=headers).status_code == 201
+    for _ in range(60):
+        client.post('/api/alerts', json={'type': 'manual', 'riskLevel': round(rng.random(), 2)}, headers=headers)
+    for i in range(3):
+        client.post('/api/contacts', json={'name': f'Contact {i}', 'phone': f'+1555000{i:04d}',
+                                           'email': f'contact{i}@example.com', 'relationship': 'friend'},
+                    headers=headers)
+
+
+def measure(client, headers, path, encoding, iterations):
+    request_headers = {**headers, 'Accept-Encoding': encoding} if encoding else headers
+    samples, size = [], 0
+    for _ in range(iterations):
+        started = time.perf_counter()
+        response = client.get(path, headers=request_headers)
+        samples.append(time.perf_counter() - started)
+        assert response.status_code == 200, response.get_json()
+        size = len(response.data)
+    return size, statistics.median(samples)
+
+
+def main():
+    signals = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    kbps = float(sys.argv[2]) if len(sys.argv) > 2 else 1000
+    rtt = float(sys.argv[3]) / 1000 if len(sys.argv) > 3 else 0.3
+    iterations = 50
+    encodings = [('identity', None), ('gzip', 'gzip')] + ([('br', 'br')] if brotli is not None else [])
+
+    with tempfile.TemporaryDirectory() as tmp:
+        db_path = os.path.join(tmp, 'bench.db')
+        client, headers = build_app('bench-payloads', db_path)
+        seed(client, headers, signals)
+        pretty_client, pretty_headers = build_app('bench-payloads-pretty', db_path,
+                                                  JSON_PRETTYPRINT=True, COMPRESS_ENABLED=False)
+
+        print(f'{signals} signals, {kbps:g} kbit/s, {rtt * 1000:g} ms RTT'
+              f'{"" if brotli is not None else " (brotli not installed)"}')
+        for name, path, fields in REQUESTS:
+            variants = [('pretty', pretty_client, pretty_headers, path, None)]
+            variants += [(label, client, headers, path, encoding) for label, encoding in encodings]
+            narrowed = f'{path}{"&" if "?" in path else "?"}fields={fields}'
+            variants += [(f'fields+{label}', client, headers, narrowed, encoding) for label, encoding in encodings]
+            baseline = None
+            for label, variant_client, variant_headers, variant_path, encoding in variants:
+                size, server = measure(variant_client, variant_headers, variant_path, encoding, iterations)
+                end_to_end = server + rtt + size * 8 / (kbps * 1000)
+                if baseline is None:
+                    baseline = (size, end_to_end)
+                print(f'  {name:9} {label:15} {size:8d} B ({size / baseline[0]:6.1%})  server {server * 1000:6.2f} ms'
+                      f'  end-to-end {end_to_end * 1000:7.1f} ms ({end_to_end / baseline[1]:6.1%})')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,143 @@
+"""HavenApp Backend - Priority gate shed rate at realistic concurrency
+
+Serves the app from a fixed pool of request threads, like one gunicorn
+gthread worker (see bench_panic.py), to a number of concurrent clients that
+each send an ordinary request (alert and signal reads, a small signal batch,
+the profile) and then think for a while, as app users do, not back to back.
+Some runs also hold alert streams open throughout. Each line reports the
+share of ordinary requests the gate answered 503 and the latency of those
+it served, for:
+
+- no gate (WORKER_THREADS unset): the baseline, nothing is shed
+- the default gate: WORKER_THREADS - PANIC_RESERVED_THREADS slots
+- the same slots with two streams open, on threads the gate leaves to them
+  (WORKER_THREADS raised by two, PRIORITY_GATE_LIMIT kept)
+
+Open streams hold their own threads rather than gate slots, so the second
+and third rows should shed alike.
+
+Usage: python benchmarks/bench_priority_gate.py [seconds] [worker_threads] [clients,...]
+"""
+import logging
+import os
+import random
+import statistics
+import sys
+import tempfile
+import threading
+import time
+
+import requests
+
+from bench_panic import PooledWSGIServer, percentile
+from common import make_client, auth_headers
+import config as app_config
+from models import User
+from seed import seed_signals, seed_alerts
+
+EMAIL = 'bench@example.com'
+PASSWORD = 'benchmark-password'
+THINK_SECONDS = 0.2  # mean pause between a client's requests
+
+
+def build_app(db_path, worker_threads, gate_limit):
+    name = f'bench-gate-{worker_threads}-{gate_limit}'
+    app_config.config[name] = type('BenchConfig', (app_config.TestingConfig,), {
+        'SQLALCHEMY_DATABASE_URI': f'sqlite:///{db_path}',
+        'PASSWORD_HASH_METHOD': 'pbkdf2:sha256:1000',
+        'WORKER_THREADS': worker_threads if gate_limit else None,
+        'PRIORITY_GATE_LIMIT': gate_limit,
+        'STREAM_HEARTBEAT_SECONDS': 0.5,
+    })
+    app, client = make_client(name)
+    headers = auth_headers(client, EMAIL, PASSWORD)
+    with app.app_context():
+        user_id = User.query.filter_by(email=EMAIL).first().id
+        seed_signals([user_id], 2000)
+        seed_alerts([user_id], 200)
+    return app, headers
+
+
+def client_loop(base_url, headers, stop, seed, latencies, counts):
+    session = requests.Session()
+    rng = random.Random(seed)
+    batch = {'signals': [{'category': 'device', 'type': 'bench', 'confidence': 0.1}] * 5}
+    requests_mix = [
+        ('get', '/api/alerts?limit=50', None),
+        ('get', '/api/signals?limit=50', None),
+        ('post', '/api/signals/batch', batch),
+        ('get', '/api/user', None),
+    ]
+    stop.wait(rng.uniform(0, THINK_SECONDS))
+    while not stop.is_set():
+        method, path, body = rng.choice(requests_mix)
+        start = time.perf_counter()
+        response = getattr(session, method)(f'{base_url}{path}', json=body, headers=headers)
+        elapsed = time.perf_counter() - start
+        counts[response.status_code] = counts.get(response.status_code, 0) + 1
+        if response.status_code < 500:
+            latencies.append(elapsed)
+        stop.wait(rng.expovariate(1 / THINK_SECONDS))
+
+
+def hold_stream(base_url, headers, stop, opened):
+    response = requests.get(f'{base_url}/api/alerts/stream', headers=headers, stream=True)
+    assert response.status_code == 200, response.status_code
+    opened.append(response)
+    for _ in response.iter_content(chunk_size=1):
+        if stop.is_set():
+            break
+    response.close()
+
+
+def run(label, clients, seconds, worker_threads, gate_limit, streams=0):
+    with tempfile.TemporaryDirectory() as tmp:
+        app, headers = build_app(os.path.join(tmp, 'bench.db'), worker_threads, gate_limit)
+        server = PooledWSGIServer('127.0.0.1', 0, app, worker_threads)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        base_url = f'http://127.0.0.1:{server.server_port}'
+
+        stop = threading.Event()
+        opened = []
+        streamers = [threading.Thread(target=hold_stream, args=(base_url, headers, stop, opened))
+                     for _ in range(streams)]
+        for thread in streamers:
+            thread.start()
+        while len(opened) < streams:
+            time.sleep(0.01)
+
+        latencies, counts = [], {}
+        threads = [threading.Thread(target=client_loop, args=(base_url, headers, stop, i, latencies, counts))
+                   for i in range(clients)]
+        for thread in threads:
+            thread.start()
+        time.sleep(seconds)
+        stop.set()
+        for thread in threads + streamers:
+            thread.join()
+        gate = app.extensions.get('priority_gate')
+        server.shutdown()
+
+    total = sum(counts.values())
+    shed = counts.get(503, 0)
+    print(f'{label:34} {clients:3} clients  {total / seconds:6.1f} req/s  shed {shed:5} ({shed / total * 100:5.1f}%)'
+          f'  served p50 {statistics.median(latencies) * 1000:6.1f}  p95 {percentile(latencies, 95) * 1000:6.1f} ms'
+          f'  | gate limit {gate.limit if gate else "-"}')
+
+
+def main():
+    logging.getLogger('werkzeug').setLevel(logging.ERROR)
+    logging.getLogger('app').setLevel(logging.ERROR)
+    seconds = float(sys.argv[1]) if len(sys.argv) > 1 else 5
+    worker_threads = int(sys.argv[2]) if len(sys.argv) > 2 else 4
+    client_counts = [int(n) for n in sys.argv[3].split(',')] if len(sys.argv) > 3 else [4, 8, 16]
+    reserved = app_config.Config.PANIC_RESERVED_THREADS
+    slots = worker_threads - reserved
+    for clients in client_counts:
+        run('no gate', clients, seconds, worker_threads, None)
+        run(f'gate, {slots} slots', clients, seconds, worker_threads, slots)
+        run(f'gate, {slots} slots + 2 open streams', clients, seconds, worker_threads + 2, slots, streams=2)
+
+
+if __name__ == '__main__':
+    main()
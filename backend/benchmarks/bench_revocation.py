@@ -0,0 +1,73 @@
+"""HavenApp Backend - Token revocation check cost
+
+Times RevocationList.is_revoked() for tokens that were never revoked (the
+common case, answered by the Bloom filter) and for revoked ones (exact LRU),
+with a growing number of revoked tokens, and measures the filter's false
+positive rate. Then times an authenticated GET /api/user with revocation
+on and off, which is the overhead every protected request pays.
+
+Usage: python benchmarks/bench_revocation.py [revoked_counts] [requests]
+    e.g. python benchmarks/bench_revocation.py 0,10000,100000 5000
+"""
+import statistics
+import sys
+import time
+import uuid
+
+from common import make_client, auth_headers
+import config as app_config
+from revocation import LocalRevocationStore, RevocationList
+
+
+def per_call_us(fn, keys):
+    started = time.perf_counter()
+    for key in keys:
+        fn(key)
+    return (time.perf_counter() - started) / len(keys) * 1e6
+
+
+def check_cost(revoked_count, probes=100000):
+    revocations = RevocationList(LocalRevocationStore())
+    exp = time.time() + 3600
+    revoked = [str(uuid.uuid4()) for _ in range(revoked_count)]
+    for jti in revoked:
+        revocations.revoke(jti, exp)
+    revocations.is_revoked('warm-up')  # first check builds the filter from the store
+
+    fresh = [str(uuid.uuid4()) for _ in range(probes)]
+    miss_us = per_call_us(revocations.is_revoked, fresh)
+    false_positives = revocations.false_positives
+    hit_us = per_call_us(revocations.is_revoked, revoked[-1000:]) if revoked else 0.0
+    print(f'{revoked_count:>8} revoked  not revoked {miss_us:6.2f} us  revoked {hit_us:6.2f} us'
+          f'  false positives {false_positives}/{probes} ({false_positives / probes:.4%})')
+
+
+def request_cost(enabled, requests):
+    name = f'bench-revocation-{enabled}'
+    app_config.config[name] = type('BenchConfig', (app_config.TestingConfig,), {
+        'REVOCATION_ENABLED': enabled,
+        'PASSWORD_HASH_METHOD': 'pbkdf2:sha256:1000',
+    })
+    _, client = make_client(name)
+    headers = auth_headers(client)
+    samples = []
+    for _ in range(requests):
+        started = time.perf_counter()
+        response = client.get('/api/user', headers=headers)
+        samples.append(time.perf_counter() - started)
+        assert response.status_code == 200, response.get_json()
+    return statistics.median(samples) * 1e6
+
+
+def main():
+    counts = [int(n) for n in (sys.argv[1] if len(sys.argv) > 1 else '0,10000,100000').split(',')]
+    requests = int(sys.argv[2]) if len(sys.argv) > 2 else 5000
+    for count in counts:
+        check_cost(count)
+    off = request_cost(False, requests)
+    on = request_cost(True, requests)
+    print(f'GET /api/user median  revocation off {off:7.1f} us  on {on:7.1f} us  (+{on - off:.1f} us)')
+
+
+if __name__ == '__main__':
+    main()
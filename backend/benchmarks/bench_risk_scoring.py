@@ -0,0 +1,73 @@
+"""HavenApp Backend - Risk scoring cost
+
+Times the incremental per-signal update at growing history sizes and the
+NumPy batch rescore over the whole signals table.
+
+Usage: python benchmarks/bench_risk_scoring.py [total_signals] [users]
+"""
+import random
+import sys
+import time
+from datetime import datetime, timedelta
+from sqlalchemy import insert
+
+from common import make_client, auth_headers, timed
+from ids import generate_id
+from models import db, Signal, User
+from scoring import CATEGORIES, record_signals, rescore_all
+
+
+def seed_signals(user_ids, first, total, chunk=50000):
+    now = datetime.utcnow()
+    rng = random.Random(42)
+    for start in range(first, first + total, chunk):
+        rows = [{
+            'id': generate_id(),
+            'user_id': user_ids[i % len(user_ids)],
+            'category': CATEGORIES[i % len(CATEGORIES)],
+            'signal_type': 'bench_signal',
+            'confidence': rng.random(),
+            'created_at': now - timedelta(seconds=rng.randrange(30 * 86400)),
+        } for i in range(start, min(start + chunk, first + total))]
+        db.session.execute(insert(Signal), rows)
+    db.session.commit()
+
+
+def time_incremental(user_id, repeats=2000):
+    start = time.perf_counter()
+    for i in range(repeats):
+        record_signals(user_id, [(generate_id(), 'device', 0.1, datetime.utcnow())])
+        db.session.flush()
+    db.session.rollback()
+    return (time.perf_counter() - start) / repeats
+
+
+def main():
+    total = int(sys.argv[1]) if len(sys.argv) > 1 else 1000000
+    user_count = int(sys.argv[2]) if len(sys.argv) > 2 else 1000
+
+    app, client = make_client()
+    auth_headers(client)
+    with app.app_context():
+        user_ids = [User.query.first().id]
+        others = [generate_id() for _ in range(1, user_count)]
+        db.session.execute(insert(User), [
+            {'id': user_id, 'email': f'bench{i}@example.com', 'password_hash': 'x'}
+            for i, user_id in enumerate(others, 1)
+        ])
+        user_ids += others
+
+        seeded = 0
+        for size in (total // 100, total // 10, total):
+            seed_signals(user_ids, seeded, size - seeded)
+            seeded = size
+            per_signal = time_incremental(user_ids[0])
+            print(f'history {size:>9} signals  incremental update {per_signal * 1e6:8.1f} us/signal')
+
+        (users, signals), elapsed = timed(rescore_all)
+        print(f'batch rescore  {signals} signals / {users} users  {elapsed:.2f}s'
+              f'  ({signals / elapsed:,.0f} signals/s)')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,59 @@
+"""HavenApp Backend - List serialization benchmark
+
+Compares the previous list-response path (ORM query, marshmallow dump,
+stdlib json) with the current one (column-only select, precompiled Shape,
+orjson) for a page of signals and alerts, and checks both produce the same
+decoded JSON.
+
+Usage:
+    python benchmarks/bench_serialization.py [page_size] [rounds]
+"""
+import json
+import statistics
+import sys
+
+from common import make_client, timed
+from models import db, Signal, Alert, SIGNAL_SHAPE, ALERT_SHAPE
+from schemas import signals_schema, alerts_schema
+from seed import seed_users, seed_signals, seed_alerts
+
+
+def old_path(model, schema, user_id, limit):
+    rows = model.query.filter_by(user_id=user_id).order_by(model.created_at.desc(), model.id.desc()).limit(limit)
+    return json.dumps(schema.dump(rows.all()), sort_keys=True)
+
+
+def new_path(app, model, shape, user_id, limit):
+    rows = (model.query.with_entities(*shape.columns).filter_by(user_id=user_id)
+            .order_by(model.created_at.desc(), model.id.desc()).limit(limit))
+    return app.json.dumps(shape.dump_rows(rows.all()))
+
+
+def main():
+    page_size = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    rounds = int(sys.argv[2]) if len(sys.argv) > 2 else 50
+
+    app, _ = make_client('testing')
+    with app.app_context():
+        user_ids = seed_users(1)
+        seed_signals(user_ids, page_size)
+        seed_alerts(user_ids, page_size)
+        user_id = user_ids[0]
+
+        for label, model, schema, shape in (('signals', Signal, signals_schema, SIGNAL_SHAPE),
+                                            ('alerts', Alert, alerts_schema, ALERT_SHAPE)):
+            old_body = old_path(model, schema, user_id, page_size)
+            new_body = new_path(app, model, shape, user_id, page_size)
+            assert json.loads(old_body) == json.loads(new_body), f'{label}: outputs differ'
+
+            old_times = [timed(old_path, model, schema, user_id, page_size)[1] for _ in range(rounds)]
+            new_times = [timed(new_path, app, model, shape, user_id, page_size)[1] for _ in range(rounds)]
+            old_ms = statistics.median(old_times) * 1000
+            new_ms = statistics.median(new_times) * 1000
+            print(f'{label:8} page of {page_size}: ORM+marshmallow+json {old_ms:7.2f} ms   '
+                  f'columns+Shape+orjson {new_ms:7.2f} ms   ({old_ms / new_ms:.1f}x)')
+            db.session.expunge_all()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,111 @@
+"""HavenApp Backend - Write throughput against the number of shards
+
+Registers users spread over 1, 2 and 4 SQLite file shards (plus the primary,
+which holds only users), then has writer processes post signals through the
+test client for a fixed time, each process writing as its own users. A
+SQLite file takes one writer at a time, so with one database every commit
+queues behind the others; each shard added is another file taking writes
+in parallel. Reports signal writes per second and the p50/p99 request
+latency for each shard count.
+
+commit_ms adds that much time to every commit while the write lock is held,
+standing in for a durable commit on a server (fsync, replication) that a
+local SQLite file on a fast disk doesn't pay. With 0, writers on a machine
+with few cores are CPU-bound, which no number of shards helps.
+
+Usage: python benchmarks/bench_sharding.py [writers] [seconds] [commit_ms]
+    e.g. python benchmarks/bench_sharding.py 8 10 5
+"""
+import multiprocessing
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+from sqlalchemy import event
+
+from common import make_client, auth_headers
+import config as app_config
+from models import db, User
+
+USERS_PER_WRITER = 4
+
+
+def build_app(tmp, shards, migrate=True):
+    app_config.config['bench-sharding'] = type('BenchConfig', (app_config.TestingConfig,), {
+        'SCHEMA_AUTO_MIGRATE': migrate,
+        'SQLALCHEMY_DATABASE_URI': f'sqlite:///{os.path.join(tmp, "primary.db")}',
+        'DATABASE_SHARD_URLS': [f'sqlite:///{os.path.join(tmp, f"shard{i}.db")}' for i in range(shards)],
+        'PASSWORD_HASH_METHOD': 'pbkdf2:sha256:1000',
+    })
+    return make_client('bench-sharding')
+
+
+def write(tmp, shards, commit_ms, users, seconds, ready, results):
+    # A fresh app per process: engines and pools must not cross a fork
+    app, client = build_app(tmp, shards, migrate=False)
+    if commit_ms:
+        with app.app_context():
+            for engine in db.engines.values():
+                event.listen(engine, 'commit', lambda connection: time.sleep(commit_ms / 1000))
+    headers = [auth_headers(client, email) for email in users]
+    # Every writer starts together, once all have logged in
+    ready.wait()
+    samples = []
+    deadline = time.perf_counter() + seconds
+    i = 0
+    while time.perf_counter() < deadline:
+        started = time.perf_counter()
+        response = client.post('/api/signals', json={'category': 'device', 'type': 'screen_time', 'confidence': 0.4},
+                               headers=headers[i % len(headers)])
+        samples.append(time.perf_counter() - started)
+        assert response.status_code == 201, response.get_json()
+        i += 1
+    results.put(samples)
+
+
+def run(shards, writers, seconds, commit_ms):
+    with tempfile.TemporaryDirectory() as tmp:
+        app, client = build_app(tmp, shards)
+        users = [[f'writer{w}-{u}@example.com' for u in range(USERS_PER_WRITER)] for w in range(writers)]
+        placements = {}
+        for emails in users:
+            for email in emails:
+                auth_headers(client, email)
+        with app.app_context():
+            for shard, in db.session.execute(db.select(User.shard)):
+                placements[shard] = placements.get(shard, 0) + 1
+
+        context = multiprocessing.get_context('fork')
+        ready, results = context.Barrier(writers), context.Queue()
+        processes = [context.Process(target=write, args=(tmp, shards, commit_ms, emails, seconds, ready, results))
+                     for emails in users]
+        for process in processes:
+            process.start()
+        samples = []
+        for _ in processes:
+            samples += results.get()
+        for process in processes:
+            process.join()
+
+    samples.sort()
+    print(f'{shards} shard(s) {dict(sorted(placements.items()))}: {len(samples) / seconds:8.1f} writes/s'
+          f'  p50 {statistics.median(samples) * 1000:6.2f} ms  p99 {samples[int(len(samples) * 0.99)] * 1000:7.2f} ms')
+    return len(samples) / seconds
+
+
+def main():
+    writers = int(sys.argv[1]) if len(sys.argv) > 1 else 8
+    seconds = float(sys.argv[2]) if len(sys.argv) > 2 else 10
+    commit_ms = float(sys.argv[3]) if len(sys.argv) > 3 else 5
+    print(f'{writers} writer processes, {seconds:g}s, {commit_ms:g} ms per commit, {os.cpu_count()} CPU(s)')
+    baseline = None
+    for shards in (1, 2, 4):
+        throughput = run(shards, writers, seconds, commit_ms)
+        baseline = baseline or throughput
+        print(f'  {throughput / baseline:.2f}x the single shard')
+
+
+if __name__ == '__main__':
+    main()
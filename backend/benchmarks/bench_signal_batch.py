@@ -0,0 +1,53 @@
+"""HavenApp Backend - Per-signal vs batch ingestion throughput
+
+Usage: python benchmarks/bench_signal_batch.py [total_signals] [batch_size]
+"""
+import sys
+
+from common import make_client, auth_headers, timed
+
+
+def sample_signal(i):
+    return {
+        'category': ('communication', 'movement', 'device', 'self_report')[i % 4],
+        'type': 'bench_signal',
+        'confidence': (i % 100) / 100.0,
+        'metadata': {'seq': i},
+    }
+
+
+def ingest_single(client, headers, total):
+    for i in range(total):
+        response = client.post('/api/signals', json=sample_signal(i), headers=headers)
+        assert response.status_code == 201, response.get_json()
+
+
+def ingest_batch(client, headers, total, batch_size):
+    for start in range(0, total, batch_size):
+        items = [sample_signal(i) for i in range(start, min(start + batch_size, total))]
+        response = client.post('/api/signals/batch', json={'signals': items}, headers=headers)
+        assert response.status_code == 201, response.get_json()
+
+
+def main():
+    total = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    batch_size = int(sys.argv[2]) if len(sys.argv) > 2 else 500
+
+    _, client = make_client()
+    headers = auth_headers(client)
+    # Movement signals need location consent, which is off by default
+    client.put('/api/user/consent', json={'location_tracking': True}, headers=headers)
+
+    _, single_elapsed = timed(ingest_single, client, headers, total)
+    _, batch_elapsed = timed(ingest_batch, client, headers, total, batch_size)
+
+    single_rate = total / single_elapsed
+    batch_rate = total / batch_elapsed
+    print(f'POST /api/signals        {total} signals  {single_elapsed:8.3f}s  {single_rate:10.0f} signals/s')
+    print(f'POST /api/signals/batch  {total} signals  {batch_elapsed:8.3f}s  {batch_rate:10.0f} signals/s'
+          f'  (batch size {batch_size})')
+    print(f'speedup: {batch_rate / single_rate:.1f}x')
+
+
+if __name__ == '__main__':
+    main()
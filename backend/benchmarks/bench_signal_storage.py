@@ -0,0 +1,109 @@
+"""HavenApp Backend - Signal storage layout benchmark
+
+Stores the same synthetic signals once per SIGNAL_STORAGE layout, each in
+its own SQLite file, and reports:
+
+- bytes per signal for the signals data plus its indexes (SQLite dbstat,
+  after VACUUM)
+- range queries through the store: the newest page, a page starting at a
+  random point in the last 30 days, and a user's full history (export)
+- appending 50-signal batches
+
+The bucket layout is filled by packing the seeded rows (`flask
+pack-signals`), which is timed too.
+
+Usage: python benchmarks/bench_signal_storage.py [signals] [users] [--metadata]
+"""
+import os
+import random
+import statistics
+import sys
+import tempfile
+from datetime import datetime, timedelta
+
+from common import make_client, timed
+import config as app_config
+from models import db
+from seed import seed_users, seed_signals
+from signal_store import pack_signal_rows, signal_store
+
+TABLES = {
+    'rows': ('signals', 'ix_signals_user_id_created_at', 'ix_signals_created_at', 'sqlite_autoindex_signals_1'),
+    'buckets': ('signal_buckets', 'ix_signal_buckets_user_id_last_at', 'ix_signal_buckets_last_at',
+                'sqlite_autoindex_signal_buckets_1'),
+}
+
+
+def storage_bytes(storage):
+    db.session.commit()
+    with db.engine.connect() as connection:
+        connection.exec_driver_sql('VACUUM')
+        names = ', '.join(f"'{name}'" for name in TABLES[storage])
+        return connection.exec_driver_sql(
+            f'SELECT COALESCE(SUM(pgsize), 0) FROM dbstat WHERE name IN ({names})'
+        ).scalar()
+
+
+def median_ms(samples):
+    return statistics.median(samples) * 1000
+
+
+def run(storage, total, users, metadata):
+    with tempfile.TemporaryDirectory() as tmp:
+        name = f'bench-storage-{storage}'
+        app_config.config[name] = type('BenchConfig', (app_config.TestingConfig,), {
+            'SQLALCHEMY_DATABASE_URI': f'sqlite:///{os.path.join(tmp, "bench.db")}',
+            'SIGNAL_STORAGE': storage,
+        })
+        app, _ = make_client(name)
+        with app.app_context():
+            store = signal_store()
+            user_ids = seed_users(users)
+            seed_signals(user_ids, total, metadata=metadata)
+            pack_seconds = None
+            if storage == 'buckets':
+                _, pack_seconds = timed(pack_signal_rows, store, users_per_batch=users)
+            size = storage_bytes(storage)
+
+            rng = random.Random(1)
+            now = datetime.utcnow()
+            newest, random_page, history = [], [], []
+            for _ in range(50):
+                user_id = rng.choice(user_ids)
+                newest.append(timed(store.page, user_id, 50)[1])
+                position = (now - timedelta(seconds=rng.randrange(30 * 86400)), 'ffffffff')
+                rows, _ = store.page(user_id, 200, position)
+                random_page.append(timed(store.page, user_id, 200, position)[1])
+                assert all((row[5], row[0]) < position for row in rows)
+            for user_id in user_ids[:10]:
+                _, elapsed = timed(lambda: sum(1 for _ in store.iter_user(user_id)))
+                history.append(elapsed)
+
+            batch = [{'category': 'device', 'type': 'bench', 'confidence': 0.5}] * 50
+            appends = []
+            for i in range(40):
+                def append():
+                    store.add(user_ids[i % users], batch, datetime.utcnow())
+                    db.session.commit()
+                appends.append(timed(append)[1])
+            db.session.remove()
+
+    pack = f'  packed in {pack_seconds:.1f} s' if pack_seconds is not None else ''
+    print(f'{storage:8} {size / total:7.1f} bytes/signal   newest page {median_ms(newest):6.2f} ms   '
+          f'page of 200 at random point {median_ms(random_page):6.2f} ms   '
+          f'full history ({total // users} signals) {median_ms(history):7.1f} ms   '
+          f'append 50 {median_ms(appends) * 1000 / 50:6.1f} us/signal{pack}')
+
+
+def main():
+    args = [arg for arg in sys.argv[1:] if not arg.startswith('--')]
+    total = int(args[0]) if args else 200000
+    users = int(args[1]) if len(args) > 1 else 20
+    metadata = '--metadata' in sys.argv
+    print(f'{total} signals over {users} users, 30 days{", with metadata" if metadata else ""}')
+    for storage in ('rows', 'buckets'):
+        run(storage, total, users, metadata)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,74 @@
+"""HavenApp Backend - Signal summary benchmark
+
+Seeds one user with a growing number of signals over 30 days, rebuilds the
+rollups, and times GET /api/signals/summary (hourly for the last 7 days and
+daily for 30 days) against the same aggregate computed from the raw signals
+rows with GROUP BY. The summary should stay flat as the history grows.
+
+Usage: python benchmarks/bench_signal_summary.py [scales] [rounds]
+    e.g. python benchmarks/bench_signal_summary.py 1000,100000,1000000 20
+"""
+import statistics
+import sys
+from datetime import datetime, timedelta
+from sqlalchemy import func, select
+
+from common import make_client, auth_headers
+from models import db, Signal, User
+import rollups
+from seed import seed_signals
+from signal_store import signal_store, epoch_seconds
+
+EMAIL = 'bench@example.com'
+
+
+def raw_summary(user_id, start):
+    hour = func.floor(epoch_seconds(Signal.created_at) / 3600)
+    return db.session.execute(
+        select(hour, Signal.category, func.count(), func.avg(Signal.confidence))
+        .where(Signal.user_id == user_id, Signal.created_at >= start)
+        .group_by(hour, Signal.category)
+    ).all()
+
+
+def median_ms(fn, rounds):
+    samples = []
+    for _ in range(rounds):
+        started = datetime.utcnow()
+        fn()
+        samples.append((datetime.utcnow() - started).total_seconds())
+    return statistics.median(samples) * 1000
+
+
+def main():
+    scales = [int(n) for n in (sys.argv[1] if len(sys.argv) > 1 else '1000,10000,100000').split(',')]
+    rounds = int(sys.argv[2]) if len(sys.argv) > 2 else 20
+
+    for total in scales:
+        app, client = make_client('testing')
+        headers = auth_headers(client, EMAIL)
+        with app.app_context():
+            user_id = User.query.filter_by(email=EMAIL).first().id
+            seed_signals([user_id], total, metadata=False)
+            rollups.rebuild(signal_store())
+            week_ago = datetime.utcnow() - timedelta(days=7)
+
+            def hourly():
+                response = client.get('/api/signals/summary?bucket=hour&from=' + week_ago.isoformat(), headers=headers)
+                assert response.status_code == 200
+
+            def daily():
+                response = client.get('/api/signals/summary?bucket=day&from='
+                                      + (datetime.utcnow() - timedelta(days=30)).isoformat(), headers=headers)
+                assert response.status_code == 200
+
+            # Fresh ETag each round, so every request is served in full
+            bump = lambda fn: (lambda: (app.extensions['version_store'].bump(user_id, ['signals']), fn()))
+            print(f'{total:>9} signals   summary hourly/7d {median_ms(bump(hourly), rounds):6.2f} ms   '
+                  f'daily/30d {median_ms(bump(daily), rounds):6.2f} ms   '
+                  f'raw GROUP BY hourly/7d {median_ms(lambda: raw_summary(user_id, week_ago), rounds):8.2f} ms')
+            db.session.remove()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,111 @@
+"""HavenApp Backend - Worker startup benchmark
+
+Boots the app the way a fresh gunicorn worker does, each time in a new
+interpreter, and reports the median of:
+
+- importing app.py
+- create_app('production')
+- the first request (GET /api/health)
+- SQL statements issued before that request is served
+
+once as workers now boot (schema left to `flask migrate`) and once with the
+old per-boot db.create_all(), against an already migrated SQLite file. A
+third row forks a worker from an app loaded in the parent, as gunicorn
+--preload does when scaling out or replacing a crashed worker.
+
+Against SQLite the first two rows are within noise of each other (about
+300 ms, nearly all of it importing app.py): leaving DDL to `flask migrate`
+drops the statements sent before the first response, not boot time. Only
+the forked row is faster, because it skips the import and create_app.
+
+Usage:
+    python benchmarks/bench_startup.py [runs]
+"""
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+BACKEND = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def child(mode):
+    started = time.perf_counter()
+    sys.path.insert(0, BACKEND)
+    import app as app_module
+    imported = time.perf_counter()
+
+    from sqlalchemy import event
+    from sqlalchemy.engine import Engine
+    statements = []
+    event.listen(Engine, 'before_cursor_execute', lambda *args: statements.append(args[2]))
+
+    app = app_module.create_app('production')
+    if mode == 'preload':
+        forked = time.perf_counter()
+        read_end, write_end = os.pipe()
+        pid = os.fork()
+        if pid == 0:
+            response = app.test_client().get('/api/health')
+            assert response.status_code == 200, response.status_code
+            os.write(write_end, json.dumps({
+                'import': 0.0,
+                'create_app': 0.0,
+                'first_request': time.perf_counter() - forked,
+                'sql_statements': len(statements),
+            }).encode())
+            os._exit(0)
+        os.waitpid(pid, 0)
+        print(os.read(read_end, 65536).decode())
+        return
+    if mode == 'create_all':
+        from models import db
+        with app.app_context():
+            db.create_all()
+    created = time.perf_counter()
+
+    response = app.test_client().get('/api/health')
+    assert response.status_code == 200, response.status_code
+    served = time.perf_counter()
+
+    print(json.dumps({
+        'import': imported - started,
+        'create_app': created - imported,
+        'first_request': served - created,
+        'sql_statements': len(statements),
+    }))
+
+
+def run(mode, runs, env):
+    samples = []
+    for _ in range(runs):
+        out = subprocess.run([sys.executable, '-W', 'ignore', __file__, '--child', mode],
+                             env=env, cwd=BACKEND, capture_output=True, text=True, check=True)
+        samples.append(json.loads(out.stdout.strip().splitlines()[-1]))
+    return {key: statistics.median(sample[key] for sample in samples) for key in samples[0]}
+
+
+def main():
+    runs = int(sys.argv[1]) if len(sys.argv) > 1 else 10
+    with tempfile.TemporaryDirectory() as tmp:
+        env = dict(os.environ, DATABASE_URL=f'sqlite:///{os.path.join(tmp, "startup.db")}', FLASK_ENV='production')
+        subprocess.run([sys.executable, '-W', 'ignore', '-m', 'flask', '--app', 'wsgi', 'migrate'],
+                       env=env, cwd=BACKEND, capture_output=True, check=True)
+
+        for label, mode in (('create_all per boot', 'create_all'), ('no DDL per boot', 'none'),
+                            ('forked from preloaded app', 'preload')):
+            r = run(mode, runs, env)
+            total = r['import'] + r['create_app'] + r['first_request']
+            print(f'{label:30} import {r["import"] * 1000:7.1f} ms  create_app {r["create_app"] * 1000:7.1f} ms  '
+                  f'first request {r["first_request"] * 1000:6.1f} ms  total {total * 1000:7.1f} ms  '
+                  f'SQL before first response {r["sql_statements"]:.0f}')
+
+
+if __name__ == '__main__':
+    if len(sys.argv) > 2 and sys.argv[1] == '--child':
+        child(sys.argv[2])
+    else:
+        main()
@@ -0,0 +1,29 @@
+"""HavenApp Backend - Shared benchmark helpers"""
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app import create_app  # noqa: E402
+
+
+def make_client(config_name='testing'):
+    """Build an app through the real factory and return (app, test_client)"""
+    app = create_app(config_name)
+    return app, app.test_client()
+
+
+def auth_headers(client, email='bench@example.com', password='benchmark-password'):
+    """Register (or log in) a benchmark user and return Authorization headers"""
+    response = client.post('/api/auth/register', json={'email': email, 'password': password})
+    if response.status_code != 201:
+        response = client.post('/api/auth/login', json={'email': email, 'password': password})
+    return {'Authorization': f"Bearer {response.get_json()['access_token']}"}
+
+
+def timed(fn, *args, **kwargs):
+    """Run fn once and return (result, elapsed seconds)"""
+    start = time.perf_counter()
+    result = fn(*args, **kwargs)
+    return result, time.perf_counter() - start
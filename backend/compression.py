@@ -0,0 +1,110 @@
+"""HavenApp Backend - Response compression
+
+Responses of COMPRESS_MIMETYPES of at least COMPRESS_MIN_SIZE bytes are
+compressed with the coding the client ranks highest in Accept-Encoding:
+brotli when the brotli package is installed, else gzip. Smaller bodies go
+out as they are, since compressing them costs more time than it saves on the
+wire. Streamed responses (the alert stream, data export) are left alone.
+
+A compressed body is a different representation from the uncompressed one,
+so its ETag is made weak; conditional GETs compare tags weakly (see
+versions.not_modified) and keep answering 304 either way.
+"""
+import gzip
+import logging
+import threading
+from flask import current_app, request
+
+try:
+    import brotli
+except ImportError:  # pragma: no cover - optional, gzip only without it
+    brotli = None
+
+logger = logging.getLogger(__name__)
+
+
+class ResponseCompressor:
+    """after_request hook compressing eligible responses"""
+
+    def __init__(self, app):
+        config = app.config
+        self.min_size = config.get('COMPRESS_MIN_SIZE', 1024)
+        self.mimetypes = set(config.get('COMPRESS_MIMETYPES', ('application/json',)))
+        self.gzip_level = config.get('COMPRESS_GZIP_LEVEL', 6)
+        self.brotli_quality = config.get('COMPRESS_BROTLI_QUALITY', 4)
+        # Preferred first when the client ranks codings equally
+        self.codings = (('br',) if brotli is not None else ()) + ('gzip',)
+        self._lock = threading.Lock()
+        self.compressed = {coding: 0 for coding in self.codings}
+        self.skipped_small = 0
+        self.bytes_in = 0
+        self.bytes_out = 0
+
+    def _negotiate(self):
+        accepted = request.accept_encodings
+        best, best_quality = None, 0
+        for coding in self.codings:
+            quality = accepted.quality(coding)
+            if quality > best_quality:
+                best, best_quality = coding, quality
+        return best
+
+    def _compress(self, coding, data):
+        if coding == 'br':
+            return brotli.compress(data, quality=self.brotli_quality)
+        return gzip.compress(data, compresslevel=self.gzip_level, mtime=0)
+
+    def after_request(self, response):
+        if (response.direct_passthrough or response.is_streamed or response.mimetype not in self.mimetypes
+                or response.status_code < 200 or response.status_code in (204, 206, 304)
+                or 'Content-Encoding' in response.headers):
+            return response
+        # The body depends on Accept-Encoding whenever it could be compressed
+        response.vary.add('Accept-Encoding')
+        coding = self._negotiate()
+        if coding is None:
+            return response
+        data = response.get_data()
+        if len(data) < self.min_size:
+            with self._lock:
+                self.skipped_small += 1
+            return response
+
+        body = self._compress(coding, data)
+        response.set_data(body)
+        response.headers['Content-Encoding'] = coding
+        etag, weak = response.get_etag()
+        if etag and not weak:
+            response.set_etag(etag, weak=True)
+        with self._lock:
+            self.compressed[coding] += 1
+            self.bytes_in += len(data)
+            self.bytes_out += len(body)
+        return response
+
+    def stats(self):
+        with self._lock:
+            stats = {f'compressed_{coding}': count for coding, count in self.compressed.items()}
+            stats.update({
+                'skipped_small': self.skipped_small,
+                'bytes_in': self.bytes_in,
+                'bytes_out': self.bytes_out,
+                'ratio': round(self.bytes_out / self.bytes_in, 4) if self.bytes_in else None,
+            })
+            return stats
+
+
+def init_compression(app):
+    if not app.config.get('COMPRESS_ENABLED', True):
+        return None
+    compressor = ResponseCompressor(app)
+    app.extensions['compression'] = compressor
+    app.after_request(compressor.after_request)
+    if brotli is None:
+        logger.info('brotli is not installed; responses are compressed with gzip only')
+    return compressor
+
+
+def compression_stats():
+    compressor = current_app.extensions.get('compression')
+    return compressor.stats() if compressor else {}
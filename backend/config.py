@@ -7,40 +7,262 @@ class Config:
     SQLALCHEMY_DATABASE_URI = os.environ.get('DATABASE_URL', 'sqlite:///havenapp.db')
     SQLALCHEMY_TRACK_MODIFICATIONS = False
     
+    # Apply pending migrations inside create_app. Off by default so workers
+    # boot without DDL; run `flask --app wsgi migrate` once per deploy instead.
+    SCHEMA_AUTO_MIGRATE = False
+    
+    # Engine profile (see database.py). Pool settings apply to server
+    # databases, SQLITE_* to SQLite files.
+    DB_POOL_SIZE = 5
+    DB_MAX_OVERFLOW = 10
+    DB_POOL_TIMEOUT = 30  # seconds to wait for a free connection
+    DB_POOL_PRE_PING = True
+    DB_POOL_RECYCLE = 1800  # seconds
+    DB_STATEMENT_TIMEOUT_MS = int(os.environ['DB_STATEMENT_TIMEOUT_MS']) if os.environ.get('DB_STATEMENT_TIMEOUT_MS') else None
+    SQLITE_JOURNAL_MODE = 'wal'
+    SQLITE_SYNCHRONOUS = 'normal'
+    SQLITE_BUSY_TIMEOUT_MS = 5000
+    
+    # Read replica for @read_only GET handlers; a user's reads stay on the
+    # primary for DB_READ_YOUR_WRITES_SECONDS after they write, so keep it
+    # above the replica's worst lag (ETags would otherwise cache stale pages)
+    DATABASE_REPLICA_URL = os.environ.get('DATABASE_REPLICA_URL')
+    DB_READ_YOUR_WRITES_SECONDS = 5
+    
+    # Shards for per-user tables (see sharding.py), comma-separated URLs in
+    # a fixed order: users.shard records positions in this list, so only
+    # append to it, then `flask rebalance-shards`. Empty keeps everything on
+    # SQLALCHEMY_DATABASE_URI.
+    DATABASE_SHARD_URLS = [url.strip() for url in os.environ.get('DATABASE_SHARD_URLS', '').split(',') if url.strip()]
+    SHARD_MOVE_CHUNK_SIZE = 1000  # rows copied or deleted per transaction
+    SHARD_MOVE_CHUNK_PAUSE = 0.01  # seconds between chunks
+    SHARD_MOVE_SETTLE_SECONDS = 5  # longest request still in flight after a move holds writes
+    
     # JWT Configuration
     JWT_SECRET_KEY = os.environ.get('JWT_SECRET_KEY', 'jwt-dev-key')
     JWT_ACCESS_TOKEN_EXPIRES = 1  # hours
     JWT_REFRESH_TOKEN_EXPIRES = 30  # days
     
+    # Password hashing: any werkzeug method string (e.g. 'scrypt:32768:8:1').
+    # Hashes made with another method or cost are upgraded on next login.
+    # With offload on, hashing runs in a per-worker process pool and requests
+    # beyond PASSWORD_HASH_MAX_PENDING are answered 503 instead of queueing.
+    PASSWORD_HASH_METHOD = os.environ.get('PASSWORD_HASH_METHOD', 'pbkdf2:sha256:600000')
+    PASSWORD_HASH_OFFLOAD = True
+    PASSWORD_HASH_WORKERS = 2
+    PASSWORD_HASH_MAX_PENDING = 16
+    PASSWORD_HASH_TIMEOUT = 10  # seconds
+    PASSWORD_HASH_NICE = 10  # scheduling priority drop for pool processes
+    
+    # Panic alerts: retries carrying the same Idempotency-Key get the first
+    # attempt's response for IDEMPOTENCY_TTL seconds. With WORKER_THREADS set
+    # to gunicorn's --threads, PANIC_RESERVED_THREADS of them per worker are
+    # kept for panic alerts by shedding other requests beyond
+    # PRIORITY_GATE_LIMIT (default: the rest of the threads; see priority.py).
+    IDEMPOTENCY_BACKEND = os.environ.get('IDEMPOTENCY_BACKEND', 'redis' if os.environ.get('REDIS_URL') else 'local')
+    IDEMPOTENCY_TTL = 86400  # seconds
+    IDEMPOTENCY_WAIT_SECONDS = 2.0  # how long a retry waits for an in-flight first attempt
+    WORKER_THREADS = int(os.environ['WORKER_THREADS']) if os.environ.get('WORKER_THREADS') else None
+    PANIC_RESERVED_THREADS = 1
+    PRIORITY_GATE_LIMIT = int(os.environ['PRIORITY_GATE_LIMIT']) if os.environ.get('PRIORITY_GATE_LIMIT') else None
+    
+    # Emergency contact notifications (see notifications.py): panic alerts and
+    # alerts at or above NOTIFY_RISK_THRESHOLD are sent to the user's contacts
+    # when they consented to emergency_sharing. Transports: email 'smtp',
+    # sms 'webhook', or 'log' for either (nothing is sent).
+    NOTIFY_ENABLED = True
+    NOTIFY_RISK_THRESHOLD = 0.8
+    NOTIFY_WORKERS = 4  # delivery threads per worker process
+    NOTIFY_QUEUE_SIZE = 10000
+    NOTIFY_MAX_ATTEMPTS = 5
+    NOTIFY_BACKOFF_SECONDS = 2.0  # doubled after each failed attempt
+    NOTIFY_BACKOFF_MAX_SECONDS = 300.0
+    NOTIFY_CONTACT_RATE = 5  # messages per contact and channel...
+    NOTIFY_CONTACT_RATE_WINDOW = 60.0  # ...per this many seconds
+    NOTIFY_BATCH_MAX = 20  # alerts combined into one waiting message
+    NOTIFY_EMAIL_TRANSPORT = os.environ.get('NOTIFY_EMAIL_TRANSPORT', 'smtp' if os.environ.get('NOTIFY_SMTP_HOST') else 'log')
+    NOTIFY_SMTP_HOST = os.environ.get('NOTIFY_SMTP_HOST')
+    NOTIFY_SMTP_PORT = int(os.environ.get('NOTIFY_SMTP_PORT', 587))
+    NOTIFY_SMTP_USERNAME = os.environ.get('NOTIFY_SMTP_USERNAME')
+    NOTIFY_SMTP_PASSWORD = os.environ.get('NOTIFY_SMTP_PASSWORD')
+    NOTIFY_SMTP_STARTTLS = True
+    NOTIFY_EMAIL_SENDER = os.environ.get('NOTIFY_EMAIL_SENDER', 'alerts@havenapp.local')
+    NOTIFY_SMS_TRANSPORT = os.environ.get('NOTIFY_SMS_TRANSPORT', 'webhook' if os.environ.get('NOTIFY_SMS_WEBHOOK_URL') else 'log')
+    NOTIFY_SMS_WEBHOOK_URL = os.environ.get('NOTIFY_SMS_WEBHOOK_URL')
+    NOTIFY_SMS_WEBHOOK_TOKEN = os.environ.get('NOTIFY_SMS_WEBHOOK_TOKEN')
+    
+    # Emergency contacts per user
+    CONTACTS_MAX = 10
+    
     # Encryption
     ENCRYPTION_KEY = os.environ.get('ENCRYPTION_KEY', None)
     
+    # Redis: shared state across gunicorn workers. Required with more than
+    # one worker process, since per-process ('local') revocation lists would
+    # each see only their own logouts.
+    REDIS_URL = os.environ.get('REDIS_URL')
+    # gunicorn worker processes; gunicorn itself reads WEB_CONCURRENCY as the
+    # default for -w, so set it rather than passing -w
+    WORKER_PROCESSES = int(os.environ.get('WEB_CONCURRENCY', 1))
+    
     # Rate Limiting
     RATELIMIT_ENABLED = True
     RATELIMIT_STORAGE_URL = os.environ.get('REDIS_URL', 'memory://')
     
+    # Authenticated user cache: 'local' keeps it per worker, 'redis' also
+    # broadcasts invalidations to every worker over REDIS_URL
+    USER_CACHE_ENABLED = True
+    USER_CACHE_BACKEND = os.environ.get('USER_CACHE_BACKEND', 'redis' if os.environ.get('REDIS_URL') else 'local')
+    USER_CACHE_SIZE = 10000
+    USER_CACHE_TTL = 60  # seconds
+    
+    # Consent snapshots checked on signal ingestion (see consent.py); each is
+    # retired by the user's consent version, the TTL only bounds out-of-band edits.
+    # Off without a version store every worker shares (several workers, no Redis)
+    CONSENT_CACHE_ENABLED = True
+    CONSENT_CACHE_SIZE = 10000
+    CONSENT_CACHE_TTL = 300  # seconds
+    
+    # Token revocation (logout): 'local' keeps the denylist per process (one
+    # worker only; gunicorn refuses to serve it from more), 'redis' shares it
+    # over REDIS_URL and broadcasts each revocation to every worker's Bloom
+    # filter, which is rebuilt every REVOCATION_REBUILD_SECONDS
+    REVOCATION_ENABLED = True
+    REVOCATION_BACKEND = os.environ.get('REVOCATION_BACKEND', 'redis' if os.environ.get('REDIS_URL') else 'local')
+    REVOCATION_BLOOM_CAPACITY = 100000
+    REVOCATION_BLOOM_ERROR_RATE = 0.001
+    REVOCATION_EXACT_SIZE = 10000
+    REVOCATION_REBUILD_SECONDS = 3600
+    
+    # ETag version counters for conditional GETs: 'local' is per process
+    # (single worker only; ETags are off with more), 'redis' is shared by
+    # every worker over REDIS_URL
+    VERSION_STORE_BACKEND = os.environ.get('VERSION_STORE_BACKEND', 'redis' if os.environ.get('REDIS_URL') else 'local')
+    
+    # Alert event stream (GET /api/alerts/stream): 'local' publishes within
+    # the process, 'redis' across every worker over REDIS_URL
+    EVENT_BROKER_BACKEND = os.environ.get('EVENT_BROKER_BACKEND', 'redis' if os.environ.get('REDIS_URL') else 'local')
+    STREAM_HEARTBEAT_SECONDS = 15
+    STREAM_QUEUE_SIZE = 100  # events a slow client may fall behind before it is disconnected
+    STREAM_REPLAY_SIZE = 200  # recent events kept per user for Last-Event-ID resume
+    STREAM_REPLAY_TTL = 86400  # seconds
+    # Open streams per worker. A threaded worker (WORKER_THREADS) holds fewer:
+    # its threads less PANIC_RESERVED_THREADS and PRIORITY_GATE_LIMIT
+    STREAM_MAX_CONNECTIONS = int(os.environ.get('STREAM_MAX_CONNECTIONS', 1000))
+    
     # Logging
     LOG_LEVEL = os.environ.get('LOG_LEVEL', 'INFO')
     
-    # Data Retention
+    # Metrics (GET /api/metrics, Prometheus text format). Set
+    # METRICS_MULTIPROC_DIR to a directory shared by the gunicorn workers to
+    # report totals for the whole server; METRICS_SLOW_REQUEST_MS logs slower
+    # requests with their SQL; METRICS_TOKEN requires a bearer token to scrape,
+    # and with METRICS_TOKEN_REQUIRED (production) the endpoint is closed without one.
+    METRICS_ENABLED = True
+    METRICS_MULTIPROC_DIR = os.environ.get('METRICS_MULTIPROC_DIR')
+    METRICS_FLUSH_INTERVAL = 5  # seconds
+    METRICS_SLOW_REQUEST_MS = int(os.environ['METRICS_SLOW_REQUEST_MS']) if os.environ.get('METRICS_SLOW_REQUEST_MS') else None
+    METRICS_TOKEN = os.environ.get('METRICS_TOKEN')
+    METRICS_TOKEN_REQUIRED = False
+    
+    # Risk scoring: passive alerts are raised when the decayed, weighted
+    # signal score crosses RISK_ALERT_THRESHOLD and re-armed below RISK_ALERT_RESET
+    RISK_CATEGORY_WEIGHTS = {
+        'communication': 0.35,
+        'movement': 0.25,
+        'device': 0.2,
+        'self_report': 0.6,
+    }
+    RISK_DECAY_HALF_LIFE_HOURS = 24
+    RISK_ALERT_THRESHOLD = 0.7
+    RISK_ALERT_RESET = 0.5
+    
+    # Audit logging: 'transaction' commits audit rows with the change they
+    # describe, 'sync' commits them separately once that change has committed,
+    # 'async' then batches them in a background writer (see audit.py)
+    AUDIT_DURABILITY = os.environ.get('AUDIT_DURABILITY', 'transaction')
+    AUDIT_BATCH_SIZE = 200
+    AUDIT_FLUSH_INTERVAL = 1.0  # seconds
+    AUDIT_QUEUE_SIZE = 10000
+    
+    # Data Retention (enforced by `flask purge-expired` and, when
+    # RETENTION_SWEEP_INTERVAL_HOURS is set, a background sweep)
     SIGNAL_RETENTION_DAYS = 30
+    ALERT_RETENTION_DAYS = 180  # acknowledged alerts only
+    AUDIT_RETENTION_DAYS = 365
+    SIGNAL_ROLLUP_RETENTION_DAYS = 365  # hourly/daily aggregates outlive the raw signals
     SHARE_EXPIRY_DAYS = 7
+    RETENTION_BATCH_SIZE = 500
+    RETENTION_BATCH_PAUSE = 0.05  # seconds between batches
+    RETENTION_SWEEP_INTERVAL_HOURS = 0
+    
+    # Account deletion (DELETE /api/user): rows removed per transaction, and
+    # how long a runner's claim on a job lasts before another may resume it
+    ACCOUNT_DELETION_CHUNK_SIZE = 1000
+    ACCOUNT_DELETION_CHUNK_PAUSE = 0.01  # seconds between chunks
+    ACCOUNT_DELETION_LEASE_SECONDS = 60
+    ACCOUNT_DELETION_POLL_SECONDS = 30  # also how soon an abandoned job is noticed
+    ACCOUNT_DELETION_MAX_ATTEMPTS = 5
     
-    # API Settings
+    # API Settings (applied to app.json; Flask 2.3 no longer reads the
+    # JSON_*/JSONIFY_* keys itself). Indented output is for development only.
     JSON_SORT_KEYS = False
-    JSONIFY_PRETTYPRINT_REGULAR = True
+    JSON_PRETTYPRINT = False
+    
+    # Response compression (see compression.py): brotli when installed, else
+    # gzip, for bodies of at least COMPRESS_MIN_SIZE bytes
+    COMPRESS_ENABLED = True
+    COMPRESS_MIN_SIZE = 1024  # bytes
+    COMPRESS_MIMETYPES = ('application/json', 'text/plain')
+    COMPRESS_GZIP_LEVEL = 6
+    COMPRESS_BROTLI_QUALITY = 4  # 0-11; higher costs far more CPU per response
+    
+    # Pagination (GET /api/alerts, GET /api/signals)
+    PAGE_SIZE_DEFAULT = 50
+    PAGE_SIZE_MAX = 200
+    
+    # Signal summary (GET /api/signals/summary): longest range per request
+    SUMMARY_MAX_HOURS = 24 * 31
+    SUMMARY_MAX_DAYS = 366
+    
+    # Batch signal ingestion (POST /api/signals/batch)
+    SIGNAL_BATCH_MAX = 500
+    
+    # Signal layout (see signal_store.py): 'rows' stores one row per signal,
+    # 'buckets' packs each user's signals per SIGNAL_BUCKET_SECONDS window.
+    # Move existing rows with `flask pack-signals` after switching.
+    SIGNAL_STORAGE = os.environ.get('SIGNAL_STORAGE', 'rows')
+    SIGNAL_BUCKET_SECONDS = 3600
+    SIGNAL_BUCKET_MAX_SIGNALS = 2000
+    
+    # Data export (GET /api/user/export): rows fetched per server-side chunk
+    EXPORT_CHUNK_SIZE = 1000
 
 class DevelopmentConfig(Config):
     DEBUG = True
     TESTING = False
+    JSON_PRETTYPRINT = True
+    SCHEMA_AUTO_MIGRATE = True
 
 class TestingConfig(Config):
     TESTING = True
     SQLALCHEMY_DATABASE_URI = 'sqlite:///:memory:'
+    SCHEMA_AUTO_MIGRATE = True  # every in-memory database starts empty
     JWT_ACCESS_TOKEN_EXPIRES = 1  # minutes for testing
+    PASSWORD_HASH_OFFLOAD = False
+    NOTIFY_EMAIL_TRANSPORT = 'stub'
+    NOTIFY_SMS_TRANSPORT = 'stub'
 
 class ProductionConfig(Config):
     DEBUG = False
+    # Each worker runs 4 request threads plus the audit and retention threads
+    DB_POOL_SIZE = 6
+    DB_MAX_OVERFLOW = 4
+    DB_POOL_RECYCLE = 900
+    DB_STATEMENT_TIMEOUT_MS = int(os.environ.get('DB_STATEMENT_TIMEOUT_MS', 10000))
+    RETENTION_SWEEP_INTERVAL_HOURS = 6
+    # Route and SQL timings aren't for the public internet
+    METRICS_TOKEN_REQUIRED = True
 
 config = {
     'development': DevelopmentConfig,
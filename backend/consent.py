@@ -0,0 +1,119 @@
+"""HavenApp Backend - Consent snapshots
+
+Signal ingestion refuses categories the user hasn't consented to collect,
+and does so before validating or storing anything. Reading consent_records
+on every signal would add a query to the hottest write path, so each worker
+keeps a per-user snapshot of the granted scopes. A snapshot is tagged with
+the user's 'consent' version from versions.py and is only used while that
+version is current: update_consent() bumps it after committing, which
+retires the snapshot in every worker sharing the version store. The TTL
+bounds staleness for writes that bypass the API.
+
+A per-process version store can't retire another worker's snapshot, and a
+withdrawn scope must stop signals at once, not within the TTL: when
+versions.py attached no store (several workers, no Redis) there is no
+snapshot cache and every signal reads consent_records.
+"""
+import logging
+
+from flask import current_app
+from sqlalchemy import select
+
+from ids import generate_id
+from models import db, ConsentRecord
+from user_cache import UserCache
+from versions import resource_version
+
+logger = logging.getLogger(__name__)
+
+SCOPES = ('passive_detection', 'location_tracking', 'journaling', 'emergency_sharing')
+
+# Consent scopes a signal category needs; categories not listed need none
+REQUIRED_SCOPES = {
+    'communication': ('passive_detection',),
+    'device': ('passive_detection',),
+    'movement': ('passive_detection', 'location_tracking'),
+    'self_report': ('journaling',),
+}
+
+# Scopes granted by a consent record with the column defaults
+DEFAULT_GRANTED = frozenset(
+    scope for scope in SCOPES if ConsentRecord.__table__.c[scope].default.arg
+)
+
+
+def default_consent(user_id):
+    """A new ConsentRecord for user_id with every scope at its default"""
+    return ConsentRecord(
+        id=generate_id(),
+        user_id=user_id,
+        **{scope: scope in DEFAULT_GRANTED for scope in SCOPES},
+    )
+
+
+def init_consent_cache(app):
+    if 'version_store' not in app.extensions:
+        logger.warning('Consent snapshots are off: no version store is shared by every worker')
+        return None
+    cache = UserCache(
+        max_size=app.config.get('CONSENT_CACHE_SIZE', 10000),
+        ttl=app.config.get('CONSENT_CACHE_TTL', 300),
+    )
+    app.extensions['consent_cache'] = cache
+    return cache
+
+
+def _cache():
+    return current_app.extensions.get('consent_cache') if current_app.config.get('CONSENT_CACHE_ENABLED', True) else None
+
+
+def _load(user_id):
+    row = db.session.execute(
+        select(*(ConsentRecord.__table__.c[scope] for scope in SCOPES)).where(ConsentRecord.user_id == user_id)
+    ).first()
+    if row is None:
+        # Users registered before consent rows were created at registration
+        return DEFAULT_GRANTED
+    return frozenset(scope for scope, granted in zip(SCOPES, row) if granted)
+
+
+def consent_snapshot(user_id):
+    """frozenset of the consent scopes user_id has granted"""
+    cache = _cache()
+    # Read the version before the row: a change committed in between is then
+    # either in the row we load or retires the snapshot on the next lookup
+    version = resource_version(user_id, 'consent') if cache is not None else None
+    if version is not None:
+        entry = cache.get(user_id)
+        if entry is not None:
+            if entry[0] == version:
+                return entry[1]
+            cache.discard(user_id)
+    granted = _load(user_id)
+    if version is not None:
+        cache.put(user_id, (version, granted))
+    return granted
+
+
+def missing_scope(granted, category):
+    """The first scope category needs that isn't in granted, or None"""
+    if not isinstance(category, str):
+        # Not a category at all; schema validation rejects it
+        return None
+    for scope in REQUIRED_SCOPES.get(category, ()):
+        if scope not in granted:
+            return scope
+    return None
+
+
+def invalidate_consent(user_id):
+    """Drop this worker's snapshot now; other workers see the bumped version"""
+    cache = current_app.extensions.get('consent_cache')
+    if cache is not None:
+        cache.discard(user_id)
+
+
+def consent_cache_stats():
+    cache = current_app.extensions.get('consent_cache')
+    # Stale snapshots found on lookup count as hits and as invalidations
+    return cache.stats() if cache else {}
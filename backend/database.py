@@ -0,0 +1,207 @@
+"""HavenApp Backend - Engine profiles and read-replica routing
+
+init_database() builds the engine options from the config's DB_* and
+SQLITE_* settings before handing the app to Flask-SQLAlchemy:
+
+- server databases get an explicit pool (size, overflow, timeout,
+  pre-ping, recycle) and, on PostgreSQL, a per-connection statement_timeout
+- SQLite files are switched to WAL with synchronous=NORMAL and a busy
+  timeout, so readers no longer block signal writes and concurrent writers
+  wait rather than fail
+
+With DATABASE_REPLICA_URL set, views decorated with @read_only run their
+queries on the replica bind while everything else, including any flush,
+goes to the primary. A user who wrote within DB_READ_YOUR_WRITES_SECONDS
+reads from the primary, so they never see the replica's lag on their own
+changes; writes are tracked by bump_versions() in versions.py, which every
+write path already calls.
+
+With DATABASE_SHARD_URLS set, each URL becomes a shard bind ('shard0',
+'shard1', ...). Tables marked info={'sharded': True} in models.py (every
+per-user table) are read and written on the shard chosen for the current
+app context with use_shard()/on_shard(), which get_current_user() does from
+the user's users.shard; everything else stays on the primary. A shard of
+None is the primary itself, where users from before sharding keep their
+rows. Touching a sharded table with no shard chosen is an error rather
+than a silent write to the wrong database. See sharding.py.
+"""
+from contextlib import contextmanager
+from functools import wraps
+from flask import current_app, g, has_app_context
+from flask_jwt_extended import get_jwt_identity
+from flask_sqlalchemy.session import Session
+from sqlalchemy import Table, event, inspect
+from sqlalchemy.engine import make_url
+from sqlalchemy.exc import UnboundExecutionError
+from sqlalchemy.sql.util import find_tables
+
+from versions import recently_written
+
+REPLICA_BIND = 'replica'
+SHARD_BIND_PREFIX = 'shard'
+
+_NO_SHARD = object()
+
+
+def shard_bind(shard):
+    """Bind key of shard (None for the primary)"""
+    return None if shard is None else f'{SHARD_BIND_PREFIX}{shard}'
+
+
+def _sharded_table(mapper, clause):
+    if mapper is not None:
+        table = inspect(mapper).local_table
+        if table.info.get('sharded'):
+            return table
+    if clause is not None:
+        tables = [clause] if isinstance(clause, Table) else find_tables(clause, include_crud=True, check_columns=True)
+        for table in tables:
+            if isinstance(table, Table) and table.info.get('sharded'):
+                return table
+    return None
+
+
+class RoutingSession(Session):
+    """Session that sends sharded tables to the current shard, and reads to the replica while
+    g._db_use_replica is set"""
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if bind is None and has_app_context() and current_app.extensions.get('shards'):
+            table = _sharded_table(mapper, clause)
+            if table is not None:
+                shard = g.get('_db_shard', _NO_SHARD)
+                if shard is _NO_SHARD:
+                    raise UnboundExecutionError(f'No shard chosen for {table.name}; use on_shard() or use_shard()')
+                return self._db.engines[shard_bind(shard)] if shard is not None else self._db.engines[None]
+        engine = super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+        if bind is None and not self._flushing and has_app_context() and g.get('_db_use_replica'):
+            replica = self._db.engines.get(REPLICA_BIND)
+            # Only the default bind has a replica
+            if replica is not None and engine is self._db.engines.get(None):
+                return replica
+        return engine
+
+
+def engine_options(config, url):
+    """SQLAlchemy create_engine() options for url under config's profile"""
+    url = make_url(url)
+    options = {}
+    if url.get_backend_name() == 'sqlite':
+        return options
+
+    options.update(
+        pool_size=config.get('DB_POOL_SIZE', 5),
+        max_overflow=config.get('DB_MAX_OVERFLOW', 10),
+        pool_timeout=config.get('DB_POOL_TIMEOUT', 30),
+        pool_pre_ping=config.get('DB_POOL_PRE_PING', True),
+        pool_recycle=config.get('DB_POOL_RECYCLE', 1800),
+    )
+    timeout = config.get('DB_STATEMENT_TIMEOUT_MS')
+    if timeout and url.get_backend_name() == 'postgresql':
+        options['connect_args'] = {'options': f'-c statement_timeout={int(timeout)}'}
+    return options
+
+
+def _sqlite_pragmas(config):
+    pragmas = []
+    if config.get('SQLITE_JOURNAL_MODE'):
+        pragmas.append(f"PRAGMA journal_mode={config['SQLITE_JOURNAL_MODE']}")
+    if config.get('SQLITE_SYNCHRONOUS'):
+        pragmas.append(f"PRAGMA synchronous={config['SQLITE_SYNCHRONOUS']}")
+    if config.get('SQLITE_BUSY_TIMEOUT_MS'):
+        pragmas.append(f"PRAGMA busy_timeout={int(config['SQLITE_BUSY_TIMEOUT_MS'])}")
+    return pragmas
+
+
+def _on_sqlite_connect(pragmas):
+    def set_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        try:
+            for pragma in pragmas:
+                cursor.execute(pragma)
+        finally:
+            cursor.close()
+    return set_pragmas
+
+
+def init_database(app, db):
+    """Apply the engine profile (and replica bind, if configured) and initialise db"""
+    config = app.config
+    options = engine_options(config, config['SQLALCHEMY_DATABASE_URI'])
+    options.update(config.get('SQLALCHEMY_ENGINE_OPTIONS') or {})
+    config['SQLALCHEMY_ENGINE_OPTIONS'] = options
+
+    binds = dict(config.get('SQLALCHEMY_BINDS') or {})
+    replica_url = config.get('DATABASE_REPLICA_URL')
+    if replica_url:
+        binds[REPLICA_BIND] = {'url': replica_url, **engine_options(config, replica_url)}
+    shard_urls = config.get('DATABASE_SHARD_URLS') or []
+    for shard, url in enumerate(shard_urls):
+        binds[shard_bind(shard)] = {'url': url, **engine_options(config, url)}
+    config['SQLALCHEMY_BINDS'] = binds
+    app.extensions['shards'] = len(shard_urls)
+
+    db.init_app(app)
+
+    pragmas = _sqlite_pragmas(config)
+    with app.app_context():
+        for engine in db.engines.values():
+            # In-memory databases have no journal to configure
+            if pragmas and engine.dialect.name == 'sqlite' and engine.url.database not in (None, '', ':memory:'):
+                event.listen(engine, 'connect', _on_sqlite_connect(pragmas))
+
+
+def read_only(view):
+    """Run view's queries on the replica unless the user wrote recently (apply inside @jwt_required)"""
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        if current_app.config.get('DATABASE_REPLICA_URL'):
+            user_id = get_jwt_identity()
+            if user_id is None or not recently_written(user_id):
+                g._db_use_replica = True
+        return view(*args, **kwargs)
+    return wrapper
+
+
+def use_primary():
+    """Send the rest of this request's queries to the primary (e.g. before a write)"""
+    g._db_use_replica = False
+
+
+def use_shard(shard):
+    """Send this app context's sharded tables to shard (None: the primary)"""
+    g._db_shard = shard
+
+
+def current_shard():
+    """The shard chosen by use_shard(); None (the primary) when sharding is off"""
+    shard = g.get('_db_shard', _NO_SHARD)
+    if shard is _NO_SHARD:
+        if current_app.extensions.get('shards'):
+            raise UnboundExecutionError('No shard chosen; use on_shard() or use_shard()')
+        return None
+    return shard
+
+
+@contextmanager
+def on_shard(shard):
+    """Run the block against shard, then restore the previous choice"""
+    previous = g.get('_db_shard', _NO_SHARD)
+    g._db_shard = shard
+    try:
+        yield
+    finally:
+        if previous is _NO_SHARD:
+            g.pop('_db_shard', None)
+        else:
+            g._db_shard = previous
+
+
+def each_shard():
+    """Every database holding per-user rows: the primary (None), then each shard"""
+    return [None] + list(range(current_app.extensions.get('shards', 0)))
+
+
+def shard_engine(db, shard):
+    """Engine of shard (None: the primary)"""
+    return db.engines[shard_bind(shard)]
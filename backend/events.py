@@ -0,0 +1,322 @@
+"""HavenApp Backend - Real-time alert events
+
+create_alert, acknowledge_alert and passive alerts raised by signals publish
+an event to the user's channel once committed; GET /api/alerts/stream
+delivers them as Server-Sent Events.
+
+The pub/sub layer is a broker with two backends, selected by
+EVENT_BROKER_BACKEND:
+
+- 'local' fans events out inside the process (tests, single worker)
+- 'redis' appends each event to a capped per-user Redis stream, which gives
+  it a stable id and makes it replayable, and announces it on one pub/sub
+  channel that a listener thread in every worker fans out locally
+
+Each connection has a bounded queue. A client that falls STREAM_QUEUE_SIZE
+events behind is disconnected rather than buffered without limit; its
+EventSource reconnects with Last-Event-ID and the missed events are replayed
+from the last STREAM_REPLAY_SIZE kept per user. If they are no longer all
+available the stream starts with a `reset` event, telling the client to
+refetch GET /api/alerts.
+
+A connection mostly sits idle, so under threaded workers it pins a thread
+for its whole life; deploy the stream behind gevent workers (see README).
+Where WORKER_THREADS says the worker is threaded, a worker holds at most the
+threads left after the panic reservation and the priority gate's
+PRIORITY_GATE_LIMIT, whatever STREAM_MAX_CONNECTIONS says; by default the
+gate takes them all and a threaded worker holds none.
+
+A stream is authorised once, when it opens, so it checks its token against
+the revocation list whenever it wakes and ends once the token is revoked
+(logout, account deletion): within STREAM_HEARTBEAT_SECONDS.
+"""
+import json
+import logging
+import os
+import queue
+import threading
+import time
+import uuid
+from collections import OrderedDict, deque
+from flask import current_app
+
+from priority import gate_limit
+
+logger = logging.getLogger(__name__)
+
+REDIS_PREFIX = 'havenapp:events'
+
+# Reconnect delay suggested to EventSource clients
+RETRY_MS = 3000
+
+
+class Subscription:
+    """One stream connection's bounded queue of (id, type, data) events"""
+
+    def __init__(self, user_id, max_pending):
+        self.user_id = user_id
+        self._queue = queue.Queue(max_pending)
+        self.overflowed = False
+
+    def deliver(self, event):
+        try:
+            self._queue.put_nowait(event)
+        except queue.Full:
+            # Too slow to keep up; it is disconnected once the queue drains
+            self.overflowed = True
+
+    def get(self, timeout):
+        try:
+            return self._queue.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+
+class _Fanout:
+    """Subscriptions of this process, by user"""
+
+    def __init__(self, max_pending):
+        self.max_pending = max_pending
+        self._subscribers = {}
+        self._lock = threading.Lock()
+        self.connections = 0
+        self.max_connections = None
+        self.published = 0
+        self.overflows = 0
+
+    def subscribe(self, user_id):
+        subscription = Subscription(user_id, self.max_pending)
+        with self._lock:
+            self._subscribers.setdefault(user_id, set()).add(subscription)
+            self.connections += 1
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            subscribers = self._subscribers.get(subscription.user_id)
+            if subscribers is not None:
+                subscribers.discard(subscription)
+                if not subscribers:
+                    del self._subscribers[subscription.user_id]
+                self.connections -= 1
+            if subscription.overflowed:
+                self.overflows += 1
+
+    def deliver(self, user_id, event):
+        with self._lock:
+            subscribers = list(self._subscribers.get(user_id, ()))
+        for subscription in subscribers:
+            subscription.deliver(event)
+
+    def disconnect_all(self):
+        """Force every connection to reconnect and replay (after events may have been lost)"""
+        with self._lock:
+            subscribers = [s for group in self._subscribers.values() for s in group]
+        for subscription in subscribers:
+            subscription.overflowed = True
+
+    def stats(self):
+        with self._lock:
+            return {
+                'connections': self.connections,
+                'max_connections': self.max_connections,
+                'users': len(self._subscribers),
+                'published': self.published,
+                'overflow_disconnects': self.overflows,
+            }
+
+
+class LocalBroker(_Fanout):
+    """In-process broker keeping each user's recent events for replay"""
+
+    def __init__(self, max_pending=100, replay_size=200, max_users=10000):
+        super().__init__(max_pending)
+        self.replay_size = replay_size
+        self.max_users = max_users
+        self._history = OrderedDict()
+        self._history_lock = threading.Lock()
+        self._epoch = uuid.uuid4().hex[:8]
+        self._sequence = 0
+
+    def publish(self, user_id, event_type, data):
+        with self._history_lock:
+            self._sequence += 1
+            event = (f'{self._epoch}-{self._sequence}', event_type, data)
+            history = self._history.get(user_id)
+            if history is None:
+                history = self._history[user_id] = deque(maxlen=self.replay_size)
+            history.append(event)
+            self._history.move_to_end(user_id)
+            while len(self._history) > self.max_users:
+                self._history.popitem(last=False)
+            self.published += 1
+        self.deliver(user_id, event)
+        return event[0]
+
+    def replay(self, user_id, last_event_id):
+        """(events after last_event_id, whether none were lost)"""
+        with self._history_lock:
+            history = list(self._history.get(user_id, ()))
+        for index, event in enumerate(history):
+            if event[0] == last_event_id:
+                return history[index + 1:], True
+        return history, False
+
+
+class RedisBroker(_Fanout):
+    """Broker shared by every worker through Redis streams and pub/sub"""
+
+    def __init__(self, redis_url, max_pending=100, replay_size=200, replay_ttl=86400, prefix=REDIS_PREFIX):
+        import redis
+
+        super().__init__(max_pending)
+        self._client = redis.Redis.from_url(redis_url)
+        self.replay_size = replay_size
+        self.replay_ttl = replay_ttl
+        self.prefix = prefix
+        self.channel = f'{prefix}:live'
+        self._thread = None
+        self._pid = None
+        self._listen_lock = threading.Lock()
+
+    def _key(self, user_id):
+        return f'{self.prefix}:{user_id}'
+
+    def publish(self, user_id, event_type, data):
+        key = self._key(user_id)
+        pipe = self._client.pipeline(transaction=False)
+        pipe.xadd(key, {'type': event_type, 'data': data}, maxlen=self.replay_size, approximate=True)
+        pipe.expire(key, self.replay_ttl)
+        event_id = pipe.execute()[0].decode('utf-8')
+        self._client.publish(self.channel, json.dumps([user_id, event_id, event_type, data]))
+        self.published += 1
+        return event_id
+
+    def replay(self, user_id, last_event_id):
+        """(events after last_event_id, whether none were lost)"""
+        try:
+            entries = self._client.xrange(self._key(user_id), min=last_event_id, max='+')
+        except Exception:
+            # Not a stream id we issued
+            entries = self._client.xrange(self._key(user_id), min='-', max='+')
+            last_event_id = None
+        events = [(entry_id.decode('utf-8'), fields[b'type'].decode('utf-8'), fields[b'data'].decode('utf-8'))
+                  for entry_id, fields in entries]
+        if events and events[0][0] == last_event_id:
+            return events[1:], True
+        return events, False
+
+    def subscribe(self, user_id):
+        self.ensure_listening()
+        return super().subscribe(user_id)
+
+    def ensure_listening(self):
+        # The listener thread does not survive a fork, so each worker starts its own
+        if self._thread is not None and self._pid == os.getpid() and self._thread.is_alive():
+            return
+        with self._listen_lock:
+            if self._thread is not None and self._pid == os.getpid() and self._thread.is_alive():
+                return
+            self._pid = os.getpid()
+            self._thread = threading.Thread(target=self._listen, name='event-listener', daemon=True)
+            self._thread.start()
+
+    def _listen(self):
+        while True:
+            try:
+                pubsub = self._client.pubsub(ignore_subscribe_messages=True)
+                pubsub.subscribe(self.channel)
+                for message in pubsub.listen():
+                    user_id, event_id, event_type, data = json.loads(message['data'])
+                    self.deliver(user_id, (event_id, event_type, data))
+            except Exception as e:
+                logger.warning(f'Event listener reconnecting: {str(e)}')
+                # Anything published meanwhile is missed; clients replay it on reconnect
+                self.disconnect_all()
+                time.sleep(1.0)
+
+
+def init_events(app):
+    """Attach the event broker selected by EVENT_BROKER_BACKEND to app"""
+    max_pending = app.config.get('STREAM_QUEUE_SIZE', 100)
+    replay_size = app.config.get('STREAM_REPLAY_SIZE', 200)
+    if app.config.get('EVENT_BROKER_BACKEND', 'local') == 'redis':
+        broker = RedisBroker(app.config['REDIS_URL'], max_pending, replay_size,
+                             app.config.get('STREAM_REPLAY_TTL', 86400))
+    else:
+        broker = LocalBroker(max_pending, replay_size)
+    broker.max_connections = stream_capacity(app.config)
+    app.extensions['event_broker'] = broker
+    return broker
+
+
+def stream_capacity(config):
+    """Streams one worker may hold open"""
+    limit = config.get('STREAM_MAX_CONNECTIONS', 1000)
+    threads = config.get('WORKER_THREADS')
+    if threads:
+        # Each stream pins one of the worker's threads
+        ordinary = gate_limit(config) or 0
+        limit = min(limit, max(threads - config.get('PANIC_RESERVED_THREADS', 1) - ordinary, 0))
+    return limit
+
+
+def publish_alert_event(user_id, event_type, alert):
+    """Publish an alert change to user_id's stream; call after the change is committed"""
+    broker = current_app.extensions.get('event_broker')
+    if broker is None:
+        return None
+    try:
+        return broker.publish(user_id, event_type, current_app.json.dumps(alert.to_dict()))
+    except Exception as e:
+        logger.error(f'Could not publish {event_type} event for user {user_id}: {str(e)}')
+        return None
+
+
+def format_event(event_id, event_type, data):
+    lines = [f'id: {event_id}'] if event_id else []
+    lines.append(f'event: {event_type}')
+    lines.extend(f'data: {line}' for line in data.split('\n'))
+    return '\n'.join(lines) + '\n\n'
+
+
+def event_stream(broker, user_id, last_event_id=None, heartbeat=15.0, expires_at=None, revoked=None):
+    """Generator of SSE text for user_id's events until the client leaves, expires_at or revoked() is true"""
+    subscription = broker.subscribe(user_id)
+    try:
+        yield f'retry: {RETRY_MS}\n\n'
+
+        # Subscribed first so nothing published during the replay is missed;
+        # live copies of replayed events are skipped below
+        replayed = set()
+        if last_event_id:
+            events, complete = broker.replay(user_id, last_event_id)
+            if not complete:
+                yield format_event(None, 'reset', '{}')
+            for event in events:
+                replayed.add(event[0])
+                yield format_event(*event)
+
+        while True:
+            remaining = None if expires_at is None else expires_at - time.time()
+            if remaining is not None and remaining <= 0:
+                # The token has expired; the client reconnects with a fresh one
+                return
+            wait = 0 if subscription.overflowed else min(heartbeat, remaining or heartbeat)
+            event = subscription.get(wait)
+            if revoked is not None and revoked():
+                # Logged out or deleted; a reconnect is refused
+                return
+            if event is None:
+                if subscription.overflowed:
+                    return
+                yield ': keep-alive\n\n'
+            elif event[0] not in replayed:
+                yield format_event(*event)
+    finally:
+        broker.unsubscribe(subscription)
+
+
+def event_stats():
+    broker = current_app.extensions.get('event_broker')
+    return broker.stats() if broker else {}
@@ -0,0 +1,73 @@
+"""HavenApp Backend - Streaming data export"""
+import json
+import zlib
+from sqlalchemy import select
+
+from models import db, Alert, ConsentRecord, EmergencyContact, AuditLog, SIGNAL_SHAPE
+from signal_store import signal_store
+
+# (record type, model, ordering column) in the order they appear in an export;
+# signals come from the signal store, whatever its layout
+EXPORT_SECTIONS = (
+    ('consent', ConsentRecord, ConsentRecord.created_at),
+    ('emergency_contact', EmergencyContact, EmergencyContact.created_at),
+    ('signal', None, None),
+    ('alert', Alert, Alert.created_at),
+    ('audit_log', AuditLog, AuditLog.timestamp),
+)
+
+# Flush to the client once this many bytes of NDJSON are buffered
+BUFFER_BYTES = 64 * 1024
+
+
+def _line(record_type, data):
+    return json.dumps({'type': record_type, 'data': data}, separators=(',', ':')) + '\n'
+
+
+def iter_records(user, chunk_size=1000):
+    """Yield one NDJSON line per exported record, reading rows in server-side chunks"""
+    yield _line('user', user.to_dict())
+
+    for record_type, model, order_column in EXPORT_SECTIONS:
+        if record_type == 'signal':
+            dump_row = SIGNAL_SHAPE.dump_row
+            for row in signal_store().iter_user(user.id, chunk_size):
+                yield _line('signal', dump_row(row))
+            continue
+        stmt = (
+            select(model)
+            .where(model.user_id == user.id)
+            .order_by(order_column, model.id)
+            .execution_options(yield_per=chunk_size)
+        )
+        for partition in db.session.execute(stmt).scalars().partitions():
+            for record in partition:
+                yield _line(record_type, record.to_dict())
+            # Rows already written out don't need to stay in the session
+            for record in partition:
+                db.session.expunge(record)
+
+
+def iter_export(user, chunk_size=1000, compress=False):
+    """Yield the export as byte chunks of roughly BUFFER_BYTES, gzip'd if requested"""
+    compressor = zlib.compressobj(wbits=31) if compress else None
+    buffer = []
+    size = 0
+
+    for line in iter_records(user, chunk_size):
+        encoded = line.encode('utf-8')
+        buffer.append(encoded)
+        size += len(encoded)
+        if size >= BUFFER_BYTES:
+            chunk = b''.join(buffer)
+            buffer, size = [], 0
+            if compressor:
+                chunk = compressor.compress(chunk)
+            if chunk:
+                yield chunk
+
+    chunk = b''.join(buffer)
+    if compressor:
+        chunk = compressor.compress(chunk) + compressor.flush()
+    if chunk:
+        yield chunk
@@ -0,0 +1,12 @@
+"""HavenApp Backend - gunicorn hooks, read from the working directory
+
+Checks that need the real worker count run here, when gunicorn is about to
+serve, rather than in create_app, so CLI commands (flask --app wsgi migrate)
+work whatever WEB_CONCURRENCY says.
+"""
+from revocation import check_worker_count
+
+
+def post_worker_init(worker):
+    # Raising here stops the worker before it boots, and gunicorn with it
+    check_worker_count(worker.wsgi, worker.cfg.workers)
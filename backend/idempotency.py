@@ -0,0 +1,156 @@
+"""HavenApp Backend - Idempotency keys
+
+A client that may retry a request (a panic alert sent over a flaky mobile
+network) sends the same Idempotency-Key header on every attempt. The first
+attempt reserves the key; once it succeeds its response body is stored
+under the key for IDEMPOTENCY_TTL seconds and later attempts get that body
+back instead of repeating the work. An attempt that arrives while the first
+is still running waits up to IDEMPOTENCY_WAIT_SECONDS for it to finish.
+
+Keys are scoped per user. IDEMPOTENCY_BACKEND = 'redis' shares them between
+workers; 'local' keeps them per process. Callers that create rows should
+also derive the row id from the key (idempotent_id) so a retry landing on
+another worker collides on the primary key instead of creating a duplicate.
+"""
+import logging
+import threading
+import time
+import uuid
+from flask import current_app
+
+logger = logging.getLogger(__name__)
+
+REDIS_PREFIX = 'havenapp:idempotency'
+
+PENDING = b'\x00pending'
+
+# Namespace for ids derived from (user, key)
+ID_NAMESPACE = uuid.UUID('5b0f4f1e-8a3c-4c47-9a57-3f1d2b6c9e10')
+
+MAX_KEY_LENGTH = 255
+
+
+class IdempotencyConflict(Exception):
+    """The key's first attempt is still running"""
+
+
+class LocalIdempotencyStore:
+    """Reservations and stored responses held in this process"""
+
+    def __init__(self):
+        self._entries = {}  # key -> (expires at, value)
+        self._lock = threading.Lock()
+
+    def reserve(self, key, ttl):
+        """None if key was free and is now reserved, else its current value"""
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] > now:
+                return entry[1]
+            self._entries[key] = (now + ttl, PENDING)
+            if len(self._entries) > 10000:
+                self._entries = {k: e for k, e in self._entries.items() if e[0] > now}
+            return None
+
+    def get(self, key):
+        entry = self._entries.get(key)
+        return entry[1] if entry is not None and entry[0] > time.monotonic() else None
+
+    def complete(self, key, value, ttl):
+        with self._lock:
+            self._entries[key] = (time.monotonic() + ttl, value)
+
+    def release(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+
+class RedisIdempotencyStore:
+    """Reservations and stored responses shared by every worker through Redis"""
+
+    def __init__(self, redis_url, prefix=REDIS_PREFIX):
+        import redis
+
+        self._client = redis.Redis.from_url(redis_url)
+        self.prefix = prefix
+
+    def reserve(self, key, ttl):
+        name = f'{self.prefix}:{key}'
+        if self._client.set(name, PENDING, nx=True, px=int(ttl * 1000)):
+            return None
+        return self._client.get(name)
+
+    def get(self, key):
+        return self._client.get(f'{self.prefix}:{key}')
+
+    def complete(self, key, value, ttl):
+        self._client.set(f'{self.prefix}:{key}', value, px=int(ttl * 1000))
+
+    def release(self, key):
+        self._client.delete(f'{self.prefix}:{key}')
+
+
+def init_idempotency(app):
+    """Attach the idempotency store selected by IDEMPOTENCY_BACKEND to app"""
+    if app.config.get('IDEMPOTENCY_BACKEND', 'local') == 'redis':
+        store = RedisIdempotencyStore(app.config['REDIS_URL'])
+    else:
+        store = LocalIdempotencyStore()
+    app.extensions['idempotency_store'] = store
+    return store
+
+
+def valid_key(key):
+    return key is None or 0 < len(key) <= MAX_KEY_LENGTH
+
+
+def idempotent_id(user_id, key):
+    """Row id determined by (user_id, key), so every attempt targets the same row"""
+    return str(uuid.uuid5(ID_NAMESPACE, f'{user_id}:{key}'))
+
+
+def begin(user_id, key):
+    """Reserve (user_id, key). Returns the stored response body of an earlier
+    attempt, or None if this attempt should do the work; raises
+    IdempotencyConflict if an earlier attempt is still running."""
+    store = current_app.extensions['idempotency_store']
+    scoped = f'{user_id}:{key}'
+    try:
+        value = store.reserve(scoped, current_app.config.get('IDEMPOTENCY_TTL', 86400))
+        if value is None:
+            return None
+        deadline = time.monotonic() + current_app.config.get('IDEMPOTENCY_WAIT_SECONDS', 2.0)
+        while value == PENDING and time.monotonic() < deadline:
+            time.sleep(0.02)
+            value = store.get(scoped)
+    except Exception as e:
+        # The deterministic row id still stops duplicates; don't fail the request over the store
+        logger.error(f'Idempotency store unavailable: {str(e)}')
+        return None
+    if value == PENDING:
+        raise IdempotencyConflict(key)
+    if value is None:
+        # The earlier attempt failed and released the key; try again
+        return begin(user_id, key)
+    return value
+
+
+def finish(user_id, key, body):
+    """Store the successful response body for later attempts"""
+    store = current_app.extensions['idempotency_store']
+    try:
+        if isinstance(body, str):
+            body = body.encode('utf-8')
+        store.complete(f'{user_id}:{key}', body, current_app.config.get('IDEMPOTENCY_TTL', 86400))
+    except Exception as e:
+        logger.error(f'Could not store idempotent response: {str(e)}')
+
+
+def abandon(user_id, key):
+    """Free the key after a failed attempt so a retry can run"""
+    store = current_app.extensions['idempotency_store']
+    try:
+        store.release(f'{user_id}:{key}')
+    except Exception as e:
+        logger.error(f'Could not release idempotency key: {str(e)}')
@@ -0,0 +1,76 @@
+"""HavenApp Backend - Record identifiers
+
+generate_id() returns UUIDv7 strings (RFC 9562): a 48-bit Unix millisecond
+timestamp, then a 12-bit counter that keeps ids from this process in order
+within a millisecond, then 62 random bits. New rows of insert-heavy tables
+therefore land at the right-hand edge of their primary key index instead of
+on a random page, which keeps the index dense and its hot pages cached.
+
+Ids stay ordinary 36-character UUID strings in the API and in Python, so
+existing uuid4 ids remain valid. UUIDString stores them as PostgreSQL's
+native 16-byte uuid and as String(36) elsewhere.
+"""
+import os
+import threading
+import time
+import uuid
+from sqlalchemy import String
+from sqlalchemy.dialects.postgresql import UUID
+from sqlalchemy.types import TypeDecorator
+
+# Strings that aren't UUIDs can't name a row; on PostgreSQL they bind as this
+# so lookups by them match nothing, as they do on other databases
+NIL_UUID = '00000000-0000-0000-0000-000000000000'
+
+_lock = threading.Lock()
+_last_ms = 0
+_counter = 0
+
+
+def _uuid7_int():
+    global _last_ms, _counter
+    with _lock:
+        ms = time.time_ns() // 1000000
+        if ms > _last_ms:
+            _last_ms, _counter = ms, 0
+        else:
+            # Same millisecond, or the clock went back: keep counting from the last one
+            _counter += 1
+            if _counter > 0xFFF:
+                _last_ms, _counter = _last_ms + 1, 0
+            ms = _last_ms
+        counter = _counter
+    random_bits = int.from_bytes(os.urandom(8), 'big') & 0x3FFFFFFFFFFFFFFF
+    return ms << 80 | 0x7 << 76 | counter << 64 | 0x2 << 62 | random_bits
+
+
+def uuid7():
+    """A UUIDv7, later than every one this process made before"""
+    return uuid.UUID(int=_uuid7_int())
+
+
+def generate_id():
+    """Generate a time-ordered UUID string for database records"""
+    # Formatted directly; building a uuid.UUID first costs more than the id itself
+    h = f'{_uuid7_int():032x}'
+    return f'{h[:8]}-{h[8:12]}-{h[12:16]}-{h[16:20]}-{h[20:]}'
+
+
+class UUIDString(TypeDecorator):
+    """UUID strings: native uuid on PostgreSQL, String(36) elsewhere"""
+
+    impl = String(36)
+    cache_ok = True
+
+    def load_dialect_impl(self, dialect):
+        if dialect.name == 'postgresql':
+            return dialect.type_descriptor(UUID(as_uuid=False))
+        return dialect.type_descriptor(String(36))
+
+    def process_bind_param(self, value, dialect):
+        if value is None or dialect.name != 'postgresql':
+            return value
+        try:
+            return str(uuid.UUID(str(value)))
+        except ValueError:
+            return NIL_UUID
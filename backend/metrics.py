@@ -0,0 +1,356 @@
+"""HavenApp Backend - Request metrics
+
+Every request records, per route template and method:
+
+- latency, SQL statements issued, SQL time, JSON serialization time and
+  response size histograms
+- a request counter by status code
+
+SQL is measured with SQLAlchemy cursor-execute events and serialization by
+timing the app's JSON provider, so routes need no changes. GET /api/metrics
+renders the result in the Prometheus text format. With
+METRICS_MULTIPROC_DIR set, each gunicorn worker periodically writes its
+totals to a file there and the endpoint sums every worker's file, so a
+scrape that lands on any worker sees the whole server. Files left by
+workers that have exited are folded into one archive file on the next
+scrape, so restarts neither pile up files nor make the totals go back.
+
+The endpoint needs `Authorization: Bearer <METRICS_TOKEN>` when a token is
+set; with METRICS_TOKEN_REQUIRED (on in production) and no token it is
+closed altogether.
+
+Requests slower than METRICS_SLOW_REQUEST_MS are logged together with the
+SQL statements they ran.
+"""
+import fcntl
+import glob
+import json
+import logging
+import os
+import threading
+import time
+from flask import current_app, g, has_request_context, jsonify, request, Response
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+logger = logging.getLogger(__name__)
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_COUNT_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100)
+NOTIFY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 300.0)
+SIZE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304)
+
+HISTOGRAMS = {
+    'havenapp_request_duration_seconds': ('Request latency', LATENCY_BUCKETS),
+    'havenapp_request_sql_queries': ('SQL statements issued per request', QUERY_COUNT_BUCKETS),
+    'havenapp_request_sql_seconds': ('Time spent in SQL per request', LATENCY_BUCKETS),
+    'havenapp_request_serialization_seconds': ('Time spent serializing JSON per request', LATENCY_BUCKETS),
+    'havenapp_response_size_bytes': ('Response body size', SIZE_BUCKETS),
+    'havenapp_notification_delivery_seconds': ('Time from alert to contact notification sent', NOTIFY_BUCKETS),
+}
+COUNTERS = {
+    'havenapp_requests_total': 'Requests handled',
+}
+
+# Totals of exited workers, in METRICS_MULTIPROC_DIR
+ARCHIVE_FILE = 'archived.json'
+
+
+class MetricsRegistry:
+    """Counters and fixed-bucket histograms for one process"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.counters = {}  # (name, labels) -> value
+        self.histograms = {}  # (name, labels) -> [bucket counts..., sum, count]
+
+    def inc(self, name, labels, value=1):
+        key = (name, labels)
+        with self._lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def observe(self, name, labels, value):
+        buckets = HISTOGRAMS[name][1]
+        key = (name, labels)
+        with self._lock:
+            series = self.histograms.get(key)
+            if series is None:
+                series = self.histograms[key] = [0] * (len(buckets) + 2)
+            for i, bound in enumerate(buckets):
+                if value <= bound:
+                    series[i] += 1
+            series[-2] += value
+            series[-1] += 1
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                'counters': [[name, list(labels), value] for (name, labels), value in self.counters.items()],
+                'histograms': [[name, list(labels), list(series)]
+                               for (name, labels), series in self.histograms.items()],
+            }
+
+
+def merge_snapshots(snapshots):
+    """Sum several registry snapshots into one"""
+    counters, histograms = {}, {}
+    for snap in snapshots:
+        for name, labels, value in snap.get('counters', []):
+            key = (name, tuple(tuple(pair) for pair in labels))
+            counters[key] = counters.get(key, 0) + value
+        for name, labels, series in snap.get('histograms', []):
+            key = (name, tuple(tuple(pair) for pair in labels))
+            if key in histograms:
+                histograms[key] = [a + b for a, b in zip(histograms[key], series)]
+            else:
+                histograms[key] = list(series)
+    return counters, histograms
+
+
+def as_snapshot(counters, histograms):
+    """merge_snapshots() output back in snapshot form"""
+    return {
+        'counters': [[name, [list(pair) for pair in labels], value] for (name, labels), value in counters.items()],
+        'histograms': [[name, [list(pair) for pair in labels], series]
+                       for (name, labels), series in histograms.items()],
+    }
+
+
+def _process_exists(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+def _labels(pairs, extra=None):
+    items = list(pairs) + ([extra] if extra else [])
+    if not items:
+        return ''
+    escaped = (f'{k}="{str(v).replace(chr(92), chr(92) * 2).replace(chr(34), chr(92) + chr(34))}"'
+               for k, v in items)
+    return '{' + ','.join(escaped) + '}'
+
+
+def render(counters, histograms, gauges=()):
+    """Prometheus text exposition format"""
+    lines = []
+    for name, help_text in COUNTERS.items():
+        lines += [f'# HELP {name} {help_text}', f'# TYPE {name} counter']
+        for (series_name, labels), value in sorted(counters.items()):
+            if series_name == name:
+                lines.append(f'{name}{_labels(labels)} {value}')
+    for name, (help_text, buckets) in HISTOGRAMS.items():
+        lines += [f'# HELP {name} {help_text}', f'# TYPE {name} histogram']
+        for (series_name, labels), series in sorted(histograms.items()):
+            if series_name != name:
+                continue
+            for bound, count in zip(buckets, series):
+                lines.append(f'{name}_bucket{_labels(labels, ("le", bound))} {count}')
+            lines.append(f'{name}_bucket{_labels(labels, ("le", "+Inf"))} {series[-1]}')
+            lines.append(f'{name}_sum{_labels(labels)} {series[-2]}')
+            lines.append(f'{name}_count{_labels(labels)} {series[-1]}')
+    for name, help_text, samples in gauges:
+        lines += [f'# HELP {name} {help_text}', f'# TYPE {name} gauge']
+        for labels, value in samples:
+            lines.append(f'{name}{_labels(labels)} {value}')
+    return '\n'.join(lines) + '\n'
+
+
+class TimedJSONMixin:
+    """Mixed into the app's JSON provider to add its running time to the request's metrics"""
+
+    def response(self, *args, **kwargs):
+        started = time.perf_counter()
+        try:
+            return super().response(*args, **kwargs)
+        finally:
+            state = g.get('_metrics') if has_request_context() else None
+            if state is not None:
+                state['serialize'] += time.perf_counter() - started
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault('_metrics_started', []).append(time.perf_counter())
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    started = conn.info.get('_metrics_started')
+    if not started:
+        return
+    elapsed = time.perf_counter() - started.pop()
+    state = g.get('_metrics') if has_request_context() else None
+    if state is None:
+        return
+    state['sql_count'] += 1
+    state['sql_time'] += elapsed
+    if state['statements'] is not None:
+        state['statements'].append((round(elapsed * 1000, 2), statement))
+
+
+_listening = False
+
+
+def _listen_for_sql():
+    global _listening
+    if not _listening:
+        event.listen(Engine, 'before_cursor_execute', _before_cursor_execute)
+        event.listen(Engine, 'after_cursor_execute', _after_cursor_execute)
+        _listening = True
+
+
+class RequestMetrics:
+    """Hooks a Flask app up to a MetricsRegistry and serves /api/metrics"""
+
+    def __init__(self, app):
+        self.app = app
+        self.registry = MetricsRegistry()
+        self.multiproc_dir = app.config.get('METRICS_MULTIPROC_DIR')
+        self.flush_interval = app.config.get('METRICS_FLUSH_INTERVAL', 5.0)
+        self.slow_ms = app.config.get('METRICS_SLOW_REQUEST_MS')
+        self._last_flush = 0.0
+        self.gauge_sources = []  # callables returning (name, help, [(labels, value)])
+
+        _listen_for_sql()
+        provider = type(app.json)
+        app.json = type(f'Timed{provider.__name__}', (TimedJSONMixin, provider), {})(app)
+        app.before_request(self._before_request)
+        app.after_request(self._after_request)
+        app.add_url_rule('/api/metrics', 'metrics', self.metrics_view, methods=['GET'])
+        if self.multiproc_dir:
+            os.makedirs(self.multiproc_dir, exist_ok=True)
+
+    def _before_request(self):
+        g._metrics = {
+            'started': time.perf_counter(),
+            'sql_count': 0,
+            'sql_time': 0.0,
+            'serialize': 0.0,
+            'statements': [] if self.slow_ms else None,
+        }
+
+    def _after_request(self, response):
+        state = g.pop('_metrics', None)
+        if state is None:
+            return response
+        elapsed = time.perf_counter() - state['started']
+        endpoint = request.url_rule.rule if request.url_rule else 'unmatched'
+        labels = (('endpoint', endpoint), ('method', request.method))
+
+        registry = self.registry
+        registry.inc('havenapp_requests_total', labels + (('status', str(response.status_code)),))
+        registry.observe('havenapp_request_duration_seconds', labels, elapsed)
+        registry.observe('havenapp_request_sql_queries', labels, state['sql_count'])
+        registry.observe('havenapp_request_sql_seconds', labels, state['sql_time'])
+        registry.observe('havenapp_request_serialization_seconds', labels, state['serialize'])
+        if not response.is_streamed:
+            registry.observe('havenapp_response_size_bytes', labels, response.calculate_content_length() or 0)
+
+        if self.slow_ms and elapsed * 1000 >= self.slow_ms:
+            statements = '\n'.join(f'  [{ms} ms] {sql}' for ms, sql in state['statements'])
+            logger.warning(
+                f'Slow request {request.method} {endpoint} {response.status_code}: '
+                f'{elapsed * 1000:.1f} ms, {state["sql_count"]} SQL statements '
+                f'({state["sql_time"] * 1000:.1f} ms)\n{statements}'
+            )
+
+        if self.multiproc_dir and time.monotonic() - self._last_flush >= self.flush_interval:
+            self.flush()
+        return response
+
+    def flush(self):
+        """Write this worker's totals where other workers can read them"""
+        path = os.path.join(self.multiproc_dir, f'metrics-{os.getpid()}.json')
+        tmp = f'{path}.tmp'
+        with open(tmp, 'w') as f:
+            json.dump(self.registry.snapshot(), f)
+        os.replace(tmp, path)
+        self._last_flush = time.monotonic()
+
+    def archive_exited(self):
+        """Fold the files of workers that have exited into the archive; returns how many"""
+        archived = 0
+        for path in glob.glob(os.path.join(self.multiproc_dir, 'metrics-*.json')):
+            pid = os.path.basename(path)[len('metrics-'):-len('.json')]
+            if not pid.isdigit() or _process_exists(int(pid)):
+                continue
+            # Claimed by renaming, so two workers scraping at once don't both count it
+            claimed = f'{path}.exited'
+            try:
+                os.replace(path, claimed)
+                with open(claimed) as f:
+                    snapshot = json.load(f)
+            except (OSError, ValueError):
+                continue
+            archive = os.path.join(self.multiproc_dir, ARCHIVE_FILE)
+            with open(os.path.join(self.multiproc_dir, 'archive.lock'), 'w') as lock:
+                fcntl.flock(lock, fcntl.LOCK_EX)
+                try:
+                    with open(archive) as f:
+                        totals = json.load(f)
+                except (OSError, ValueError):
+                    totals = {}
+                with open(f'{archive}.tmp', 'w') as f:
+                    json.dump(as_snapshot(*merge_snapshots([totals, snapshot])), f)
+                os.replace(f'{archive}.tmp', archive)
+                os.remove(claimed)
+            archived += 1
+        return archived
+
+    def collect(self):
+        if not self.multiproc_dir:
+            return merge_snapshots([self.registry.snapshot()])
+        self.flush()
+        self.archive_exited()
+        snapshots = []
+        for path in glob.glob(os.path.join(self.multiproc_dir, 'metrics-*.json')) + [
+            os.path.join(self.multiproc_dir, ARCHIVE_FILE)
+        ]:
+            try:
+                with open(path) as f:
+                    snapshots.append(json.load(f))
+            except (OSError, ValueError):
+                continue
+        return merge_snapshots(snapshots)
+
+    def metrics_view(self):
+        token = current_app.config.get('METRICS_TOKEN')
+        if not token and current_app.config.get('METRICS_TOKEN_REQUIRED'):
+            return jsonify({'error': 'Metrics are disabled until METRICS_TOKEN is set'}), 403
+        if token and request.headers.get('Authorization') != f'Bearer {token}':
+            return jsonify({'error': 'Unauthorized'}), 401
+
+        counters, histograms = self.collect()
+        gauges = []
+        for source in self.gauge_sources:
+            try:
+                gauges.append(source())
+            except Exception as e:
+                logger.error(f'Metrics gauge source failed: {str(e)}')
+        return Response(render(counters, histograms, gauges), mimetype='text/plain; version=0.0.4')
+
+
+def stats_gauge(name, help_text, stats_fn):
+    """Gauge source exposing each numeric value of a stats() dict as a labelled sample"""
+    def source():
+        pid = str(os.getpid())
+        return name, help_text, [
+            ((('stat', key), ('pid', pid)), value)
+            for key, value in sorted(stats_fn().items())
+            if isinstance(value, (int, float)) and not isinstance(value, bool)
+        ]
+    return source
+
+
+def init_metrics(app):
+    """Instrument app and register GET /api/metrics"""
+    if not app.config.get('METRICS_ENABLED', True):
+        return None
+    metrics = RequestMetrics(app)
+    app.extensions['metrics'] = metrics
+    if app.config.get('METRICS_TOKEN_REQUIRED') and not app.config.get('METRICS_TOKEN'):
+        logger.warning('GET /api/metrics is closed until METRICS_TOKEN is set')
+    return metrics
@@ -0,0 +1,81 @@
+"""Tables as originally created by db.create_all()
+
+Databases that predate migrations already have these; checkfirst leaves
+them alone.
+"""
+from sqlalchemy import Boolean, Column, DateTime, Float, ForeignKey, JSON, MetaData, String, Table
+
+metadata = MetaData()
+
+Table(
+    'users', metadata,
+    Column('id', String(36), primary_key=True),
+    Column('email', String(255), unique=True, nullable=False, index=True),
+    Column('password_hash', String(255), nullable=False),
+    Column('name', String(255)),
+    Column('created_at', DateTime),
+    Column('updated_at', DateTime),
+    Column('is_active', Boolean),
+)
+
+Table(
+    'consent_records', metadata,
+    Column('id', String(36), primary_key=True),
+    Column('user_id', String(36), ForeignKey('users.id'), nullable=False),
+    Column('passive_detection', Boolean),
+    Column('location_tracking', Boolean),
+    Column('journaling', Boolean),
+    Column('emergency_sharing', Boolean),
+    Column('created_at', DateTime),
+    Column('updated_at', DateTime),
+)
+
+Table(
+    'signals', metadata,
+    Column('id', String(36), primary_key=True),
+    Column('user_id', String(36), ForeignKey('users.id'), nullable=False),
+    Column('category', String(50), nullable=False),
+    Column('signal_type', String(100), nullable=False),
+    Column('confidence', Float),
+    Column('metadata', JSON),
+    Column('created_at', DateTime),
+)
+
+Table(
+    'alerts', metadata,
+    Column('id', String(36), primary_key=True),
+    Column('user_id', String(36), ForeignKey('users.id'), nullable=False),
+    Column('risk_level', Float),
+    Column('alert_type', String(50)),
+    Column('signals', JSON),
+    Column('acknowledged', Boolean),
+    Column('created_at', DateTime),
+    Column('updated_at', DateTime),
+)
+
+Table(
+    'emergency_contacts', metadata,
+    Column('id', String(36), primary_key=True),
+    Column('user_id', String(36), ForeignKey('users.id'), nullable=False),
+    Column('name', String(255), nullable=False),
+    Column('phone', String(20)),
+    Column('email', String(255)),
+    Column('relationship', String(100)),
+    Column('is_advocate', Boolean),
+    Column('created_at', DateTime),
+)
+
+Table(
+    'audit_logs', metadata,
+    Column('id', String(36), primary_key=True),
+    Column('user_id', String(36), ForeignKey('users.id'), nullable=False),
+    Column('action', String(255), nullable=False),
+    Column('resource_type', String(100)),
+    Column('resource_id', String(36)),
+    Column('details', JSON),
+    Column('timestamp', DateTime, index=True),
+)
+
+
+def upgrade(connection):
+    metadata.create_all(connection, checkfirst=True)
@@ -0,0 +1,37 @@
+"""(user_id, created_at) and created_at indexes on signals and alerts; risk_states
+
+create_all() never added indexes to existing tables, so older databases
+get them here.
+"""
+from sqlalchemy import Boolean, Column, DateTime, Float, ForeignKey, Index, JSON, MetaData, String, Table
+
+metadata = MetaData()
+
+Table('users', metadata, Column('id', String(36), primary_key=True))
+signals = Table('signals', metadata, Column('id', String(36), primary_key=True),
+                Column('user_id', String(36)), Column('created_at', DateTime))
+alerts = Table('alerts', metadata, Column('id', String(36), primary_key=True),
+               Column('user_id', String(36)), Column('created_at', DateTime))
+
+INDEXES = (
+    Index('ix_signals_user_id_created_at', signals.c.user_id, signals.c.created_at),
+    Index('ix_signals_created_at', signals.c.created_at),
+    Index('ix_alerts_user_id_created_at', alerts.c.user_id, alerts.c.created_at),
+    Index('ix_alerts_created_at', alerts.c.created_at),
+)
+
+risk_states = Table(
+    'risk_states', metadata,
+    Column('user_id', String(36), ForeignKey('users.id'), primary_key=True),
+    Column('category_sums', JSON),
+    Column('recent_signals', JSON),
+    Column('score', Float),
+    Column('alert_active', Boolean),
+    Column('scored_at', DateTime),
+)
+
+
+def upgrade(connection):
+    for index in INDEXES:
+        index.create(connection, checkfirst=True)
+    risk_states.create(connection, checkfirst=True)
@@ -0,0 +1,13 @@
+"""user_id index on emergency_contacts, read for every notified alert"""
+from sqlalchemy import Column, Index, MetaData, String, Table
+
+metadata = MetaData()
+
+emergency_contacts = Table('emergency_contacts', metadata, Column('id', String(36), primary_key=True),
+                           Column('user_id', String(36)))
+
+INDEX = Index('ix_emergency_contacts_user_id', emergency_contacts.c.user_id)
+
+
+def upgrade(connection):
+    INDEX.create(connection, checkfirst=True)
@@ -0,0 +1,27 @@
+"""signal_buckets, the compact signal layout used when SIGNAL_STORAGE = 'buckets'"""
+from sqlalchemy import Column, DateTime, ForeignKey, Index, Integer, JSON, LargeBinary, MetaData, String, Table
+
+metadata = MetaData()
+
+Table('users', metadata, Column('id', String(36), primary_key=True))
+
+signal_buckets = Table(
+    'signal_buckets', metadata,
+    Column('user_id', String(36), ForeignKey('users.id'), primary_key=True),
+    Column('bucket_start', DateTime, primary_key=True),
+    Column('part', Integer, primary_key=True),
+    Column('count', Integer, nullable=False),
+    Column('last_at', DateTime, nullable=False),
+    Column('version', Integer, nullable=False),
+    Column('kinds', JSON, nullable=False),
+    Column('codes', LargeBinary, nullable=False),
+    Column('offsets', LargeBinary, nullable=False),
+    Column('confidences', LargeBinary, nullable=False),
+    Column('extras', JSON),
+    Index('ix_signal_buckets_user_id_last_at', 'user_id', 'last_at'),
+    Index('ix_signal_buckets_last_at', 'last_at'),
+)
+
+
+def upgrade(connection):
+    signal_buckets.create(connection, checkfirst=True)
@@ -0,0 +1,24 @@
+"""signal_rollups: per user, category and hour/day signal counts for GET /api/signals/summary
+
+Fill it for signals stored before this migration with `flask rebuild-rollups`.
+"""
+from sqlalchemy import Column, DateTime, Float, ForeignKey, Index, Integer, MetaData, String, Table
+
+metadata = MetaData()
+
+Table('users', metadata, Column('id', String(36), primary_key=True))
+
+signal_rollups = Table(
+    'signal_rollups', metadata,
+    Column('user_id', String(36), ForeignKey('users.id'), primary_key=True),
+    Column('granularity', String(8), primary_key=True),
+    Column('bucket_start', DateTime, primary_key=True),
+    Column('category', String(50), primary_key=True),
+    Column('count', Integer, nullable=False),
+    Column('confidence_sum', Float, nullable=False),
+    Index('ix_signal_rollups_bucket_start', 'bucket_start'),
+)
+
+
+def upgrade(connection):
+    signal_rollups.create(connection, checkfirst=True)
@@ -0,0 +1,43 @@
+"""Default consent records for users without one, and a user_id index on consent_records
+
+Registration now creates the record and GET /api/user/consent no longer
+does, so users registered before this migration get theirs here.
+"""
+import uuid
+from datetime import datetime
+from sqlalchemy import Boolean, Column, DateTime, Index, MetaData, String, Table, insert, select
+
+metadata = MetaData()
+
+users = Table('users', metadata, Column('id', String(36), primary_key=True))
+
+consent_records = Table(
+    'consent_records', metadata,
+    Column('id', String(36), primary_key=True),
+    Column('user_id', String(36)),
+    Column('passive_detection', Boolean),
+    Column('location_tracking', Boolean),
+    Column('journaling', Boolean),
+    Column('emergency_sharing', Boolean),
+    Column('created_at', DateTime),
+    Column('updated_at', DateTime),
+)
+
+INDEX = Index('ix_consent_records_user_id', consent_records.c.user_id)
+
+BATCH_SIZE = 1000
+
+
+def upgrade(connection):
+    INDEX.create(connection, checkfirst=True)
+    missing = connection.execute(
+        select(users.c.id).where(~select(consent_records.c.id)
+                                 .where(consent_records.c.user_id == users.c.id).exists())
+    ).scalars().all()
+    now = datetime.utcnow()
+    for start in range(0, len(missing), BATCH_SIZE):
+        connection.execute(insert(consent_records), [
+            {'id': str(uuid.uuid4()), 'user_id': user_id, 'passive_detection': True, 'location_tracking': False,
+             'journaling': True, 'emergency_sharing': False, 'created_at': now, 'updated_at': now}
+            for user_id in missing[start:start + BATCH_SIZE]
+        ])
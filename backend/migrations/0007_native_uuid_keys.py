@@ -0,0 +1,62 @@
+"""Store id and user_id columns as native uuid on PostgreSQL
+
+Existing rows keep their ids: uuid4 strings convert in place, and new rows
+get time-ordered UUIDv7s from ids.generate_id(). PostgreSQL requires a
+foreign key and the key it references to share a type, so the foreign keys
+to users.id are dropped, every column is converted, and they are recreated
+with the same names. Other databases keep String(36) and need no change.
+
+This rewrites the converted tables under an exclusive lock; run it in a
+maintenance window on large databases.
+"""
+from sqlalchemy import inspect, text
+
+# Columns holding ids that ids.generate_id() (or the users' ids) fill
+COLUMNS = {
+    'users': ('id',),
+    'consent_records': ('id', 'user_id'),
+    'signals': ('id', 'user_id'),
+    'signal_buckets': ('user_id',),
+    'signal_rollups': ('user_id',),
+    'alerts': ('id', 'user_id'),
+    'risk_states': ('user_id',),
+    'emergency_contacts': ('id', 'user_id'),
+    'audit_logs': ('id', 'user_id'),
+}
+
+
+def upgrade(connection):
+    if connection.dialect.name != 'postgresql':
+        return
+    inspector = inspect(connection)
+    tables = set(inspector.get_table_names())
+
+    pending = {}
+    for table, columns in COLUMNS.items():
+        if table not in tables:
+            continue
+        types = {column['name']: column['type'] for column in inspector.get_columns(table)}
+        pending[table] = [column for column in columns if types[column].__visit_name__.upper() != 'UUID']
+    if not any(pending.values()):
+        return
+
+    foreign_keys = [
+        (table, key)
+        for table in COLUMNS if table in tables
+        for key in inspector.get_foreign_keys(table)
+        if key['referred_table'] == 'users'
+    ]
+    for table, key in foreign_keys:
+        connection.execute(text(f'ALTER TABLE {table} DROP CONSTRAINT "{key["name"]}"'))
+
+    for table, columns in pending.items():
+        if columns:
+            changes = ', '.join(f'ALTER COLUMN {column} TYPE uuid USING {column}::uuid' for column in columns)
+            connection.execute(text(f'ALTER TABLE {table} {changes}'))
+
+    for table, key in foreign_keys:
+        local = ', '.join(key['constrained_columns'])
+        remote = ', '.join(key['referred_columns'])
+        connection.execute(text(
+            f'ALTER TABLE {table} ADD CONSTRAINT "{key["name"]}" FOREIGN KEY ({local}) REFERENCES users ({remote})'
+        ))
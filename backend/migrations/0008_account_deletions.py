@@ -0,0 +1,36 @@
+"""account_deletions: DELETE /api/user jobs, and a user_id index on audit_logs for them"""
+from sqlalchemy import Column, DateTime, Index, Integer, JSON, MetaData, String, Table, Text
+from sqlalchemy.dialects.postgresql import UUID
+
+metadata = MetaData()
+
+# Id columns are native uuid on PostgreSQL since 0007
+ID = String(36).with_variant(UUID(as_uuid=False), 'postgresql')
+
+audit_logs = Table('audit_logs', metadata, Column('id', String(36), primary_key=True),
+                   Column('user_id', String(36)))
+
+AUDIT_INDEX = Index('ix_audit_logs_user_id', audit_logs.c.user_id)
+
+account_deletions = Table(
+    'account_deletions', metadata,
+    Column('id', ID, primary_key=True),
+    Column('user_id', ID, nullable=False),
+    Column('status', String(16), nullable=False),
+    Column('step', String(32)),
+    Column('deleted', JSON),
+    Column('runner', String(36)),
+    Column('lease_until', DateTime),
+    Column('attempts', Integer, nullable=False),
+    Column('error', Text),
+    Column('created_at', DateTime),
+    Column('updated_at', DateTime),
+    Column('finished_at', DateTime),
+    Index('ix_account_deletions_user_id', 'user_id'),
+    Index('ix_account_deletions_status', 'status'),
+)
+
+
+def upgrade(connection):
+    AUDIT_INDEX.create(connection, checkfirst=True)
+    account_deletions.create(connection, checkfirst=True)
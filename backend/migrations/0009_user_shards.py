@@ -0,0 +1,56 @@
+"""users.shard and users.shard_moving_to, shard_moves, and shard databases without user foreign keys
+
+Shard databases (DATABASE_SHARD_URLS) are migrated with the same chain as
+the primary, so they also get an empty users table. Their per-user tables
+can't reference it: on a shard, the foreign keys to users.id that earlier
+migrations created are dropped. SQLite doesn't enforce them unless asked to,
+so only PostgreSQL shards need the change.
+"""
+from sqlalchemy import Column, DateTime, Index, Integer, JSON, MetaData, String, Table, Text, inspect, text
+from sqlalchemy.dialects.postgresql import UUID
+
+from migrations import is_shard
+
+metadata = MetaData()
+
+# Id columns are native uuid on PostgreSQL since 0007
+ID = String(36).with_variant(UUID(as_uuid=False), 'postgresql')
+
+USER_COLUMNS = {
+    'shard': 'INTEGER',
+    'shard_moving_to': 'INTEGER',
+}
+
+SHARDED_TABLES = ('consent_records', 'signals', 'signal_buckets', 'signal_rollups', 'alerts', 'risk_states',
+                  'emergency_contacts', 'audit_logs')
+
+shard_moves = Table(
+    'shard_moves', metadata,
+    Column('id', ID, primary_key=True),
+    Column('user_id', ID, nullable=False),
+    Column('source', Integer),
+    Column('target', Integer, nullable=False),
+    Column('status', String(16), nullable=False),
+    Column('copied', JSON),
+    Column('error', Text),
+    Column('created_at', DateTime),
+    Column('updated_at', DateTime),
+    Column('finished_at', DateTime),
+    Index('ix_shard_moves_user_id', 'user_id'),
+    Index('ix_shard_moves_status', 'status'),
+)
+
+
+def upgrade(connection):
+    inspector = inspect(connection)
+    existing = {column['name'] for column in inspector.get_columns('users')}
+    for name, column_type in USER_COLUMNS.items():
+        if name not in existing:
+            connection.execute(text(f'ALTER TABLE users ADD COLUMN {name} {column_type}'))
+    shard_moves.create(connection, checkfirst=True)
+
+    if is_shard(connection) and connection.dialect.name == 'postgresql':
+        for table in SHARDED_TABLES:
+            for key in inspector.get_foreign_keys(table):
+                if key['referred_table'] == 'users':
+                    connection.execute(text(f'ALTER TABLE {table} DROP CONSTRAINT "{key["name"]}"'))
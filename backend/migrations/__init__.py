@@ -0,0 +1,131 @@
+"""HavenApp Backend - Versioned schema migrations
+
+Each module in this package named NNNN_description.py is one migration,
+applied in order of NNNN. It defines upgrade(connection), which runs in its
+own transaction together with recording its version in schema_migrations,
+so a failed migration leaves nothing half-applied and is retried next run.
+
+Migrations describe their own tables rather than importing models.py: the
+models show the schema as of now, a migration shows one step towards it.
+
+Run once per deploy, before the new workers start:
+
+    flask --app wsgi migrate
+
+With DATABASE_SHARD_URLS set, `migrate` also applies the chain to every
+shard, through for_shard(engine); a migration that must differ there (e.g.
+no foreign keys to the primary's users) checks is_shard(connection).
+"""
+import importlib
+import os
+import re
+from datetime import datetime
+from sqlalchemy import Column, DateTime, Integer, MetaData, String, Table, inspect, select, text
+
+VERSION_TABLE = 'schema_migrations'
+
+# Arbitrary key for the PostgreSQL advisory lock that keeps concurrent
+# deploys from applying the same migration twice
+ADVISORY_LOCK_KEY = 7240562
+
+SHARD_OPTION = 'havenapp_shard'
+
+_FILENAME = re.compile(r'^(\d{4})_(\w+)\.py$')
+
+_version_metadata = MetaData()
+schema_migrations = Table(
+    VERSION_TABLE, _version_metadata,
+    Column('version', Integer, primary_key=True),
+    Column('name', String(255), nullable=False),
+    Column('applied_at', DateTime, nullable=False),
+)
+
+
+def discover():
+    """[(version, name, module)] for every migration in this package, in order"""
+    found = []
+    for filename in sorted(os.listdir(os.path.dirname(os.path.abspath(__file__)))):
+        match = _FILENAME.match(filename)
+        if match:
+            name = filename[:-3]
+            found.append((int(match.group(1)), name, importlib.import_module(f'{__name__}.{name}')))
+    return found
+
+
+def for_shard(engine):
+    """engine marked as a shard database, for upgrade(), pending() and drift()"""
+    return engine.execution_options(**{SHARD_OPTION: True})
+
+
+def is_shard(connection):
+    """Whether a migration is running on a shard database rather than the primary"""
+    return bool(connection.get_execution_options().get(SHARD_OPTION))
+
+
+def applied_versions(connection):
+    if not inspect(connection).has_table(VERSION_TABLE):
+        return set()
+    return set(connection.execute(select(schema_migrations.c.version)).scalars())
+
+
+def pending(engine):
+    """[(version, name)] not yet applied to engine's database"""
+    with engine.connect() as connection:
+        done = applied_versions(connection)
+    return [(version, name) for version, name, _ in discover() if version not in done]
+
+
+def upgrade(engine, target=None, log=None):
+    """Apply pending migrations up to target (default all); returns [(version, name)] applied"""
+    applied = []
+    with engine.connect() as lock_connection:
+        _lock(lock_connection)
+        try:
+            with engine.begin() as connection:
+                _version_metadata.create_all(connection, checkfirst=True)
+                done = applied_versions(connection)
+            for version, name, module in discover():
+                if version in done or (target is not None and version > target):
+                    continue
+                with engine.begin() as connection:
+                    if connection.dialect.name == 'postgresql':
+                        # Index builds on big tables outlast the request-sized DB_STATEMENT_TIMEOUT_MS
+                        connection.execute(text('SET LOCAL statement_timeout = 0'))
+                    module.upgrade(connection)
+                    connection.execute(schema_migrations.insert().values(
+                        version=version, name=name, applied_at=datetime.utcnow(),
+                    ))
+                applied.append((version, name))
+                if log:
+                    log(f'Applied {name}')
+        finally:
+            _unlock(lock_connection)
+    return applied
+
+
+def drift(engine, metadata):
+    """Tables, columns and indexes declared in metadata but missing from the database"""
+    missing = []
+    with engine.connect() as connection:
+        inspector = inspect(connection)
+        existing_tables = set(inspector.get_table_names())
+        for table in metadata.sorted_tables:
+            if table.name not in existing_tables:
+                missing.append(f'table {table.name}')
+                continue
+            columns = {column['name'] for column in inspector.get_columns(table.name)}
+            missing += [f'column {table.name}.{column.name}' for column in table.columns if column.name not in columns]
+            indexes = {index['name'] for index in inspector.get_indexes(table.name)}
+            missing += [f'index {index.name}' for index in table.indexes if index.name not in indexes]
+    return missing
+
+
+def _lock(connection):
+    if connection.dialect.name == 'postgresql':
+        connection.execute(text('SELECT pg_advisory_lock(:key)'), {'key': ADVISORY_LOCK_KEY})
+
+
+def _unlock(connection):
+    if connection.dialect.name == 'postgresql':
+        connection.execute(text('SELECT pg_advisory_unlock(:key)'), {'key': ADVISORY_LOCK_KEY})
+        connection.commit()
@@ -1,48 +1,54 @@
 from datetime import datetime, timedelta
 from flask_sqlalchemy import SQLAlchemy
-from werkzeug.security import generate_password_hash, check_password_hash
+from database import RoutingSession
+from ids import UUIDString
+from passwords import hash_password, verify_password
+from serializers import Shape
 
-db = SQLAlchemy()
+db = SQLAlchemy(session_options={'class_': RoutingSession})
 
 
 class User(db.Model):
     __tablename__ = 'users'
 
-    id = db.Column(db.String(36), primary_key=True)
+    id = db.Column(UUIDString, primary_key=True)
     email = db.Column(db.String(255), unique=True, nullable=False, index=True)
     password_hash = db.Column(db.String(255), nullable=False)
     name = db.Column(db.String(255))
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
     is_active = db.Column(db.Boolean, default=True)
+    # Where the user's sharded rows live (see sharding.py); NULL is the primary
+    shard = db.Column(db.Integer)
+    shard_moving_to = db.Column(db.Integer)  # set while a move holds the user's writes
 
     # Relationships
     consent_records = db.relationship('ConsentRecord', backref='user', lazy=True, cascade='all, delete-orphan')
     signals = db.relationship('Signal', backref='user', lazy=True, cascade='all, delete-orphan')
     alerts = db.relationship('Alert', backref='user', lazy=True, cascade='all, delete-orphan')
     contacts = db.relationship('EmergencyContact', backref='user', lazy=True, cascade='all, delete-orphan')
+    signal_buckets = db.relationship('SignalBucket', backref='user', lazy=True, cascade='all, delete-orphan')
+    signal_rollups = db.relationship('SignalRollup', backref='user', lazy=True, cascade='all, delete-orphan')
 
     def set_password(self, password):
-        self.password_hash = generate_password_hash(password)
+        self.password_hash = hash_password(password)
 
     def check_password(self, password):
-        return check_password_hash(self.password_hash, password)
+        return verify_password(self.password_hash, password)
 
     def to_dict(self):
-        return {
-            'id': self.id,
-            'email': self.email,
-            'name': self.name,
-            'created_at': self.created_at.isoformat(),
-            'is_active': self.is_active,
-        }
+        return USER_SHAPE.dump(self)
 
 
 class ConsentRecord(db.Model):
     __tablename__ = 'consent_records'
+    __table_args__ = (
+        db.Index('ix_consent_records_user_id', 'user_id'),
+        {'info': {'sharded': True}},
+    )
 
-    id = db.Column(db.String(36), primary_key=True)
-    user_id = db.Column(db.String(36), db.ForeignKey('users.id'), nullable=False)
+    id = db.Column(UUIDString, primary_key=True)
+    user_id = db.Column(UUIDString, db.ForeignKey('users.id'), nullable=False)
     passive_detection = db.Column(db.Boolean, default=True)
     location_tracking = db.Column(db.Boolean, default=False)
     journaling = db.Column(db.Boolean, default=True)
@@ -51,43 +57,79 @@ class ConsentRecord(db.Model):
     updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
 
     def to_dict(self):
-        return {
-            'id': self.id,
-            'passive_detection': self.passive_detection,
-            'location_tracking': self.location_tracking,
-            'journaling': self.journaling,
-            'emergency_sharing': self.emergency_sharing,
-            'updated_at': self.updated_at.isoformat(),
-        }
+        return CONSENT_SHAPE.dump(self)
 
 
 class Signal(db.Model):
     __tablename__ = 'signals'
+    __table_args__ = (
+        db.Index('ix_signals_user_id_created_at', 'user_id', 'created_at'),
+        db.Index('ix_signals_created_at', 'created_at'),  # retention sweeps
+        {'info': {'sharded': True}},
+    )
 
-    id = db.Column(db.String(36), primary_key=True)
-    user_id = db.Column(db.String(36), db.ForeignKey('users.id'), nullable=False)
+    id = db.Column(UUIDString, primary_key=True)
+    user_id = db.Column(UUIDString, db.ForeignKey('users.id'), nullable=False)
     category = db.Column(db.String(50), nullable=False)  # communication, movement, device, self_report
     signal_type = db.Column(db.String(100), nullable=False)
     confidence = db.Column(db.Float, default=0.0)  # 0.0 to 1.0
-    metadata = db.Column(db.JSON)
+    # 'metadata' is reserved on declarative models, so map the column under another attribute
+    signal_metadata = db.Column('metadata', db.JSON)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
 
     def to_dict(self):
-        return {
-            'id': self.id,
-            'category': self.category,
-            'type': self.signal_type,
-            'confidence': self.confidence,
-            'metadata': self.metadata,
-            'timestamp': self.created_at.isoformat(),
-        }
+        return SIGNAL_SHAPE.dump(self)
+
+
+class SignalBucket(db.Model):
+    """Up to SIGNAL_BUCKET_MAX_SIGNALS of a user's signals from one time bucket,
+    column-packed (SIGNAL_STORAGE = 'buckets'; see signal_store.py)"""
+    __tablename__ = 'signal_buckets'
+    __table_args__ = (
+        db.Index('ix_signal_buckets_user_id_last_at', 'user_id', 'last_at'),
+        db.Index('ix_signal_buckets_last_at', 'last_at'),  # retention sweeps
+        {'info': {'sharded': True}},
+    )
+
+    user_id = db.Column(UUIDString, db.ForeignKey('users.id'), primary_key=True)
+    bucket_start = db.Column(db.DateTime, primary_key=True)
+    part = db.Column(db.Integer, primary_key=True, default=0)
+    count = db.Column(db.Integer, nullable=False, default=0)
+    last_at = db.Column(db.DateTime, nullable=False)  # newest signal in the bucket
+    version = db.Column(db.Integer, nullable=False, default=0)  # optimistic lock for appends
+    kinds = db.Column(db.JSON, nullable=False)  # [[category, type], ...], indexed by codes
+    codes = db.Column(db.LargeBinary, nullable=False)  # uint8 per signal
+    offsets = db.Column(db.LargeBinary, nullable=False)  # uint32 ms after bucket_start per signal
+    confidences = db.Column(db.LargeBinary, nullable=False)  # uint16, confidence * 65535
+    extras = db.Column(db.JSON)  # {position: metadata} for signals that have any
+
+
+class SignalRollup(db.Model):
+    """Signal count and confidence sum per user, category and UTC hour or day (see rollups.py)"""
+    __tablename__ = 'signal_rollups'
+    __table_args__ = (
+        db.Index('ix_signal_rollups_bucket_start', 'bucket_start'),  # retention sweeps
+        {'info': {'sharded': True}},
+    )
+
+    user_id = db.Column(UUIDString, db.ForeignKey('users.id'), primary_key=True)
+    granularity = db.Column(db.String(8), primary_key=True)  # hour, day
+    bucket_start = db.Column(db.DateTime, primary_key=True)
+    category = db.Column(db.String(50), primary_key=True)
+    count = db.Column(db.Integer, nullable=False, default=0)
+    confidence_sum = db.Column(db.Float, nullable=False, default=0.0)
 
 
 class Alert(db.Model):
     __tablename__ = 'alerts'
+    __table_args__ = (
+        db.Index('ix_alerts_user_id_created_at', 'user_id', 'created_at'),
+        db.Index('ix_alerts_created_at', 'created_at'),  # retention sweeps
+        {'info': {'sharded': True}},
+    )
 
-    id = db.Column(db.String(36), primary_key=True)
-    user_id = db.Column(db.String(36), db.ForeignKey('users.id'), nullable=False)
+    id = db.Column(UUIDString, primary_key=True)
+    user_id = db.Column(UUIDString, db.ForeignKey('users.id'), nullable=False)
     risk_level = db.Column(db.Float, default=0.0)  # 0.0 to 1.0
     alert_type = db.Column(db.String(50), default='passive')  # passive, manual, panic
     signals = db.Column(db.JSON)  # List of signal IDs contributing to alert
@@ -95,22 +137,39 @@ class Alert(db.Model):
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
 
+    def to_dict(self):
+        return ALERT_SHAPE.dump(self)
+
+
+class RiskState(db.Model):
+    __tablename__ = 'risk_states'
+    __table_args__ = {'info': {'sharded': True}}
+
+    user_id = db.Column(UUIDString, db.ForeignKey('users.id'), primary_key=True)
+    category_sums = db.Column(db.JSON)  # {category: decayed confidence sum as of scored_at}
+    recent_signals = db.Column(db.JSON)  # Most recent contributing signal IDs
+    score = db.Column(db.Float, default=0.0)  # 0.0 to 1.0
+    alert_active = db.Column(db.Boolean, default=False)  # Passive alert raised and not yet reset
+    scored_at = db.Column(db.DateTime, default=datetime.utcnow)
+
     def to_dict(self):
         return {
-            'id': self.id,
-            'riskLevel': self.risk_level,
-            'type': self.alert_type,
-            'signals': self.signals or [],
-            'acknowledged': self.acknowledged,
-            'timestamp': self.created_at.isoformat(),
+            'score': self.score,
+            'categories': self.category_sums or {},
+            'alert_active': self.alert_active,
+            'scored_at': self.scored_at.isoformat(),
         }
 
 
 class EmergencyContact(db.Model):
     __tablename__ = 'emergency_contacts'
+    __table_args__ = (
+        db.Index('ix_emergency_contacts_user_id', 'user_id'),
+        {'info': {'sharded': True}},
+    )
 
-    id = db.Column(db.String(36), primary_key=True)
-    user_id = db.Column(db.String(36), db.ForeignKey('users.id'), nullable=False)
+    id = db.Column(UUIDString, primary_key=True)
+    user_id = db.Column(UUIDString, db.ForeignKey('users.id'), nullable=False)
     name = db.Column(db.String(255), nullable=False)
     phone = db.Column(db.String(20))
     email = db.Column(db.String(255))
@@ -119,32 +178,132 @@ class EmergencyContact(db.Model):
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
 
     def to_dict(self):
-        return {
-            'id': self.id,
-            'name': self.name,
-            'phone': self.phone,
-            'email': self.email,
-            'relationship': self.relationship,
-            'is_advocate': self.is_advocate,
-        }
+        return CONTACT_SHAPE.dump(self)
 
 
 class AuditLog(db.Model):
     __tablename__ = 'audit_logs'
+    __table_args__ = (
+        db.Index('ix_audit_logs_user_id', 'user_id'),  # account deletion
+        {'info': {'sharded': True}},
+    )
 
-    id = db.Column(db.String(36), primary_key=True)
-    user_id = db.Column(db.String(36), db.ForeignKey('users.id'), nullable=False)
+    id = db.Column(UUIDString, primary_key=True)
+    user_id = db.Column(UUIDString, db.ForeignKey('users.id'), nullable=False)
     action = db.Column(db.String(255), nullable=False)
     resource_type = db.Column(db.String(100))
-    resource_id = db.Column(db.String(36))
+    resource_id = db.Column(db.String(36))  # as the route saw it, so kept a plain string
     details = db.Column(db.JSON)
     timestamp = db.Column(db.DateTime, default=datetime.utcnow, index=True)
 
     def to_dict(self):
-        return {
-            'id': self.id,
-            'action': self.action,
-            'resource_type': self.resource_type,
-            'resource_id': self.resource_id,
-            'timestamp': self.timestamp.isoformat(),
-        }
+        return AUDIT_SHAPE.dump(self)
+
+
+class AccountDeletion(db.Model):
+    """A DELETE /api/user account wipe and its progress (see account_deletion.py)"""
+    __tablename__ = 'account_deletions'
+    __table_args__ = (
+        db.Index('ix_account_deletions_user_id', 'user_id'),
+        db.Index('ix_account_deletions_status', 'status'),
+    )
+
+    id = db.Column(UUIDString, primary_key=True)
+    user_id = db.Column(UUIDString, nullable=False)  # no foreign key: the record outlives the user
+    status = db.Column(db.String(16), nullable=False, default='pending')  # pending, running, done, failed
+    step = db.Column(db.String(32))  # table being deleted from
+    deleted = db.Column(db.JSON)  # {table: rows deleted so far}
+    runner = db.Column(db.String(36))  # claim token of the runner holding the lease
+    lease_until = db.Column(db.DateTime)  # another runner may resume the job after this
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    error = db.Column(db.Text)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    finished_at = db.Column(db.DateTime)
+
+    def to_dict(self):
+        return ACCOUNT_DELETION_SHAPE.dump(self)
+
+
+class ShardMove(db.Model):
+    """A move of one user's rows between shards and its progress (see sharding.py)"""
+    __tablename__ = 'shard_moves'
+    __table_args__ = (
+        db.Index('ix_shard_moves_user_id', 'user_id'),
+        db.Index('ix_shard_moves_status', 'status'),
+    )
+
+    id = db.Column(UUIDString, primary_key=True)
+    user_id = db.Column(UUIDString, nullable=False)  # no foreign key: the record outlives the user
+    source = db.Column(db.Integer)  # NULL is the primary
+    target = db.Column(db.Integer, nullable=False)
+    status = db.Column(db.String(16), nullable=False, default='copying')  # copying, frozen, cleanup, done, aborted
+    copied = db.Column(db.JSON)  # {table: rows copied so far}
+    error = db.Column(db.Text)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    finished_at = db.Column(db.DateTime)
+
+
+# JSON output shapes, shared by to_dict() and the column-level list serializers
+USER_SHAPE = Shape(User, [
+    ('id', 'id'),
+    ('email', 'email'),
+    ('name', 'name'),
+    ('created_at', 'created_at', 'iso'),
+    ('is_active', 'is_active'),
+])
+
+CONSENT_SHAPE = Shape(ConsentRecord, [
+    ('id', 'id'),
+    ('passive_detection', 'passive_detection'),
+    ('location_tracking', 'location_tracking'),
+    ('journaling', 'journaling'),
+    ('emergency_sharing', 'emergency_sharing'),
+    ('updated_at', 'updated_at', 'iso'),
+])
+
+SIGNAL_SHAPE = Shape(Signal, [
+    ('id', 'id'),
+    ('category', 'category'),
+    ('type', 'signal_type'),
+    ('confidence', 'confidence'),
+    ('metadata', 'signal_metadata'),
+    ('timestamp', 'created_at', 'iso'),
+])
+
+ALERT_SHAPE = Shape(Alert, [
+    ('id', 'id'),
+    ('riskLevel', 'risk_level'),
+    ('type', 'alert_type'),
+    ('signals', 'signals', 'list'),
+    ('acknowledged', 'acknowledged'),
+    ('timestamp', 'created_at', 'iso'),
+])
+
+CONTACT_SHAPE = Shape(EmergencyContact, [
+    ('id', 'id'),
+    ('name', 'name'),
+    ('phone', 'phone'),
+    ('email', 'email'),
+    ('relationship', 'relationship'),
+    ('is_advocate', 'is_advocate'),
+])
+
+AUDIT_SHAPE = Shape(AuditLog, [
+    ('id', 'id'),
+    ('action', 'action'),
+    ('resource_type', 'resource_type'),
+    ('resource_id', 'resource_id'),
+    ('details', 'details'),
+    ('timestamp', 'timestamp', 'iso'),
+])
+
+ACCOUNT_DELETION_SHAPE = Shape(AccountDeletion, [
+    ('id', 'id'),
+    ('status', 'status'),
+    ('step', 'step'),
+    ('deleted', 'deleted'),
+    ('created_at', 'created_at', 'iso'),
+    ('finished_at', 'finished_at', 'iso'),
+])
@@ -0,0 +1,486 @@
+"""HavenApp Backend - Emergency contact notifications
+
+Routes call notify_contacts() after committing a panic alert, or any alert
+at or above NOTIFY_RISK_THRESHOLD. It only queues the alert, so the request
+never waits on delivery. A pool of NOTIFY_WORKERS threads per process then:
+
+- checks the user's emergency_sharing consent and looks up their contacts
+  (in its own session, off the request path)
+- queues one delivery per contact and channel (email, sms)
+- hands each delivery to the channel's transport, retrying failures with
+  exponential backoff until NOTIFY_MAX_ATTEMPTS
+- sends at most NOTIFY_CONTACT_RATE messages per contact and channel every
+  NOTIFY_CONTACT_RATE_WINDOW seconds; alerts arriving while a delivery to the
+  same contact is still waiting are batched into that delivery
+
+Transports are picked per channel by NOTIFY_EMAIL_TRANSPORT ('smtp', 'log',
+'stub') and NOTIFY_SMS_TRANSPORT ('webhook', 'log', 'stub'). 'stub' keeps
+messages in memory for tests; 'log' only logs that a message would be sent.
+
+The queue lives in the worker process: deliveries still waiting when a
+worker exits are logged and dropped. On in-memory SQLite (the testing
+config), whose single connection can't be shared with another thread, the
+consent and contact lookup runs in the request instead. The lookup reads
+consent and contacts from the user's shard (see database.py), which
+submit() takes from the request.
+"""
+import atexit
+import heapq
+import itertools
+import logging
+import os
+import queue
+import random
+import smtplib
+import threading
+import time
+from collections import deque
+from contextlib import nullcontext
+from email.message import EmailMessage
+from flask import current_app
+from sqlalchemy import select
+from sqlalchemy.orm import Session
+
+from models import db, User, ConsentRecord, EmergencyContact
+from database import current_shard, shard_bind
+
+# Queued by stop() to wake idle worker threads
+_WAKE = object()
+
+logger = logging.getLogger(__name__)
+
+
+class LogTransport:
+    """Logs each message instead of sending it"""
+
+    def __init__(self, channel):
+        self.channel = channel
+
+    def send(self, address, subject, body):
+        logger.info(f'Notification ({self.channel}) not sent, no transport configured: {subject}')
+
+
+class StubTransport:
+    """Keeps sent messages in memory; fail_next makes that many sends raise"""
+
+    def __init__(self, delay=0.0):
+        self.delay = delay
+        self.fail_next = 0
+        self.outbox = []
+        self._lock = threading.Lock()
+
+    def send(self, address, subject, body):
+        if self.delay:
+            time.sleep(self.delay)
+        with self._lock:
+            if self.fail_next > 0:
+                self.fail_next -= 1
+                raise ConnectionError('stub transport failure')
+            self.outbox.append({'to': address, 'subject': subject, 'body': body})
+
+
+class SMTPTransport:
+    """Sends email through an SMTP relay, one connection per message"""
+
+    def __init__(self, host, port=587, username=None, password=None, sender=None, starttls=True, timeout=10):
+        self.host = host
+        self.port = port
+        self.username = username
+        self.password = password
+        self.sender = sender
+        self.starttls = starttls
+        self.timeout = timeout
+
+    def send(self, address, subject, body):
+        message = EmailMessage()
+        message['From'] = self.sender
+        message['To'] = address
+        message['Subject'] = subject
+        message.set_content(body)
+        with smtplib.SMTP(self.host, self.port, timeout=self.timeout) as smtp:
+            if self.starttls:
+                smtp.starttls()
+            if self.username:
+                smtp.login(self.username, self.password)
+            smtp.send_message(message)
+
+
+class WebhookSMSTransport:
+    """Posts {'to', 'body'} to an SMS gateway's HTTP endpoint"""
+
+    def __init__(self, url, token=None, timeout=10):
+        self.url = url
+        self.token = token
+        self.timeout = timeout
+
+    def send(self, address, subject, body):
+        import requests
+
+        headers = {'Authorization': f'Bearer {self.token}'} if self.token else {}
+        response = requests.post(self.url, json={'to': address, 'body': body}, headers=headers,
+                                 timeout=self.timeout)
+        response.raise_for_status()
+
+
+class Delivery:
+    """Alerts waiting to be sent to one contact over one channel"""
+
+    __slots__ = ('channel', 'address', 'contact_id', 'user_name', 'alerts', 'attempts', 'queued_at')
+
+    def __init__(self, channel, address, contact_id, user_name, alert, queued_at):
+        self.channel = channel
+        self.address = address
+        self.contact_id = contact_id
+        self.user_name = user_name
+        self.alerts = [alert]
+        self.attempts = 0
+        self.queued_at = queued_at
+
+    @property
+    def key(self):
+        return self.channel, self.address
+
+
+def render_message(user_name, alerts):
+    """(subject, body) for a delivery of one or more alerts"""
+    who = user_name or 'A HavenApp user'
+    latest = alerts[-1]
+    kind = 'a panic alert' if latest.get('type') == 'panic' else 'a safety alert'
+    when = (latest.get('timestamp') or '')[:16].replace('T', ' ')
+    if len(alerts) == 1:
+        subject = f'{who} raised {kind}'
+        body = f'{who} raised {kind} at {when} UTC and listed you as an emergency contact.'
+    else:
+        subject = f'{who} raised {len(alerts)} alerts'
+        body = (f'{who} raised {len(alerts)} alerts, the latest {kind} at {when} UTC, '
+                f'and listed you as an emergency contact.')
+    return subject, body + ' Please check on them.'
+
+
+class NotificationDispatcher:
+    """Bounded queue of alerts fanned out to contacts by a pool of worker threads"""
+
+    def __init__(self, transports, workers=4, max_queue=10000, max_attempts=5, backoff=2.0,
+                 backoff_max=300.0, rate=5, rate_window=60.0, batch_max=20):
+        self.transports = transports
+        self.workers = workers
+        self.max_attempts = max_attempts
+        self.backoff = backoff
+        self.backoff_max = backoff_max
+        self.rate = rate
+        self.rate_window = rate_window
+        self.batch_max = batch_max
+        self.latency_observers = []  # callables(seconds, channel), run after each delivery
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._lock = threading.Lock()
+        self._wakeup = threading.Condition(self._lock)
+        self._delayed = []  # heap of (due, seq, delivery)
+        self._seq = itertools.count()
+        self._waiting = {}  # (channel, address) -> Delivery not yet handed to a transport
+        self._sent = {}  # (channel, address) -> deque of recent send times
+        self._latencies = deque(maxlen=1000)
+        self._stopping = threading.Event()
+        self._threads = []
+        self._pid = None
+        self._engines = {}
+        self._shared_connection = False
+        self.in_flight = 0
+        self.enqueued = 0
+        self.dropped = 0
+        self.no_consent = 0
+        self.delivered = 0
+        self.retried = 0
+        self.failed = 0
+        self.rate_limited = 0
+        self.batched = 0
+
+    def submit(self, user_id, alert):
+        """Queue an alert for fan-out; returns False (and counts a drop) if the queue is full"""
+        self._ensure_started()
+        if self._shared_connection:
+            # Another thread must not use the request's connection; look up contacts here
+            self._fan_out(user_id, alert, time.monotonic(), session=db.session)
+            with self._lock:
+                self.enqueued += 1
+            return True
+        try:
+            self._queue.put_nowait((user_id, alert, time.monotonic(), current_shard()))
+        except queue.Full:
+            with self._lock:
+                self.dropped += 1
+            logger.error(f'Notification queue full, alert {alert.get("id")} not sent to contacts')
+            return False
+        with self._lock:
+            self.enqueued += 1
+        return True
+
+    def _ensure_started(self):
+        # Threads don't survive a fork, so each gunicorn worker starts its own
+        if self._pid == os.getpid() and all(thread.is_alive() for thread in self._threads):
+            return
+        with self._lock:
+            if self._pid == os.getpid() and all(thread.is_alive() for thread in self._threads):
+                return
+            if self._pid != os.getpid():
+                # Whatever the parent had in flight belongs to the parent
+                self._delayed, self._waiting, self._sent = [], {}, {}
+                self._threads = []
+                self.in_flight = 0
+            self._engines = dict(db.engines)
+            # In-memory SQLite has one connection, shared by every thread
+            self._shared_connection = (db.engine.dialect.name == 'sqlite'
+                                       and db.engine.url.database in (None, '', ':memory:'))
+            self._pid = os.getpid()
+            self._stopping.clear()
+            targets = [('notify-scheduler', self._schedule)]
+            targets += [(f'notify-worker-{i}', self._work) for i in range(self.workers)]
+            running = {thread.name for thread in self._threads if thread.is_alive()}
+            for name, target in targets:
+                if name not in running:
+                    thread = threading.Thread(target=target, name=name, daemon=True)
+                    thread.start()
+                    self._threads = [t for t in self._threads if t.name != name] + [thread]
+
+    def _work(self):
+        while not (self._stopping.is_set() and self._queue.empty()):
+            try:
+                item = self._queue.get(timeout=1.0)
+            except queue.Empty:
+                continue
+            if item is _WAKE:
+                continue
+            with self._lock:
+                self.in_flight += 1
+            try:
+                if isinstance(item, Delivery):
+                    self._deliver(item)
+                else:
+                    self._fan_out(*item)
+            except Exception as e:
+                logger.error(f'Notification worker error: {str(e)}')
+            finally:
+                with self._lock:
+                    self.in_flight -= 1
+
+    def _schedule(self):
+        # Moves deliveries whose backoff or rate limit has passed back onto the queue
+        while not self._stopping.is_set():
+            with self._wakeup:
+                timeout = self._delayed[0][0] - time.monotonic() if self._delayed else 1.0
+                if timeout > 0:
+                    self._wakeup.wait(min(timeout, 1.0))
+                due = []
+                now = time.monotonic()
+                while self._delayed and self._delayed[0][0] <= now:
+                    due.append(heapq.heappop(self._delayed)[2])
+            for delivery in due:
+                self._queue.put(delivery)
+
+    def _fan_out(self, user_id, alert, queued_at, shard=None, session=None):
+        # db.session (passed in from the request) routes by itself; otherwise consent and
+        # contacts are read on the user's shard and the name on the primary, where users stays
+        own_session = session is None
+        with Session(self._engines[shard_bind(shard)]) if own_session else nullcontext(session) as session:
+            sharing = session.execute(
+                select(ConsentRecord.emergency_sharing).where(ConsentRecord.user_id == user_id)
+            ).scalar()
+            if not sharing:
+                with self._lock:
+                    self.no_consent += 1
+                return
+            contacts = session.execute(
+                select(EmergencyContact.id, EmergencyContact.email, EmergencyContact.phone)
+                .where(EmergencyContact.user_id == user_id)
+            ).all()
+            with Session(self._engines[None]) if own_session and shard is not None else nullcontext(session) as users:
+                user_name = users.execute(select(User.name).where(User.id == user_id)).scalar()
+
+        for contact_id, email, phone in contacts:
+            for channel, address in (('email', email), ('sms', phone)):
+                if address and channel in self.transports:
+                    self._add(Delivery(channel, address, contact_id, user_name, alert, queued_at))
+
+    def _add(self, delivery):
+        with self._lock:
+            waiting = self._waiting.get(delivery.key)
+            if waiting is not None and len(waiting.alerts) < self.batch_max:
+                waiting.alerts += delivery.alerts
+                self.batched += 1
+                return
+            self._waiting[delivery.key] = delivery
+            due = self._next_send_locked(delivery.key)
+            if due > time.monotonic():
+                self.rate_limited += 1
+            self._enqueue_locked(delivery, due)
+
+    def _next_send_locked(self, key):
+        """Earliest time another message may go to key under the per-contact rate limit"""
+        sent = self._sent.get(key)
+        now = time.monotonic()
+        while sent and sent[0] <= now - self.rate_window:
+            sent.popleft()
+        if not sent:
+            self._sent.pop(key, None)
+            return now
+        return now if len(sent) < self.rate else sent[0] + self.rate_window
+
+    def _enqueue_locked(self, delivery, due):
+        if due <= time.monotonic():
+            try:
+                self._queue.put_nowait(delivery)
+                return
+            except queue.Full:
+                # The scheduler thread may block on a full queue; worker threads must not
+                due = time.monotonic() + 1.0
+        heapq.heappush(self._delayed, (due, next(self._seq), delivery))
+        self._wakeup.notify()
+
+    def _deliver(self, delivery):
+        with self._lock:
+            due = self._next_send_locked(delivery.key)
+            if due > time.monotonic():
+                self.rate_limited += 1
+                self._enqueue_locked(delivery, due)
+                return
+            self._sent.setdefault(delivery.key, deque()).append(time.monotonic())
+            # Alerts arriving from now on start a new delivery
+            if self._waiting.get(delivery.key) is delivery:
+                del self._waiting[delivery.key]
+
+        subject, body = render_message(delivery.user_name, delivery.alerts)
+        delivery.attempts += 1
+        try:
+            self.transports[delivery.channel].send(delivery.address, subject, body)
+        except Exception as e:
+            self._retry(delivery, e)
+            return
+
+        latency = time.monotonic() - delivery.queued_at
+        with self._lock:
+            self.delivered += 1
+            self._latencies.append(latency)
+        for observe in self.latency_observers:
+            observe(latency, delivery.channel)
+
+    def _retry(self, delivery, error):
+        if delivery.attempts >= self.max_attempts:
+            with self._lock:
+                self.failed += 1
+            logger.error(f'Notification to contact {delivery.contact_id} ({delivery.channel}) failed '
+                         f'after {delivery.attempts} attempts: {str(error)}')
+            return
+        delay = min(self.backoff * 2 ** (delivery.attempts - 1), self.backoff_max)
+        delay *= random.uniform(0.8, 1.2)
+        with self._lock:
+            self.retried += 1
+            waiting = self._waiting.get(delivery.key)
+            if waiting is not None:
+                # Newer alerts for this contact are already queued; send everything together
+                waiting.alerts[:0] = delivery.alerts
+                waiting.attempts = max(waiting.attempts, delivery.attempts)
+                waiting.queued_at = min(waiting.queued_at, delivery.queued_at)
+                return
+            self._waiting[delivery.key] = delivery
+            self._enqueue_locked(delivery, time.monotonic() + delay)
+
+    def stop(self, timeout=5.0):
+        """Send what is already queued, then stop the worker threads"""
+        if self._pid != os.getpid() or not self._threads:
+            return
+        self._stopping.set()
+        with self._wakeup:
+            self._wakeup.notify_all()
+        for _ in self._threads:
+            try:
+                self._queue.put_nowait(_WAKE)
+            except queue.Full:
+                pass
+        deadline = time.monotonic() + timeout
+        for thread in self._threads:
+            thread.join(max(0.0, deadline - time.monotonic()))
+        self._threads = []
+        if self._delayed:
+            logger.warning(f'{len(self._delayed)} contact notifications held back by backoff or rate limit were dropped')
+
+    def stats(self):
+        with self._lock:
+            latencies = sorted(self._latencies)
+            stats = {
+                'queue_depth': self._queue.qsize(),
+                'delayed': len(self._delayed),
+                'in_flight': self.in_flight,
+                'enqueued': self.enqueued,
+                'dropped': self.dropped,
+                'no_consent': self.no_consent,
+                'delivered': self.delivered,
+                'retried': self.retried,
+                'failed': self.failed,
+                'rate_limited': self.rate_limited,
+                'batched': self.batched,
+            }
+        if latencies:
+            stats['latency_p50_ms'] = round(latencies[len(latencies) // 2] * 1000, 1)
+            stats['latency_p95_ms'] = round(latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))] * 1000, 1)
+        return stats
+
+
+def build_transports(config):
+    """{channel: transport} from NOTIFY_EMAIL_TRANSPORT and NOTIFY_SMS_TRANSPORT"""
+    transports = {}
+    email = config.get('NOTIFY_EMAIL_TRANSPORT', 'log')
+    if email == 'smtp':
+        transports['email'] = SMTPTransport(
+            config['NOTIFY_SMTP_HOST'],
+            port=config.get('NOTIFY_SMTP_PORT', 587),
+            username=config.get('NOTIFY_SMTP_USERNAME'),
+            password=config.get('NOTIFY_SMTP_PASSWORD'),
+            sender=config.get('NOTIFY_EMAIL_SENDER'),
+            starttls=config.get('NOTIFY_SMTP_STARTTLS', True),
+        )
+    elif email == 'stub':
+        transports['email'] = StubTransport()
+    elif email == 'log':
+        transports['email'] = LogTransport('email')
+
+    sms = config.get('NOTIFY_SMS_TRANSPORT', 'log')
+    if sms == 'webhook':
+        transports['sms'] = WebhookSMSTransport(config['NOTIFY_SMS_WEBHOOK_URL'],
+                                                token=config.get('NOTIFY_SMS_WEBHOOK_TOKEN'))
+    elif sms == 'stub':
+        transports['sms'] = StubTransport()
+    elif sms == 'log':
+        transports['sms'] = LogTransport('sms')
+    return transports
+
+
+def init_notifications(app):
+    """Attach the contact notification dispatcher and drain it at interpreter exit"""
+    dispatcher = NotificationDispatcher(
+        build_transports(app.config),
+        workers=app.config.get('NOTIFY_WORKERS', 4),
+        max_queue=app.config.get('NOTIFY_QUEUE_SIZE', 10000),
+        max_attempts=app.config.get('NOTIFY_MAX_ATTEMPTS', 5),
+        backoff=app.config.get('NOTIFY_BACKOFF_SECONDS', 2.0),
+        backoff_max=app.config.get('NOTIFY_BACKOFF_MAX_SECONDS', 300.0),
+        rate=app.config.get('NOTIFY_CONTACT_RATE', 5),
+        rate_window=app.config.get('NOTIFY_CONTACT_RATE_WINDOW', 60.0),
+        batch_max=app.config.get('NOTIFY_BATCH_MAX', 20),
+    )
+    app.extensions['notification_dispatcher'] = dispatcher
+    atexit.register(dispatcher.stop)
+    return dispatcher
+
+
+def notify_contacts(user_id, alert):
+    """Queue alert for the user's emergency contacts if it is a panic or high-risk alert"""
+    if not current_app.config.get('NOTIFY_ENABLED', True):
+        return False
+    if alert.alert_type != 'panic' and (alert.risk_level or 0.0) < current_app.config.get('NOTIFY_RISK_THRESHOLD', 0.8):
+        return False
+    return current_app.extensions['notification_dispatcher'].submit(user_id, alert.to_dict())
+
+
+def notification_stats():
+    """Counters for the current app's notification dispatcher"""
+    dispatcher = current_app.extensions.get('notification_dispatcher')
+    return dispatcher.stats() if dispatcher else {}
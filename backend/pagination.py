@@ -0,0 +1,70 @@
+"""HavenApp Backend - Keyset pagination"""
+import base64
+from datetime import datetime
+from flask import current_app
+from sqlalchemy import and_, or_
+
+
+def encode_cursor(created_at, record_id):
+    """Encode the (created_at, id) position of a row as an opaque cursor"""
+    raw = f'{created_at.isoformat()}|{record_id}'
+    return base64.urlsafe_b64encode(raw.encode('utf-8')).decode('ascii').rstrip('=')
+
+
+def decode_cursor(cursor):
+    """Decode a cursor produced by encode_cursor, raising ValueError if malformed"""
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        raw = base64.urlsafe_b64decode(padded.encode('ascii')).decode('utf-8')
+        created_at, record_id = raw.split('|', 1)
+        return datetime.fromisoformat(created_at), record_id
+    except (ValueError, UnicodeError) as e:
+        raise ValueError('Invalid cursor') from e
+
+
+def parse_page_args(args):
+    """Read limit/cursor from request args, raising ValueError on bad input"""
+    default = current_app.config.get('PAGE_SIZE_DEFAULT', 50)
+    maximum = current_app.config.get('PAGE_SIZE_MAX', 200)
+
+    limit = args.get('limit', default)
+    try:
+        limit = int(limit)
+    except (TypeError, ValueError):
+        raise ValueError('limit must be an integer')
+    if limit < 1:
+        raise ValueError('limit must be positive')
+    limit = min(limit, maximum)
+
+    cursor = args.get('cursor')
+    position = decode_cursor(cursor) if cursor else None
+    return limit, position
+
+
+def keyset_page(query, model, limit, position=None):
+    """Fetch one newest-first page of query ordered by (created_at, id).
+
+    Returns (rows, next_cursor); next_cursor is None on the last page.
+    """
+    if position is not None:
+        created_at, record_id = position
+        query = query.filter(or_(
+            model.created_at < created_at,
+            and_(model.created_at == created_at, model.id < record_id),
+        ))
+
+    rows = query.order_by(model.created_at.desc(), model.id.desc()).limit(limit + 1).all()
+
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        last = rows[-1]
+        next_cursor = encode_cursor(last.created_at, last.id)
+    return rows, next_cursor
+
+
+def page_headers(next_cursor):
+    """Response headers describing where the next page starts"""
+    if not next_cursor:
+        return {}
+    return {'X-Next-Cursor': next_cursor}
@@ -0,0 +1,159 @@
+"""HavenApp Backend - Password hashing
+
+Password hashing is deliberately CPU-expensive. Running it on the request
+thread lets a burst of logins occupy every worker, so by default hashes are
+computed in a small per-worker process pool. At most PASSWORD_HASH_MAX_PENDING
+hash operations may be queued or running per worker; beyond that callers get
+PasswordHashingBusy straight away and the route answers 503, leaving the
+worker free for other endpoints (panic alerts in particular).
+"""
+import atexit
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor, TimeoutError as FutureTimeout
+from concurrent.futures.process import BrokenProcessPool
+from flask import current_app, has_app_context
+from werkzeug.security import generate_password_hash, check_password_hash
+from werkzeug.security import DEFAULT_PBKDF2_ITERATIONS
+
+DEFAULT_METHOD = f'pbkdf2:sha256:{DEFAULT_PBKDF2_ITERATIONS}'
+
+
+class PasswordHashingBusy(Exception):
+    """Raised when the hashing pool is saturated and the request should be retried"""
+
+
+class HashingPool:
+    """Process pool plus admission control, created lazily in each worker process"""
+
+    def __init__(self, workers=2, max_pending=16, timeout=10.0, nice=10):
+        self.workers = workers
+        self.nice = nice
+        self.max_pending = max_pending
+        self.timeout = timeout
+        self._slots = threading.BoundedSemaphore(max_pending)
+        self._executor = None
+        self._pid = None
+        self._lock = threading.Lock()
+        self.completed = 0
+        self.rejected = 0
+
+    def _get_executor(self):
+        if self._executor is None or self._pid != os.getpid():
+            with self._lock:
+                if self._executor is None or self._pid != os.getpid():
+                    # spawn, not fork: the parent is multi-threaded. Pool processes
+                    # run at lower priority so request threads win contended CPUs.
+                    self._executor = ProcessPoolExecutor(
+                        max_workers=self.workers,
+                        mp_context=multiprocessing.get_context('spawn'),
+                        initializer=os.nice,
+                        initargs=(self.nice,),
+                    )
+                    self._pid = os.getpid()
+        return self._executor
+
+    def run(self, fn, *args):
+        if not self._slots.acquire(blocking=False):
+            with self._lock:
+                self.rejected += 1
+            raise PasswordHashingBusy('Password hashing is at capacity')
+        try:
+            future = self._get_executor().submit(fn, *args)
+        except BaseException:
+            self._slots.release()
+            raise
+        # A hash that times out keeps its pool process busy until it ends, so
+        # it keeps its slot until then too, not just until the caller gives up
+        future.add_done_callback(lambda _: self._slots.release())
+        try:
+            result = future.result(timeout=self.timeout)
+        except FutureTimeout:
+            future.cancel()
+            raise PasswordHashingBusy('Password hashing timed out')
+        except BrokenProcessPool:
+            # A pool process died; start a fresh pool for the next caller
+            self._executor = None
+            raise PasswordHashingBusy('Password hashing pool restarted')
+        with self._lock:
+            self.completed += 1
+        return result
+
+    def shutdown(self):
+        if self._executor is not None and self._pid == os.getpid():
+            self._executor.shutdown(wait=False, cancel_futures=True)
+        self._executor = None
+
+    def stats(self):
+        with self._lock:
+            return {
+                'workers': self.workers,
+                'max_pending': self.max_pending,
+                'completed': self.completed,
+                'rejected': self.rejected,
+            }
+
+
+def init_password_hashing(app):
+    """Attach the hashing pool to app when PASSWORD_HASH_OFFLOAD is enabled"""
+    pool = None
+    if app.config.get('PASSWORD_HASH_OFFLOAD', True):
+        pool = HashingPool(
+            workers=app.config.get('PASSWORD_HASH_WORKERS', 2),
+            max_pending=app.config.get('PASSWORD_HASH_MAX_PENDING', 16),
+            timeout=app.config.get('PASSWORD_HASH_TIMEOUT', 10.0),
+            nice=app.config.get('PASSWORD_HASH_NICE', 10),
+        )
+        atexit.register(pool.shutdown)
+    app.extensions['password_pool'] = pool
+    return pool
+
+
+def _method():
+    if has_app_context():
+        return current_app.config.get('PASSWORD_HASH_METHOD', DEFAULT_METHOD)
+    return DEFAULT_METHOD
+
+
+def _pool():
+    return current_app.extensions.get('password_pool') if has_app_context() else None
+
+
+def canonical_method(method):
+    """Expand a werkzeug method string to the form stored in the hash prefix"""
+    name, *args = method.split(':')
+    if name == 'pbkdf2':
+        hash_name = args[0] if args else 'sha256'
+        iterations = args[1] if len(args) > 1 else DEFAULT_PBKDF2_ITERATIONS
+        return f'pbkdf2:{hash_name}:{iterations}'
+    if name == 'scrypt':
+        return 'scrypt:' + ':'.join(args) if args else 'scrypt:32768:8:1'
+    return method
+
+
+def hash_password(password):
+    """Hash password with the configured method, in the pool if one is attached"""
+    method = _method()
+    pool = _pool()
+    if pool is None:
+        return generate_password_hash(password, method=method)
+    return pool.run(generate_password_hash, password, method)
+
+
+def verify_password(password_hash, password):
+    """Check password against password_hash, in the pool if one is attached"""
+    pool = _pool()
+    if pool is None:
+        return check_password_hash(password_hash, password)
+    return pool.run(check_password_hash, password_hash, password)
+
+
+def needs_rehash(password_hash):
+    """True if password_hash was made with a different method or cost than configured"""
+    return password_hash.split('$', 1)[0] != canonical_method(_method())
+
+
+def password_hashing_stats():
+    pool = _pool()
+    return pool.stats() if pool else {}
@@ -0,0 +1,122 @@
+"""HavenApp Backend - Request priority
+
+A gunicorn worker serves WORKER_THREADS requests at once and queues the
+rest in arrival order, so under load a panic alert waits behind whatever
+arrived first. The gate below caps ordinary requests at WORKER_THREADS -
+PANIC_RESERVED_THREADS in flight per worker. Beyond that they are answered
+503 with Retry-After straight away, which frees their thread in well under
+a millisecond, so a panic alert always finds a thread free or about to be.
+
+Priority requests (PRIORITY_ENDPOINTS, plus POST /api/alerts with type
+'panic') bypass the gate. WORKER_THREADS must match gunicorn's --threads;
+the gate is off when it is unset. PRIORITY_GATE_LIMIT sizes it instead of
+the threads left after the reservation; a lower limit leaves the remaining
+threads to alert streams, a higher one sheds less but lets ordinary requests
+take the reserved threads.
+
+A streamed response keeps its thread after the view returns and the request
+is torn down, until the server closes the response. The export keeps its
+slot until then too. An alert stream stays open for as long as the client
+listens, so it hands its slot back as soon as it starts and is counted
+apart, under 'streams': it runs on the threads the gate leaves (see
+events.stream_capacity), and open streams never shed ordinary requests.
+"""
+import threading
+from flask import g, jsonify, request
+
+PRIORITY_ENDPOINTS = frozenset({'create_panic_alert', 'health_check', 'metrics'})
+STREAM_ENDPOINTS = frozenset({'stream_alerts'})
+
+
+def is_priority_request():
+    if request.endpoint in PRIORITY_ENDPOINTS:
+        return True
+    if request.endpoint == 'create_alert' and request.method == 'POST':
+        data = request.get_json(silent=True)
+        return isinstance(data, dict) and data.get('type') == 'panic'
+    return False
+
+
+class PriorityGate:
+    """Caps concurrent ordinary requests so some threads stay free for priority ones"""
+
+    def __init__(self, limit):
+        self.limit = limit
+        self._slots = threading.BoundedSemaphore(limit)
+        self._lock = threading.Lock()
+        self.in_flight = 0
+        self.streams = 0
+        self.shed = 0
+        self.priority = 0
+
+    def before_request(self):
+        if is_priority_request():
+            with self._lock:
+                self.priority += 1
+            return None
+        if not self._slots.acquire(blocking=False):
+            with self._lock:
+                self.shed += 1
+            return jsonify({'error': 'Server busy, please retry'}), 503, {'Retry-After': '1'}
+        g._priority_slot = True
+        with self._lock:
+            self.in_flight += 1
+        return None
+
+    def after_request(self, response):
+        if not response.is_streamed or not g.pop('_priority_slot', None):
+            return response
+        if request.endpoint in STREAM_ENDPOINTS:
+            self._release()
+            with self._lock:
+                self.streams += 1
+            response.call_on_close(self._stream_closed)
+        else:
+            response.call_on_close(self._release)
+        return response
+
+    def teardown_request(self, exc=None):
+        if g.pop('_priority_slot', None):
+            self._release()
+
+    def _release(self):
+        with self._lock:
+            self.in_flight -= 1
+        self._slots.release()
+
+    def _stream_closed(self):
+        with self._lock:
+            self.streams -= 1
+
+    def stats(self):
+        with self._lock:
+            return {
+                'limit': self.limit,
+                'in_flight': self.in_flight,
+                'streams': self.streams,
+                'shed': self.shed,
+                'priority': self.priority,
+            }
+
+
+def gate_limit(config):
+    """Ordinary requests one worker serves at once, or None when there is no gate"""
+    threads = config.get('WORKER_THREADS')
+    reserved = config.get('PANIC_RESERVED_THREADS', 1)
+    if not threads or not reserved or threads <= reserved:
+        return None
+    limit = config.get('PRIORITY_GATE_LIMIT')
+    return max(limit, 1) if limit else threads - reserved
+
+
+def init_priority(app):
+    """Install the gate when WORKER_THREADS leaves room to reserve threads"""
+    limit = gate_limit(app.config)
+    if limit is None:
+        return None
+    gate = PriorityGate(limit)
+    app.extensions['priority_gate'] = gate
+    app.before_request(gate.before_request)
+    app.after_request(gate.after_request)
+    app.teardown_request(gate.teardown_request)
+    return gate
@@ -0,0 +1,199 @@
+"""HavenApp Backend - Data retention
+
+Deletes expired rows in small batches so the sweep can run while the API is
+serving traffic: each batch selects the next RETENTION_BATCH_SIZE expired ids
+in (timestamp, id) order, deletes them by primary key and commits, so no
+lock is held for longer than one small DELETE. The scan continues from the
+last key it saw rather than from the start of the index, and because every
+batch commits on its own, an interrupted sweep loses at most one batch and
+the next run picks up whatever is still expired. With SIGNAL_STORAGE =
+'buckets', signals go a whole bucket at a time (see signal_store.py). With
+DATABASE_SHARD_URLS set, every policy runs on the primary and then on each
+shard in turn.
+"""
+import logging
+import os
+import threading
+import time
+from datetime import datetime, timedelta
+from flask import current_app
+from sqlalchemy import and_, delete, or_, select, text
+
+from models import db, Signal, Alert, AuditLog, SignalRollup
+from database import each_shard, on_shard
+import rollups
+from signal_store import signal_store
+from versions import bump_all_versions
+
+logger = logging.getLogger(__name__)
+
+# Arbitrary key for the PostgreSQL advisory lock that keeps scheduled sweeps
+# from running in several gunicorn workers at once
+ADVISORY_LOCK_KEY = 7240561
+
+# name -> (model, timestamp column, retention config key, extra filter)
+POLICIES = {
+    'signals': (Signal, Signal.created_at, 'SIGNAL_RETENTION_DAYS', None),
+    'alerts': (Alert, Alert.created_at, 'ALERT_RETENTION_DAYS', Alert.acknowledged.is_(True)),
+    'audit_logs': (AuditLog, AuditLog.timestamp, 'AUDIT_RETENTION_DAYS', None),
+    'signal_rollups': (SignalRollup, SignalRollup.bucket_start, 'SIGNAL_ROLLUP_RETENTION_DAYS', None),
+}
+
+
+def _custom_purge(name):
+    """purge_before(cutoff, batch_size, pause) for policies not keyed by an id column, else None"""
+    if name == 'signal_rollups':
+        return rollups.purge_before
+    store = signal_store()
+    if name == 'signals' and store.name == 'buckets':
+        return store.purge_before
+    return None
+
+
+def purge_policy(name, now=None, batch_size=None, pause=None):
+    """Delete rows past the retention window for one policy.
+
+    Returns {'deleted': rows, 'batches': n, 'seconds': elapsed}.
+    """
+    model, column, days_key, extra = POLICIES[name]
+    config = current_app.config
+    days = config.get(days_key)
+    batch_size = batch_size or config.get('RETENTION_BATCH_SIZE', 500)
+    pause = config.get('RETENTION_BATCH_PAUSE', 0.05) if pause is None else pause
+
+    if not days:
+        return {'deleted': 0, 'batches': 0, 'seconds': 0.0}
+
+    started = time.perf_counter()
+    deleted = batches = 0
+
+    cutoff = (now or datetime.utcnow()) - timedelta(days=days)
+    purge = _custom_purge(name)
+    if purge is not None:
+        report = purge(cutoff, batch_size=batch_size, pause=pause)
+        if report['deleted']:
+            logger.info(f"Retention removed {report['deleted']} {name} in {report['batches']} batches "
+                        f"({report['seconds']:.2f}s)")
+        return report
+
+    last = None
+    while True:
+        stmt = select(column, model.id).where(column < cutoff)
+        if extra is not None:
+            stmt = stmt.where(extra)
+        if last is not None:
+            stmt = stmt.where(or_(column > last[0], and_(column == last[0], model.id > last[1])))
+        rows = db.session.execute(stmt.order_by(column, model.id).limit(batch_size)).all()
+        if not rows:
+            break
+
+        ids = [row[1] for row in rows]
+        result = db.session.execute(
+            delete(model).where(model.id.in_(ids)).execution_options(synchronize_session=False)
+        )
+        db.session.commit()
+
+        deleted += result.rowcount
+        batches += 1
+        last = tuple(rows[-1])
+        if len(rows) < batch_size:
+            break
+        if pause:
+            time.sleep(pause)
+
+    elapsed = time.perf_counter() - started
+    if deleted:
+        logger.info(f'Retention removed {deleted} {name} rows in {batches} batches ({elapsed:.2f}s)')
+    return {'deleted': deleted, 'batches': batches, 'seconds': round(elapsed, 3)}
+
+
+def purge_expired(policies=None, now=None, batch_size=None, pause=None):
+    """Run every (or the named) retention policy on every shard; returns a report per policy"""
+    now = now or datetime.utcnow()
+    report = {name: {'deleted': 0, 'batches': 0, 'seconds': 0.0} for name in (policies or POLICIES)}
+    for shard in each_shard():
+        with on_shard(shard):
+            for name, total in report.items():
+                result = purge_policy(name, now=now, batch_size=batch_size, pause=pause)
+                for key in total:
+                    total[key] += result[key]
+    for total in report.values():
+        total['seconds'] = round(total['seconds'], 3)
+    if any(report[name]['deleted'] for name in ('signals', 'alerts', 'signal_rollups') if name in report):
+        # Many users' lists just changed; cheaper to retire every ETag than to track whose
+        bump_all_versions()
+    return report
+
+
+def _try_sweep_lock(connection):
+    if connection.dialect.name != 'postgresql':
+        # Batched deletes are idempotent, so concurrent sweepers elsewhere only split the work
+        return True
+    return connection.execute(text('SELECT pg_try_advisory_lock(:key)'), {'key': ADVISORY_LOCK_KEY}).scalar()
+
+
+def _release_sweep_lock(connection):
+    if connection.dialect.name == 'postgresql':
+        connection.execute(text('SELECT pg_advisory_unlock(:key)'), {'key': ADVISORY_LOCK_KEY})
+
+
+class RetentionScheduler:
+    """Runs purge_expired every RETENTION_SWEEP_INTERVAL_HOURS in a background thread"""
+
+    def __init__(self, app, interval_seconds):
+        self.app = app
+        self.interval = interval_seconds
+        self._thread = None
+        self._pid = None
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self.last_report = None
+
+    def ensure_started(self):
+        # Threads don't survive a fork, so each gunicorn worker starts its own
+        if self._thread is not None and self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._thread is not None and self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            self._thread = threading.Thread(target=self._run, name='retention-sweeper', daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            with self.app.app_context():
+                try:
+                    self.sweep_once()
+                except Exception as e:
+                    db.session.rollback()
+                    logger.error(f'Retention sweep failed: {str(e)}')
+                finally:
+                    db.session.remove()
+
+    def sweep_once(self):
+        with db.engine.connect() as lock_connection:
+            if not _try_sweep_lock(lock_connection):
+                return None
+            try:
+                self.last_report = purge_expired()
+            finally:
+                _release_sweep_lock(lock_connection)
+                lock_connection.commit()
+        return self.last_report
+
+    def stop(self):
+        self._stop.set()
+
+
+def init_retention(app):
+    """Schedule background sweeps when RETENTION_SWEEP_INTERVAL_HOURS is set"""
+    hours = app.config.get('RETENTION_SWEEP_INTERVAL_HOURS', 0)
+    if not hours:
+        return None
+
+    scheduler = RetentionScheduler(app, hours * 3600)
+    app.extensions['retention_scheduler'] = scheduler
+    # Started from the first request so CLI commands and the gunicorn master stay thread-free
+    app.before_request(scheduler.ensure_started)
+    return scheduler
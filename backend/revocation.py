@@ -0,0 +1,305 @@
+"""HavenApp Backend - Token revocation
+
+POST /api/auth/logout revokes the presented access token and, if sent,
+the refresh token, so a stolen token stops working straight away rather
+than at expiry. flask_jwt_extended asks is_token_revoked() about every
+token it accepts, so the check must stay off the network:
+
+- each worker keeps a Bloom filter of every revoked jti; a miss, which is
+  what almost every request gets, answers "not revoked" in microseconds
+- a small exact LRU of recent revocations confirms most filter hits
+- only the remaining hits (the filter's false positives, or revocations
+  the worker hasn't cached) ask the shared store
+
+The store, selected by REVOCATION_BACKEND, keeps each jti until its token
+would have expired anyway. 'local' is an in-process stand-in (tests, one
+worker): gunicorn refuses to serve with it from more than one worker (see
+check_worker_count and gunicorn.conf.py), while CLI commands such as
+migrate still run. 'redis' writes to REDIS_URL and announces each
+revocation on a pub/sub channel that a listener thread in every worker adds
+to its filter.
+While that listener is down a worker can't trust its filter, so it asks
+Redis for every token until it has resubscribed and reloaded.
+
+Bloom filters can't forget, so each one is rebuilt from the store's live
+entries every REVOCATION_REBUILD_SECONDS, dropping tokens that have expired.
+"""
+import hashlib
+import logging
+import math
+import os
+import threading
+import time
+from collections import OrderedDict
+from flask import current_app
+
+logger = logging.getLogger(__name__)
+
+REDIS_PREFIX = 'havenapp:revoked'
+CHANNEL = 'havenapp:revocations'
+
+
+class BloomFilter:
+    """Fixed-size Bloom filter over strings, sized for capacity at error_rate"""
+
+    def __init__(self, capacity, error_rate):
+        self.capacity = capacity
+        self.size = max(8, math.ceil(-capacity * math.log(error_rate) / math.log(2) ** 2))
+        self.hashes = max(1, round(self.size / capacity * math.log(2)))
+        self._bits = bytearray((self.size + 7) // 8)
+        self._lock = threading.Lock()
+        self.count = 0
+
+    def _positions(self, key):
+        # Double hashing: k positions from one 128-bit digest
+        digest = hashlib.blake2b(key.encode('utf-8'), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], 'little')
+        h2 = int.from_bytes(digest[8:], 'little') | 1
+        return [(h1 + i * h2) % self.size for i in range(self.hashes)]
+
+    def add(self, key):
+        positions = self._positions(key)
+        with self._lock:
+            for position in positions:
+                self._bits[position >> 3] |= 1 << (position & 7)
+            self.count += 1
+
+    def __contains__(self, key):
+        bits = self._bits
+        return all(bits[position >> 3] & (1 << (position & 7)) for position in self._positions(key))
+
+
+class LocalRevocationStore:
+    """Revoked jtis held in this process"""
+
+    def __init__(self):
+        self._entries = {}  # jti -> exp
+        self._lock = threading.Lock()
+
+    def revoke(self, jti, exp):
+        with self._lock:
+            self._entries[jti] = exp
+
+    def is_revoked(self, jti):
+        exp = self._entries.get(jti)
+        return exp is not None and exp > time.time()
+
+    def live(self):
+        now = time.time()
+        with self._lock:
+            self._entries = {jti: exp for jti, exp in self._entries.items() if exp > now}
+            return list(self._entries.items())
+
+
+class RedisRevocationStore:
+    """Revoked jtis in Redis, each key expiring with its token"""
+
+    def __init__(self, redis_url, prefix=REDIS_PREFIX, channel=CHANNEL):
+        import redis
+
+        self._client = redis.Redis.from_url(redis_url)
+        self.prefix = prefix
+        self.channel = channel
+
+    def _key(self, jti):
+        return f'{self.prefix}:{jti}'
+
+    def revoke(self, jti, exp):
+        pipe = self._client.pipeline(transaction=False)
+        pipe.set(self._key(jti), 1, exat=int(exp))
+        pipe.publish(self.channel, f'{jti} {int(exp)}')
+        pipe.execute()
+
+    def is_revoked(self, jti):
+        return self._client.exists(self._key(jti)) > 0
+
+    def live(self):
+        entries = []
+        keys = list(self._client.scan_iter(match=f'{self.prefix}:*', count=1000))
+        for start in range(0, len(keys), 1000):
+            chunk = keys[start:start + 1000]
+            pipe = self._client.pipeline(transaction=False)
+            for key in chunk:
+                pipe.ttl(key)
+            now = time.time()
+            for key, ttl in zip(chunk, pipe.execute()):
+                if ttl and ttl > 0:
+                    entries.append((key.decode('utf-8')[len(self.prefix) + 1:], now + ttl))
+        return entries
+
+    def pubsub(self):
+        pubsub = self._client.pubsub(ignore_subscribe_messages=True)
+        pubsub.subscribe(self.channel)
+        return pubsub
+
+
+class RevocationList:
+    """This worker's view of the revoked tokens: Bloom filter, exact LRU, then the store"""
+
+    def __init__(self, store, capacity=100000, error_rate=0.001, exact_size=10000, rebuild_seconds=3600):
+        self.store = store
+        self.capacity = capacity
+        self.error_rate = error_rate
+        self.exact_size = exact_size
+        self.rebuild_seconds = rebuild_seconds
+        self._bloom = BloomFilter(capacity, error_rate)
+        self._exact = OrderedDict()  # jti -> exp
+        self._lock = threading.Lock()
+        self._rebuild_at = 0.0
+        # Only a store without pub/sub (local) is in sync from the start
+        self._listens = hasattr(store, 'pubsub')
+        self._synced = not self._listens
+        self._thread = None
+        self._pid = None
+        self.checks = 0
+        self.filter_hits = 0
+        self.store_lookups = 0
+        self.false_positives = 0
+        self.revoked = 0
+        self.rebuilds = 0
+
+    def _add(self, jti, exp):
+        with self._lock:
+            self._bloom.add(jti)
+            self._exact[jti] = exp
+            self._exact.move_to_end(jti)
+            while len(self._exact) > self.exact_size:
+                self._exact.popitem(last=False)
+
+    def rebuild(self):
+        """Replace the filter with one holding only the store's live entries"""
+        # Under the lock, so a revocation can't land in the filter being replaced
+        with self._lock:
+            entries = self.store.live()
+            bloom = BloomFilter(max(self.capacity, 2 * len(entries)), self.error_rate)
+            for jti, _ in entries:
+                bloom.add(jti)
+            self._bloom = bloom
+            self._rebuild_at = time.monotonic() + self.rebuild_seconds
+            self.rebuilds += 1
+
+    def revoke(self, jti, exp):
+        self.store.revoke(jti, exp)
+        # Seen by this worker at once, before any pub/sub round trip
+        self._add(jti, exp)
+        self.revoked += 1
+
+    def is_revoked(self, jti):
+        self.checks += 1
+        if self._listens:
+            self.ensure_listening()
+        elif time.monotonic() >= self._rebuild_at:
+            self.rebuild()
+        if self._synced and jti not in self._bloom:
+            return False
+        self.filter_hits += 1
+        exp = self._exact.get(jti)
+        if exp is not None and exp > time.time():
+            return True
+        self.store_lookups += 1
+        try:
+            revoked = self.store.is_revoked(jti)
+        except Exception as e:
+            logger.error(f'Could not check token revocation: {str(e)}')
+            # A filter hit fails closed; without a synced filter every token
+            # would get here, and refusing them all would lock everyone out
+            return self._synced
+        if not revoked and self._synced:
+            self.false_positives += 1
+        return revoked
+
+    def ensure_listening(self):
+        # The listener thread does not survive a fork, so each worker starts its own
+        if self._thread is not None and self._pid == os.getpid() and self._thread.is_alive():
+            return
+        with self._lock:
+            if self._thread is not None and self._pid == os.getpid() and self._thread.is_alive():
+                return
+            self._synced = False
+            self._pid = os.getpid()
+            self._thread = threading.Thread(target=self._listen, name='token-revocations', daemon=True)
+            self._thread.start()
+
+    def _listen(self):
+        while True:
+            try:
+                # Subscribe before loading, so nothing revoked in between is missed
+                pubsub = self.store.pubsub()
+                self.rebuild()
+                self._synced = True
+                while True:
+                    message = pubsub.get_message(timeout=1.0)
+                    if message and message.get('type') == 'message':
+                        data = message['data']
+                        if isinstance(data, bytes):
+                            data = data.decode('utf-8')
+                        jti, exp = data.split(' ', 1)
+                        self._add(jti, int(exp))
+                    if time.monotonic() >= self._rebuild_at:
+                        self.rebuild()
+            except Exception as e:
+                self._synced = False
+                logger.warning(f'Token revocation listener reconnecting: {str(e)}')
+                time.sleep(1.0)
+
+    def stats(self):
+        return {
+            'synced': self._synced,
+            'filter_entries': self._bloom.count,
+            'filter_bits': self._bloom.size,
+            'exact_size': len(self._exact),
+            'checks': self.checks,
+            'filter_hits': self.filter_hits,
+            'store_lookups': self.store_lookups,
+            'false_positives': self.false_positives,
+            'revoked': self.revoked,
+            'rebuilds': self.rebuilds,
+        }
+
+
+def init_revocation(app, jwt):
+    """Attach the revocation list and register it as jwt's blocklist check"""
+    if not app.config.get('REVOCATION_ENABLED', True):
+        return None
+    if app.config.get('REVOCATION_BACKEND', 'local') == 'redis':
+        store = RedisRevocationStore(app.config['REDIS_URL'])
+    else:
+        store = LocalRevocationStore()
+    revocations = RevocationList(
+        store,
+        capacity=app.config.get('REVOCATION_BLOOM_CAPACITY', 100000),
+        error_rate=app.config.get('REVOCATION_BLOOM_ERROR_RATE', 0.001),
+        exact_size=app.config.get('REVOCATION_EXACT_SIZE', 10000),
+        rebuild_seconds=app.config.get('REVOCATION_REBUILD_SECONDS', 3600),
+    )
+    app.extensions['revocations'] = revocations
+
+    @jwt.token_in_blocklist_loader
+    def is_token_revoked(jwt_header, jwt_payload):
+        return revocations.is_revoked(jwt_payload['jti'])
+
+    return revocations
+
+
+def check_worker_count(app, workers):
+    """Raise ValueError if app's revocations can't reach all of `workers` serving processes"""
+    revocations = app.extensions.get('revocations')
+    if revocations is None or workers <= 1 or isinstance(revocations.store, RedisRevocationStore):
+        return
+    # A logout would only reach the worker that served it
+    raise ValueError(f"REVOCATION_BACKEND 'local' covers one process, not {workers} workers; set REDIS_URL")
+
+
+def revoke_token(payload):
+    """Revoke the decoded token payload until it expires; False if revocation is off"""
+    revocations = current_app.extensions.get('revocations')
+    if revocations is None:
+        return False
+    exp = payload.get('exp') or time.time() + current_app.config.get('JWT_REFRESH_TOKEN_EXPIRES', 30) * 86400
+    revocations.revoke(payload['jti'], exp)
+    return True
+
+
+def revocation_stats():
+    revocations = current_app.extensions.get('revocations')
+    return revocations.stats() if revocations else {}
@@ -0,0 +1,184 @@
+"""HavenApp Backend - Signal rollups
+
+signal_rollups keeps, per user, category and UTC hour or day, the number of
+signals and the sum of their confidences. Signal writes fold their rows in
+with add_signals() inside the same transaction, as a single upsert that
+increments the counters (concurrent writers add rather than overwrite), so
+the summary endpoint reads at most one row per bucket and category however
+many raw signals there are.
+
+`flask rebuild-rollups` recomputes the table from the signal store, e.g.
+after a backfill or on a database that predates rollups. Rollups outlive
+the signals they count (SIGNAL_ROLLUP_RETENTION_DAYS against
+SIGNAL_RETENTION_DAYS),
+so it only replaces buckets starting at or after the oldest stored signal,
+or --since: an earlier bucket, or the one that signal falls in, may count
+signals already purged. It works through users in batches, one commit each.
+"""
+import time
+from datetime import datetime, timedelta
+from sqlalchemy import delete, insert, select, tuple_, update
+
+from models import db, SignalRollup
+from versions import bump_versions
+
+GRANULARITIES = {
+    'hour': 3600,
+    'day': 86400,
+}
+
+EPOCH = datetime(1970, 1, 1)
+
+
+def bucket_start(moment, granularity):
+    """Start of the UTC hour or day containing moment"""
+    seconds = GRANULARITIES[granularity]
+    epoch = int((moment - EPOCH).total_seconds())
+    return EPOCH + timedelta(seconds=epoch - epoch % seconds)
+
+
+def _next_bucket(moment, granularity):
+    """Start of the first UTC hour or day beginning at or after moment"""
+    start = bucket_start(moment, granularity)
+    return start if start == moment else start + timedelta(seconds=GRANULARITIES[granularity])
+
+
+def _increments(signals):
+    """{(granularity, bucket start, category): [count, confidence sum]} for (category, confidence, epoch seconds)"""
+    totals = {}
+    for category, confidence, seconds in signals:
+        for granularity, width in GRANULARITIES.items():
+            start = EPOCH + timedelta(seconds=int(seconds) - int(seconds) % width)
+            entry = totals.setdefault((granularity, start, category), [0, 0.0])
+            entry[0] += 1
+            entry[1] += confidence or 0.0
+    return totals
+
+
+def _upsert(user_totals):
+    """Add {user_id: increments} to the rollup counters"""
+    values = [
+        {'user_id': user_id, 'granularity': granularity, 'bucket_start': start, 'category': category,
+         'count': count, 'confidence_sum': confidence_sum}
+        for user_id, totals in user_totals.items()
+        for (granularity, start, category), (count, confidence_sum) in totals.items()
+    ]
+    if not values:
+        return
+    table = SignalRollup.__table__
+    dialect = db.session.get_bind(SignalRollup).dialect.name
+    if dialect in ('postgresql', 'sqlite'):
+        if dialect == 'postgresql':
+            from sqlalchemy.dialects.postgresql import insert as dialect_insert
+        else:
+            from sqlalchemy.dialects.sqlite import insert as dialect_insert
+        stmt = dialect_insert(table).values(values)
+        db.session.execute(stmt.on_conflict_do_update(
+            index_elements=[table.c.user_id, table.c.granularity, table.c.bucket_start, table.c.category],
+            set_={
+                'count': table.c.count + stmt.excluded.count,
+                'confidence_sum': table.c.confidence_sum + stmt.excluded.confidence_sum,
+            },
+        ))
+        return
+
+    for row in values:
+        key = (table.c.user_id == row['user_id'], table.c.granularity == row['granularity'],
+               table.c.bucket_start == row['bucket_start'], table.c.category == row['category'])
+        result = db.session.execute(update(table).where(*key).values(
+            count=table.c.count + row['count'],
+            confidence_sum=table.c.confidence_sum + row['confidence_sum'],
+        ))
+        if not result.rowcount:
+            db.session.execute(insert(table).values(**row))
+
+
+def add_signals(user_id, rows):
+    """Fold newly stored signal rows (SIGNAL_SHAPE order) into user_id's rollups, without committing"""
+    _upsert({user_id: _increments(
+        (row[1], row[3], (row[5] - EPOCH).total_seconds()) for row in rows
+    )})
+
+
+def summary(user_id, granularity, start, end):
+    """[(bucket start, category, count, confidence sum)] for buckets starting in [start, end)"""
+    table = SignalRollup.__table__
+    return db.session.execute(
+        select(table.c.bucket_start, table.c.category, table.c.count, table.c.confidence_sum)
+        .where(table.c.user_id == user_id, table.c.granularity == granularity,
+               table.c.bucket_start >= start, table.c.bucket_start < end)
+        .order_by(table.c.bucket_start, table.c.category)
+    ).all()
+
+
+def _users_after(store, after, since, limit):
+    """Up to limit ids, in order after `after`, of users with signals or with rollups from since on"""
+    table = SignalRollup.__table__
+    stmt = select(table.c.user_id).distinct().where(table.c.bucket_start >= since).order_by(table.c.user_id).limit(limit)
+    if after is not None:
+        stmt = stmt.where(table.c.user_id > after)
+    listed = [store.user_ids(after, limit), db.session.execute(stmt).scalars().all()]
+    # A full list may stop short of ids the other one reached
+    bound = min((ids[-1] for ids in listed if len(ids) == limit), default=None)
+    return sorted(user_id for user_id in set(listed[0]) | set(listed[1]) if bound is None or user_id <= bound)
+
+
+def rebuild(store, since=None, users_per_batch=100):
+    """Recompute the rollups of buckets starting at or after since from store; returns signals read.
+
+    since defaults to the oldest stored signal; with no signals at all
+    nothing is replaced. Commits after every users_per_batch users, then
+    bumps their 'signals' versions so summary ETags don't outlive the rebuild.
+    """
+    if since is None:
+        since = store.earliest()
+        if since is None:
+            return 0
+    starts = {granularity: _next_bucket(since, granularity) for granularity in GRANULARITIES}
+    first = min(starts.values())
+    table = SignalRollup.__table__
+    signals = 0
+    after = None
+    while True:
+        user_ids = _users_after(store, after, first, users_per_batch)
+        if not user_ids:
+            return signals
+        user_totals = {}
+        for user_id in user_ids:
+            for granularity, start in starts.items():
+                db.session.execute(delete(table).where(
+                    table.c.user_id == user_id, table.c.granularity == granularity, table.c.bucket_start >= start,
+                ))
+            rows = list(store.iter_user(user_id, since=first))
+            totals = _increments((row[1], row[3], (row[5] - EPOCH).total_seconds()) for row in rows)
+            user_totals[user_id] = {key: value for key, value in totals.items() if key[1] >= starts[key[0]]}
+            signals += len(rows)
+        _upsert(user_totals)
+        db.session.commit()
+        # Summary ETags of these users described the old counts
+        for user_id in user_ids:
+            bump_versions(user_id, 'signals')
+        after = user_ids[-1]
+
+
+def purge_before(cutoff, batch_size=500, pause=0.0):
+    """Delete rollups for buckets that started before cutoff, batch_size rows per commit"""
+    table = SignalRollup.__table__
+    key = (table.c.user_id, table.c.granularity, table.c.bucket_start, table.c.category)
+    started = time.perf_counter()
+    deleted = batches = 0
+    while True:
+        rows = db.session.execute(
+            select(*key).where(table.c.bucket_start < cutoff).order_by(table.c.bucket_start).limit(batch_size)
+        ).all()
+        if not rows:
+            break
+        result = db.session.execute(delete(table).where(tuple_(*key).in_([tuple(row) for row in rows])))
+        db.session.commit()
+        deleted += result.rowcount
+        batches += 1
+        if len(rows) < batch_size:
+            break
+        if pause:
+            time.sleep(pause)
+    return {'deleted': deleted, 'batches': batches, 'seconds': round(time.perf_counter() - started, 3)}
@@ -22,27 +22,27 @@ class SignalSchema(Schema):
     category = fields.Str(required=True, validate=validate.OneOf([
         'communication', 'movement', 'device', 'self_report'
     ]))
-    type = fields.Str(required=True)
+    type = fields.Str(required=True, attribute='signal_type')
     confidence = fields.Float(validate=validate.Range(min=0.0, max=1.0))
-    metadata = fields.Dict(allow_none=True)
-    timestamp = fields.DateTime(dump_only=True)
+    metadata = fields.Dict(allow_none=True, attribute='signal_metadata')
+    timestamp = fields.DateTime(dump_only=True, attribute='created_at')
 
 
 class AlertSchema(Schema):
     id = fields.Str(dump_only=True)
-    riskLevel = fields.Float(validate=validate.Range(min=0.0, max=1.0))
-    type = fields.Str(validate=validate.OneOf(['passive', 'manual', 'panic']))
+    riskLevel = fields.Float(validate=validate.Range(min=0.0, max=1.0), attribute='risk_level')
+    type = fields.Str(validate=validate.OneOf(['passive', 'manual', 'panic']), attribute='alert_type')
     signals = fields.List(fields.Str())
     acknowledged = fields.Bool(default=False)
-    timestamp = fields.DateTime(dump_only=True)
+    timestamp = fields.DateTime(dump_only=True, attribute='created_at')
 
 
 class EmergencyContactSchema(Schema):
     id = fields.Str(dump_only=True)
-    name = fields.Str(required=True)
-    phone = fields.Str(allow_none=True)
+    name = fields.Str(required=True, validate=validate.Length(min=1, max=255))
+    phone = fields.Str(allow_none=True, validate=validate.Length(max=20))
     email = fields.Email(allow_none=True)
-    relationship = fields.Str(allow_none=True)
+    relationship = fields.Str(allow_none=True, validate=validate.Length(max=100))
     is_advocate = fields.Bool(default=False)
 
 
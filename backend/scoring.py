@@ -0,0 +1,209 @@
+"""HavenApp Backend - Server-side risk scoring
+
+Each user's risk is kept as a per-category sum of signal confidences that
+decays exponentially with age. Because exponential decay composes, a new
+signal only needs the previous sums and the time they were computed at:
+
+    sum(t) = sum(t_prev) * 2 ** (-(t - t_prev) / half_life) + confidence
+
+The score combines the category sums with configured weights and squashes
+them into 0.0-1.0:
+
+    score = 1 - exp(-sum(weight[c] * sum[c]))
+"""
+import math
+from datetime import datetime
+from flask import current_app
+from sqlalchemy import select, insert, update
+
+from models import db, Alert, RiskState
+from ids import generate_id
+from signal_store import signal_store
+
+CATEGORIES = ('communication', 'movement', 'device', 'self_report')
+
+# Number of contributing signal IDs remembered for the next passive alert
+RECENT_SIGNALS = 10
+
+
+def _settings(config=None):
+    config = config or current_app.config
+    return {
+        'weights': config.get('RISK_CATEGORY_WEIGHTS', {}),
+        'half_life': config.get('RISK_DECAY_HALF_LIFE_HOURS', 24) * 3600.0,
+        'threshold': config.get('RISK_ALERT_THRESHOLD', 0.7),
+        'reset': config.get('RISK_ALERT_RESET', 0.5),
+    }
+
+
+def _decay(elapsed_seconds, half_life):
+    if elapsed_seconds <= 0:
+        return 1.0
+    return 2.0 ** (-elapsed_seconds / half_life)
+
+
+def combine(category_sums, weights):
+    """Turn per-category decayed sums into a 0.0-1.0 risk score"""
+    total = sum(weights.get(category, 0.0) * value for category, value in category_sums.items())
+    return 1.0 - math.exp(-max(total, 0.0))
+
+
+def _insert_state(user_id):
+    """Create user_id's empty RiskState unless a concurrent first signal just did"""
+    values = {'user_id': user_id, 'category_sums': {}, 'recent_signals': [], 'score': 0.0,
+              'alert_active': False, 'scored_at': None}
+    dialect = db.session.get_bind(RiskState).dialect.name
+    if dialect == 'postgresql':
+        from sqlalchemy.dialects.postgresql import insert as dialect_insert
+    elif dialect == 'sqlite':
+        from sqlalchemy.dialects.sqlite import insert as dialect_insert
+    else:
+        db.session.execute(insert(RiskState.__table__).values(**values))
+        return
+    # Two first signals both find no row; the second insert waits for the
+    # first to commit and then does nothing, rather than raising IntegrityError
+    db.session.execute(dialect_insert(RiskState.__table__).values(**values).on_conflict_do_nothing())
+
+
+def record_signals(user_id, signals, config=None):
+    """Fold newly inserted signals into the user's risk state.
+
+    signals is a sequence of (id, category, confidence, created_at) tuples in
+    insertion order. Cost is O(len(signals)), independent of history size.
+    Adds the updated state, and a passive Alert if the score crossed the
+    alert threshold, to the current session without committing. Returns the
+    new Alert or None.
+    """
+    settings = _settings(config)
+    state = db.session.get(RiskState, user_id, with_for_update=True)
+    if state is None:
+        _insert_state(user_id)
+        state = db.session.get(RiskState, user_id, with_for_update=True, populate_existing=True)
+
+    sums = dict(state.category_sums or {})
+    recent = list(state.recent_signals or [])
+    scored_at = state.scored_at
+
+    for signal_id, category, confidence, created_at in signals:
+        contribution = confidence or 0.0
+        if scored_at is None:
+            scored_at = created_at
+        elif created_at > scored_at:
+            factor = _decay((created_at - scored_at).total_seconds(), settings['half_life'])
+            sums = {name: value * factor for name, value in sums.items()}
+            scored_at = created_at
+        else:
+            # Late arrival: decay the signal itself to the state's reference time
+            contribution *= _decay((scored_at - created_at).total_seconds(), settings['half_life'])
+        sums[category] = sums.get(category, 0.0) + contribution
+        recent.append(signal_id)
+    recent = recent[-RECENT_SIGNALS:]
+
+    score = combine(sums, settings['weights'])
+
+    alert = None
+    if score >= settings['threshold'] and not state.alert_active:
+        alert = Alert(
+            id=generate_id(),
+            user_id=user_id,
+            risk_level=round(score, 4),
+            alert_type='passive',
+            signals=recent,
+        )
+        db.session.add(alert)
+        state.alert_active = True
+    elif score < settings['reset']:
+        state.alert_active = False
+
+    # Reassign the JSON columns so SQLAlchemy sees the change
+    state.category_sums = sums
+    state.recent_signals = recent
+    state.score = score
+    state.scored_at = scored_at
+    return alert
+
+
+def record_signal(signal, config=None):
+    """Fold a single Signal into its user's risk state (see record_signals)"""
+    return record_signals(
+        signal.user_id,
+        [(signal.id, signal.category, signal.confidence, signal.created_at)],
+        config,
+    )
+
+
+def rescore_all(config=None, now=None, chunk_size=200000):
+    """Recompute every user's risk state from the stored signals with NumPy.
+
+    Intended to run after the category weights or half-life change. Signals
+    are streamed in chunks of plain tuples (timestamps as epoch seconds)
+    from the signal store and reduced per (user, category) with vectorised
+    decay and bincount. Does not emit alerts: users left above the threshold
+    without an active alert get one on their next signal.
+    Returns (users rescored, signals read).
+    """
+    import numpy as np
+
+    settings = _settings(config)
+    now = now or datetime.utcnow()
+    now_seconds = (now - datetime(1970, 1, 1)).total_seconds()
+    category_index = {category: i for i, category in enumerate(CATEGORIES)}
+    weights = np.array([settings['weights'].get(category, 0.0) for category in CATEGORIES])
+
+    user_index = {}
+    totals = np.zeros(0)
+    signal_count = 0
+    for rows in signal_store().scan(chunk_size):
+        user_ids, categories, confidences, created = zip(*rows)
+        signal_count += len(rows)
+
+        user_codes = np.fromiter((user_index.setdefault(u, len(user_index)) for u in user_ids),
+                                 dtype=np.int64, count=len(rows))
+        category_codes = np.fromiter((category_index.get(c, -1) for c in categories),
+                                     dtype=np.int64, count=len(rows))
+        known = category_codes >= 0
+
+        age = now_seconds - np.array(created, dtype=np.float64)
+        contribution = np.nan_to_num(np.array(confidences, dtype=np.float64))
+        contribution *= np.exp2(-np.maximum(age, 0.0) / settings['half_life'])
+
+        flat = user_codes[known] * len(CATEGORIES) + category_codes[known]
+        size = len(user_index) * len(CATEGORIES)
+        totals = np.pad(totals, (0, size - len(totals)))
+        totals += np.bincount(flat, weights=contribution[known], minlength=size)
+    totals = totals.reshape(len(user_index), len(CATEGORIES))
+
+    existing = {
+        row.user_id: row.alert_active
+        for row in db.session.execute(select(RiskState.user_id, RiskState.alert_active))
+    }
+
+    # Users whose signals have all been removed decay to an empty state
+    zero = np.zeros(len(CATEGORIES))
+    rows_by_user = {user_id: totals[code] for user_id, code in user_index.items()}
+    for user_id in existing:
+        rows_by_user.setdefault(user_id, zero)
+
+    updates, inserts = [], []
+    for user_id, row in rows_by_user.items():
+        score = 1.0 - math.exp(-max(float(row @ weights), 0.0))
+        values = {
+            'user_id': user_id,
+            'category_sums': {category: float(value) for category, value in zip(CATEGORIES, row) if value},
+            'score': score,
+            'scored_at': now,
+        }
+        if user_id in existing:
+            values['alert_active'] = existing[user_id] and score >= settings['reset']
+            updates.append(values)
+        else:
+            values['alert_active'] = False
+            values['recent_signals'] = []
+            inserts.append(values)
+
+    if updates:
+        db.session.execute(update(RiskState), updates)
+    if inserts:
+        db.session.execute(insert(RiskState), inserts)
+    db.session.commit()
+    return len(rows_by_user), signal_count
@@ -0,0 +1,123 @@
+"""HavenApp Backend - Response serialization
+
+Each model's JSON shape is declared once as a Shape. A Shape compiles two
+plain Python functions when it is created: one that reads attributes from a
+model instance (behind the models' to_dict()) and one that reads positions
+from a column-only query row, so list endpoints can select exactly the
+shape's columns and skip ORM object hydration entirely. Shape.only()
+narrows a shape to the fields a client asked for with ?fields=, which
+narrows the selected columns along with the output.
+
+FastJSONProvider swaps the encoder behind jsonify() for orjson when it is
+installed, keeping Flask's date handling. It also takes JSON_SORT_KEYS and
+JSON_PRETTYPRINT from the app config, which Flask 2.3 no longer reads.
+"""
+from flask.json.provider import DefaultJSONProvider
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - optional speedup
+    orjson = None
+
+
+def _iso(value):
+    return value.isoformat() if value is not None else None
+
+
+def _list(value):
+    return value or []
+
+
+# Converters usable by name in a Shape field definition
+CONVERTERS = {
+    'iso': _iso,
+    'list': _list,
+}
+
+
+class Shape:
+    """The JSON output of a model: ordered (output key, model attribute[, converter]) fields"""
+
+    def __init__(self, model, fields):
+        self.model = model
+        self.fields = [(field[0], field[1], field[2] if len(field) > 2 else None) for field in fields]
+        self.keys = [key for key, _, _ in self.fields]
+        self.attributes = [attribute for _, attribute, _ in self.fields]
+        self.dump = self._compile('obj', lambda i, attribute: f'obj.{attribute}')
+        self.dump_row = self._compile('row', lambda i, attribute: f'row[{i}]')
+        self._subsets = {}
+
+    def _compile(self, arg, accessor):
+        items = []
+        for i, (key, attribute, converter) in enumerate(self.fields):
+            expr = accessor(i, attribute)
+            if converter:
+                expr = f'{converter}({expr})'
+            items.append(f'{key!r}: {expr}')
+        source = f'def _dump({arg}):\n    return {{{", ".join(items)}}}\n'
+        namespace = {}
+        exec(compile(source, f'<shape {self.model.__name__}>', 'exec'), dict(CONVERTERS), namespace)
+        return namespace['_dump']
+
+    @property
+    def columns(self):
+        """Column attributes to select, in the order dump_row expects"""
+        return [getattr(self.model, attribute) for attribute in self.attributes]
+
+    def columns_with(self, *attributes):
+        """columns, then any of attributes not among them (e.g. keys a query orders by)"""
+        return self.columns + [getattr(self.model, attribute) for attribute in attributes
+                               if attribute not in self.attributes]
+
+    def only(self, keys):
+        """This shape narrowed to keys, kept in field order; raises ValueError on unknown keys"""
+        unknown = [key for key in keys if key not in self.keys]
+        if unknown:
+            raise ValueError(f'Unknown fields: {", ".join(unknown)} (expected any of {", ".join(self.keys)})')
+        selected = tuple(key for key in self.keys if key in keys)
+        if len(selected) == len(self.keys):
+            return self
+        # At most one compiled subset per combination of this shape's fields
+        subset = self._subsets.get(selected)
+        if subset is None:
+            subset = self._subsets[selected] = Shape(self.model, [field for field in self.fields if field[0] in keys])
+        return subset
+
+    def dump_rows(self, rows):
+        dump_row = self.dump_row
+        return [dump_row(row) for row in rows]
+
+
+def parse_fields(args, shape):
+    """shape narrowed to the comma-separated ?fields= keys, or shape itself without them; raises ValueError"""
+    value = args.get('fields')
+    if value is None:
+        return shape
+    keys = [key.strip() for key in value.split(',') if key.strip()]
+    if not keys:
+        raise ValueError(f'fields must name at least one of {", ".join(shape.keys)}')
+    return shape.only(keys)
+
+
+class FastJSONProvider(DefaultJSONProvider):
+    """DefaultJSONProvider that encodes with orjson when available"""
+
+    def __init__(self, app):
+        super().__init__(app)
+        self.sort_keys = app.config.get('JSON_SORT_KEYS', True)
+        # Compact unless asked otherwise, even when debugging a production config
+        self.compact = not app.config.get('JSON_PRETTYPRINT', False)
+
+    def dumps(self, obj, **kwargs):
+        if orjson is None or kwargs.get('cls') or kwargs.get('default'):
+            return super().dumps(obj, **kwargs)
+        option = orjson.OPT_NON_STR_KEYS | orjson.OPT_PASSTHROUGH_DATETIME | orjson.OPT_PASSTHROUGH_DATACLASS
+        if kwargs.get('sort_keys', self.sort_keys):
+            option |= orjson.OPT_SORT_KEYS
+        if kwargs.get('indent'):
+            option |= orjson.OPT_INDENT_2
+        try:
+            return orjson.dumps(obj, default=self.default, option=option).decode('utf-8')
+        except TypeError:
+            # e.g. integers beyond 64 bits; the stdlib encoder handles them
+            return super().dumps(obj, **kwargs)
@@ -0,0 +1,359 @@
+"""HavenApp Backend - Per-user sharding
+
+With DATABASE_SHARD_URLS set, a user's rows in every per-user table (those
+marked sharded in models.py) live on one shard database, and users,
+account_deletions and shard_moves stay on the primary. A new user is placed
+by a jump consistent hash of their id over the configured shards and the
+result is recorded in users.shard, so placement never changes by itself:
+adding a shard moves nobody until `flask rebalance-shards` moves the ~1/n
+of users the hash now puts on it. Users from before sharding have a NULL
+shard and keep their rows on the primary until they are moved. Requests
+find the shard through get_current_user() (see database.py for routing).
+
+`flask move-user` moves one user online, recorded in shard_moves so an
+interrupted move can be resumed or aborted (`rebalance-shards` moves users
+in groups that share each wait):
+
+1. copying: rows are copied to the target in primary-key chunks while the
+   user keeps writing to the source; a copied row is never copied again
+2. frozen: users.shard_moving_to is set and the user's writes other than
+   panic alerts are answered 503 with Retry-After. Once no worker can
+   still be writing (SHARD_MOVE_SETTLE_SECONDS), signals and audit rows
+   added meanwhile are copied and the other, mutable, tables copied afresh
+3. cleanup: users.shard is switched to the target, which also ends the
+   hold. Once workers have seen that, panic alerts raised during the hold
+   are copied too and the rows are deleted from the source in chunks
+
+Workers see changes to users through the user cache. With the local cache
+backend a worker only drops its copy when the TTL runs out, so each wait
+above also lasts USER_CACHE_TTL.
+"""
+import hashlib
+import logging
+import time
+from datetime import datetime
+from flask import current_app, has_request_context, request
+from sqlalchemy import bindparam, delete, insert, select, tuple_, update
+
+from database import shard_engine, use_shard
+from ids import generate_id
+from models import db, User, ShardMove
+from user_cache import get_cached_user, invalidate_user
+
+logger = logging.getLogger(__name__)
+
+# Tables only ever appended to: rows added while a move holds writes are
+# copied by key. The rest are copied afresh once writes are held.
+APPEND_ONLY = ('signals', 'audit_logs')
+
+# Endpoints still served while a move holds the user's writes, and the
+# tables they add rows to, which cleanup copies across
+WRITES_DURING_MOVE = {'create_panic_alert'}
+CLEANUP_TABLES = ('alerts', 'audit_logs')
+
+SAFE_METHODS = ('GET', 'HEAD', 'OPTIONS')
+
+OPEN = ('copying', 'frozen', 'cleanup')
+
+
+class ShardMoveInProgress(Exception):
+    """The user's writes are held while their rows move to another shard"""
+
+
+def jump_hash(key, buckets):
+    """Jump consistent hash (Lamping & Veach) of a 64-bit key into buckets"""
+    b, j = -1, 0
+    while j < buckets:
+        b = j
+        key = (key * 2862933555777941757 + 1) & 0xFFFFFFFFFFFFFFFF
+        j = int((b + 1) * (float(1 << 31) / float((key >> 33) + 1)))
+    return b
+
+
+def placement(user_id, shards=None):
+    """Shard a user_id belongs on with shards configured (default: the app's); None without sharding"""
+    shards = current_app.extensions.get('shards', 0) if shards is None else shards
+    if not shards:
+        return None
+    # Hashed rather than taken from the id itself: UUIDv7s start with a timestamp
+    key = int.from_bytes(hashlib.blake2b(str(user_id).encode('utf-8'), digest_size=8).digest(), 'big')
+    return jump_hash(key, shards)
+
+
+def sharded_tables():
+    """Per-user tables, parents first"""
+    return [table for table in db.metadata.sorted_tables if table.info.get('sharded')]
+
+
+def route_user(user):
+    """Send this context's sharded tables to user's shard; raises ShardMoveInProgress for held writes"""
+    use_shard(user.shard)
+    if (user.shard_moving_to is not None and has_request_context() and request.method not in SAFE_METHODS
+            and request.endpoint not in WRITES_DURING_MOVE):
+        raise ShardMoveInProgress(user.id)
+
+
+def user_shard(user_id):
+    """users.shard of user_id; None (the primary) for users from before sharding and unknown ids"""
+    values = get_cached_user(user_id)
+    if values is not None:
+        return values.get('shard')
+    return db.session.execute(select(User.shard).where(User.id == user_id)).scalar()
+
+
+def settle_seconds(config):
+    """How long until no worker can still be acting on a users row from before a change"""
+    seconds = config.get('SHARD_MOVE_SETTLE_SECONDS', 5)
+    if config.get('USER_CACHE_ENABLED', True) and config.get('USER_CACHE_BACKEND') != 'redis':
+        # Other processes' local caches only forget the old row when it expires
+        seconds += config.get('USER_CACHE_TTL', 60)
+    return seconds
+
+
+def _after(key, values):
+    if len(key) == 1:
+        return key[0] > values[0]
+    return tuple_(*key) > tuple_(*(bindparam(None, value, type_=column.type) for column, value in zip(key, values)))
+
+
+def _key_in(key, keys):
+    if len(key) == 1:
+        return key[0].in_([values[0] for values in keys])
+    return tuple_(*key).in_([tuple(values) for values in keys])
+
+
+def _shard_filter(source):
+    return User.shard.is_(None) if source is None else User.shard == source
+
+
+class ShardMover:
+    """Runs one ShardMove from wherever it stopped"""
+
+    def __init__(self, move, log=None):
+        config = current_app.config
+        self.move = move
+        self.user_id = move.user_id
+        self.source = shard_engine(db, move.source)
+        self.target = shard_engine(db, move.target)
+        self.chunk_size = config.get('SHARD_MOVE_CHUNK_SIZE', 1000)
+        self.pause = config.get('SHARD_MOVE_CHUNK_PAUSE', 0.01)
+        self.log = log or logger.info
+        self.copied = dict(move.copied or {})
+
+    def _copy_missing(self, table):
+        """Copy the user's rows in table that the target lacks; returns how many"""
+        key = list(table.primary_key.columns)
+        copied, last = 0, None
+        while True:
+            stmt = select(table).where(table.c.user_id == self.user_id)
+            if last is not None:
+                stmt = stmt.where(_after(key, last))
+            with self.source.connect() as connection:
+                rows = connection.execute(stmt.order_by(*key).limit(self.chunk_size)).mappings().all()
+            if not rows:
+                break
+            keys = [tuple(row[column.name] for column in key) for row in rows]
+            with self.target.begin() as connection:
+                present = {tuple(row) for row in connection.execute(select(*key).where(_key_in(key, keys)))}
+                missing = [dict(row) for row, values in zip(rows, keys) if values not in present]
+                if missing:
+                    connection.execute(insert(table), missing)
+            copied += len(missing)
+            last = keys[-1]
+            if len(rows) < self.chunk_size:
+                break
+            if self.pause:
+                time.sleep(self.pause)
+        self.copied[table.name] = self.copied.get(table.name, 0) + copied
+        return copied
+
+    def _delete_user_rows(self, engine, table):
+        key = list(table.primary_key.columns)
+        deleted = 0
+        while True:
+            with engine.begin() as connection:
+                rows = connection.execute(select(*key).where(table.c.user_id == self.user_id)
+                                          .limit(self.chunk_size)).all()
+                if rows:
+                    deleted += connection.execute(delete(table).where(_key_in(key, rows))).rowcount
+            if len(rows) < self.chunk_size:
+                return deleted
+            if self.pause:
+                time.sleep(self.pause)
+
+    def _save(self, status, **values):
+        self.move.status = status
+        self.move.copied = dict(self.copied)
+        for name, value in values.items():
+            setattr(self.move, name, value)
+        db.session.commit()
+
+    def copy(self):
+        """Phase 1: copy while the user keeps writing, then hold their writes"""
+        for table in sharded_tables():
+            self.log(f'{self.user_id} {table.name}: copied {self._copy_missing(table)}')
+        self._save('copying')
+        # Lost to a deletion or another move if the users row changed meanwhile
+        held = db.session.execute(
+            update(User).where(User.id == self.user_id, User.is_active.is_(True), _shard_filter(self.move.source))
+            .values(shard_moving_to=self.move.target)
+        ).rowcount
+        if held != 1:
+            db.session.rollback()
+            self.abort('user was deactivated or moved meanwhile')
+            return
+        self._save('frozen')
+        invalidate_user(self.user_id)
+
+    def switch(self):
+        """Phase 2, once no worker writes: catch the target up and point the user at it"""
+        for table in sharded_tables():
+            if table.name not in APPEND_ONLY:
+                self._delete_user_rows(self.target, table)
+                self.copied[table.name] = 0
+            self.log(f'{self.user_id} {table.name}: copied {self._copy_missing(table)} (writes held)')
+        db.session.execute(
+            update(User).where(User.id == self.user_id).values(shard=self.move.target, shard_moving_to=None)
+        )
+        self._save('cleanup')
+        invalidate_user(self.user_id)
+        self.log(f'{self.user_id} now on shard {self.move.target}')
+
+    def cleanup(self):
+        """Phase 3, once no worker uses the source: copy panic alerts raised meanwhile, delete the source rows"""
+        for table in sharded_tables():
+            if table.name in CLEANUP_TABLES:
+                self._copy_missing(table)
+        for table in reversed(sharded_tables()):
+            self.log(f'{self.user_id} {table.name}: deleted {self._delete_user_rows(self.source, table)} from the source')
+        self._save('done', finished_at=datetime.utcnow())
+
+    def abort(self, reason):
+        """Drop what was copied to the target and release the user's writes"""
+        if self.move.status not in ('copying', 'frozen'):
+            raise ValueError(f'Move {self.move.id} already switched shards; finish it instead')
+        for table in reversed(sharded_tables()):
+            self._delete_user_rows(self.target, table)
+        db.session.execute(
+            update(User).where(User.id == self.user_id, User.shard_moving_to == self.move.target)
+            .values(shard_moving_to=None)
+        )
+        self._save('aborted', error=reason, finished_at=datetime.utcnow())
+        invalidate_user(self.user_id)
+        self.log(f'Move of {self.user_id} aborted: {reason}')
+
+
+def _settle(movers, status, log):
+    """Wait until settle_seconds() have passed since the last of movers reached status"""
+    settle = settle_seconds(current_app.config)
+    reached = max(mover.move.updated_at for mover in movers)
+    remaining = settle - (datetime.utcnow() - reached).total_seconds()
+    if remaining > 0:
+        log(f'Waiting {remaining:.0f}s for workers to see {len(movers)} user(s) {status}')
+        time.sleep(remaining)
+
+
+def run_moves(movers, log=None):
+    """Take movers through the remaining phases together, so a group shares each settle wait"""
+    log = log or logger.info
+    try:
+        for mover in movers:
+            if mover.move.status == 'copying':
+                mover.copy()
+        frozen = [mover for mover in movers if mover.move.status == 'frozen']
+        if frozen:
+            _settle(frozen, 'held', log)
+            for mover in frozen:
+                mover.switch()
+        switched = [mover for mover in movers if mover.move.status == 'cleanup']
+        if switched:
+            _settle(switched, 'on their new shard', log)
+            for mover in switched:
+                mover.cleanup()
+    except Exception as e:
+        db.session.rollback()
+        logger.error(f'Shard move failed, rerun to resume: {str(e)}')
+        raise
+    return [mover.move for mover in movers]
+
+
+def open_move(user_id):
+    return ShardMove.query.filter(ShardMove.user_id == user_id, ShardMove.status.in_(OPEN)).first()
+
+
+def start_move(user_id, target, log=None):
+    """A ShardMover taking user_id to shard target, resuming an unfinished move; None if already there"""
+    shards = current_app.extensions.get('shards', 0)
+    if not 0 <= target < shards:
+        raise ValueError(f'No shard {target}; DATABASE_SHARD_URLS has {shards}')
+    move = open_move(user_id)
+    if move is None:
+        user = db.session.get(User, user_id)
+        if user is None or not user.is_active:
+            raise ValueError(f'No active user {user_id}')
+        if user.shard == target:
+            return None
+        move = ShardMove(id=generate_id(), user_id=user_id, source=user.shard, target=target, status='copying',
+                         copied={})
+        db.session.add(move)
+        db.session.commit()
+    elif move.target != target:
+        raise ValueError(f'User {user_id} is already moving to shard {move.target}')
+    return ShardMover(move, log)
+
+
+def move_user(user_id, target, log=None):
+    """Move user_id's rows to shard target; returns the ShardMove, or None if they are already there"""
+    mover = start_move(user_id, target, log)
+    return run_moves([mover], log)[0] if mover else None
+
+
+def abort_move(user_id, log=None):
+    """Abort user_id's unfinished move (before it switched shards); returns the ShardMove or None"""
+    move = open_move(user_id)
+    if move is not None:
+        ShardMover(move, log).abort('aborted by operator')
+    return move
+
+
+def misplaced_users(shards=None, chunk_size=1000):
+    """(user_id, shard, placement) of active users not on the shard placement() gives them"""
+    last = None
+    while True:
+        stmt = select(User.id, User.shard).where(User.is_active.is_(True)).order_by(User.id).limit(chunk_size)
+        if last is not None:
+            stmt = stmt.where(User.id > last)
+        rows = db.session.execute(stmt).all()
+        db.session.rollback()
+        for user_id, shard in rows:
+            target = placement(user_id, shards)
+            if target != shard:
+                yield user_id, shard, target
+        if len(rows) < chunk_size:
+            return
+        last = rows[-1][0]
+
+
+def rebalance(limit=None, batch_size=50, dry_run=False, log=None):
+    """Move misplaced users (see misplaced_users) in groups of batch_size; returns how many were (or would be) moved"""
+    log = log or logger.info
+    moved, batch = 0, []
+    for user_id, shard, target in misplaced_users():
+        if limit is not None and moved >= limit:
+            break
+        log(f'{user_id}: {"primary" if shard is None else f"shard {shard}"} -> shard {target}')
+        if not dry_run:
+            try:
+                mover = start_move(user_id, target, log)
+            except ValueError as e:
+                log(f'{user_id}: skipped, {str(e)}')
+                continue
+            if mover is not None:
+                batch.append(mover)
+            if len(batch) >= batch_size:
+                run_moves(batch, log)
+                batch = []
+        moved += 1
+    if batch:
+        run_moves(batch, log)
+    return moved
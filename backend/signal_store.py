@@ -0,0 +1,465 @@
+"""HavenApp Backend - Signal storage
+
+Routes, export, retention and rescoring reach signals through the store
+selected by SIGNAL_STORAGE, so the layout can change without touching them.
+Both stores hand back plain tuples in SIGNAL_SHAPE column order; page()
+takes a narrower shape (see Shape.only) for ?fields= requests.
+
+- 'rows' (default): one signals row per signal
+- 'buckets': a user's signals from each SIGNAL_BUCKET_SECONDS window packed
+  into signal_buckets rows of at most SIGNAL_BUCKET_MAX_SIGNALS. (category,
+  type) pairs are dictionary-encoded to one byte per signal, timestamps are
+  stored as uint32 milliseconds after the bucket start and confidences as
+  uint16 fractions of 1, so a signal takes about 7 bytes plus its metadata
+  instead of a ~200 byte row and three index entries.
+
+In bucket storage timestamps are kept to the millisecond, confidences to
+four decimal places, and signal ids are derived from the signal's position
+(user, bucket, part, index) rather than stored. Retention drops a bucket
+once its newest signal has expired. `flask pack-signals` moves existing
+rows into buckets; they get new ids, so passive alerts raised before the
+move keep ids that no longer resolve.
+"""
+import heapq
+import sys
+import time
+import uuid
+from array import array
+from datetime import datetime, timedelta
+from flask import current_app
+from sqlalchemy import delete, func, insert, select, tuple_, update
+
+from models import db, Signal, SignalBucket, SIGNAL_SHAPE
+from ids import generate_id
+from pagination import encode_cursor, keyset_page
+from versions import bump_versions
+
+# Namespace for the per-bucket-part prefix of derived signal ids
+ID_NAMESPACE = uuid.UUID('0c6b1c4e-2f7a-4a5e-b8d1-6e93a7f0d254')
+
+# Appends retry this often when another request changed the bucket first
+APPEND_ATTEMPTS = 5
+
+MAX_KINDS = 256  # codes are one byte
+
+
+def epoch_seconds(column):
+    """SQL expression for a DateTime column as float seconds since the Unix epoch"""
+    if db.engine.dialect.name == 'sqlite':
+        return (func.julianday(column) - 2440587.5) * 86400.0
+    return func.extract('epoch', column)
+
+
+def _truncate_ms(moment):
+    return moment.replace(microsecond=moment.microsecond // 1000 * 1000)
+
+
+def _pack(typecode, values):
+    packed = array(typecode, values)
+    if sys.byteorder == 'big':
+        packed.byteswap()
+    return packed.tobytes()
+
+
+def _unpack(typecode, data):
+    unpacked = array(typecode)
+    unpacked.frombytes(data or b'')
+    if sys.byteorder == 'big':
+        unpacked.byteswap()
+    return unpacked
+
+
+class RowSignalStore:
+    """One signals row per signal"""
+
+    name = 'rows'
+
+    def add(self, user_id, items, now):
+        """Insert validated signal payloads; returns their rows in SIGNAL_SHAPE order"""
+        rows = [{
+            'id': generate_id(),
+            'user_id': user_id,
+            'category': item.get('category'),
+            'signal_type': item.get('type'),
+            'confidence': item.get('confidence', 0.0),
+            'signal_metadata': item.get('metadata'),
+            'created_at': now,
+        } for item in items]
+        db.session.execute(insert(Signal), rows)
+        return [(row['id'], row['category'], row['signal_type'], row['confidence'], row['signal_metadata'],
+                 row['created_at']) for row in rows]
+
+    def page(self, user_id, limit, position=None, shape=SIGNAL_SHAPE):
+        """One newest-first page of rows in shape's column order; returns (rows, next_cursor)"""
+        # The keyset columns ride along after shape's own for the next cursor
+        query = Signal.query.with_entities(*shape.columns_with('created_at', 'id')).filter_by(user_id=user_id)
+        return keyset_page(query, Signal, limit, position)
+
+    def iter_user(self, user_id, chunk_size=1000, since=None):
+        """Every signal of user_id (created at or after since, if given), oldest first"""
+        stmt = (
+            select(*SIGNAL_SHAPE.columns)
+            .where(Signal.user_id == user_id)
+            .order_by(Signal.created_at, Signal.id)
+            .execution_options(yield_per=chunk_size)
+        )
+        if since is not None:
+            stmt = stmt.where(Signal.created_at >= since)
+        for partition in db.session.execute(stmt).partitions():
+            yield from partition
+
+    def user_ids(self, after=None, limit=100):
+        """Up to limit ids, in order, of users with signals whose id sorts after `after`"""
+        stmt = select(Signal.user_id).distinct().order_by(Signal.user_id).limit(limit)
+        if after is not None:
+            stmt = stmt.where(Signal.user_id > after)
+        return db.session.execute(stmt).scalars().all()
+
+    def earliest(self):
+        """When the oldest stored signal was created, or None"""
+        return db.session.execute(select(func.min(Signal.created_at))).scalar()
+
+    def scan(self, chunk_size=200000):
+        """Lists of (user_id, category, confidence, epoch seconds) covering every signal"""
+        stmt = select(Signal.user_id, Signal.category, Signal.confidence, epoch_seconds(Signal.created_at))
+        result = db.session.connection(bind_arguments={'mapper': Signal}).execution_options(stream_results=True).execute(stmt)
+        for rows in result.partitions(chunk_size):
+            yield rows
+
+
+class BucketSignalStore:
+    """A user's signals packed into per-time-bucket signal_buckets rows"""
+
+    name = 'buckets'
+
+    def __init__(self, bucket_seconds=3600, max_signals=2000):
+        self.bucket_seconds = bucket_seconds
+        self.max_signals = max_signals
+
+    def bucket_start(self, moment):
+        epoch = int((moment - datetime(1970, 1, 1)).total_seconds())
+        return datetime(1970, 1, 1) + timedelta(seconds=epoch - epoch % self.bucket_seconds)
+
+    def add(self, user_id, items, now):
+        # Millisecond precision, so the response matches what later reads decode
+        now = _truncate_ms(now)
+        rows = []
+        for chunk in self._chunks(items, lambda item: (item.get('category'), item.get('type'))):
+            rows += self._append(user_id, chunk, now)
+        return rows
+
+    def _chunks(self, signals, kind):
+        """Split signals into runs that each fit one bucket part"""
+        chunk, kinds = [], set()
+        for signal in signals:
+            if len(chunk) == self.max_signals or (kind(signal) not in kinds and len(kinds) == MAX_KINDS):
+                yield chunk
+                chunk, kinds = [], set()
+            chunk.append(signal)
+            kinds.add(kind(signal))
+        if chunk:
+            yield chunk
+
+    def _append(self, user_id, items, now):
+        table = SignalBucket.__table__
+        start = self.bucket_start(now)
+        offset = (now - start) // timedelta(milliseconds=1)
+        latest = (
+            select(table)
+            .where(table.c.user_id == user_id, table.c.bucket_start == start)
+            .order_by(table.c.part.desc())
+            .limit(1)
+        )
+        if db.session.get_bind(SignalBucket).dialect.name == 'postgresql':
+            latest = latest.with_for_update()
+
+        for _ in range(APPEND_ATTEMPTS):
+            row = db.session.execute(latest).first()
+            if row is None:
+                self._insert_empty(user_id, start, 0)
+                continue
+
+            kinds = [list(kind) for kind in row.kinds]
+            index = {tuple(kind): code for code, kind in enumerate(kinds)}
+            codes = []
+            for item in items:
+                kind = (item.get('category'), item.get('type'))
+                if kind not in index:
+                    index[kind] = len(kinds)
+                    kinds.append(list(kind))
+                codes.append(index[kind])
+            if row.count and (row.count + len(items) > self.max_signals or len(kinds) > MAX_KINDS):
+                self._insert_empty(user_id, start, row.part + 1)
+                continue
+
+            extras = dict(row.extras or {})
+            for i, item in enumerate(items):
+                if item.get('metadata') is not None:
+                    extras[str(row.count + i)] = item['metadata']
+            confidences = [round(min(max(item.get('confidence', 0.0) or 0.0, 0.0), 1.0) * 65535) for item in items]
+
+            result = db.session.execute(
+                update(table)
+                .where(table.c.user_id == user_id, table.c.bucket_start == start, table.c.part == row.part,
+                       table.c.version == row.version)
+                .values(
+                    count=row.count + len(items),
+                    last_at=max(row.last_at, now),
+                    version=row.version + 1,
+                    kinds=kinds,
+                    codes=row.codes + _pack('B', codes),
+                    offsets=row.offsets + _pack('I', [offset] * len(items)),
+                    confidences=row.confidences + _pack('H', confidences),
+                    extras=extras or None,
+                )
+            )
+            if result.rowcount == 1:
+                prefix = self._id_prefix(user_id, start, row.part)
+                return [
+                    (f'{prefix}{row.count + i:012x}', item.get('category'), item.get('type'),
+                     round(confidences[i] / 65535, 4), item.get('metadata'), now)
+                    for i, item in enumerate(items)
+                ]
+        raise RuntimeError(f'Signal bucket for user {user_id} kept changing; gave up after {APPEND_ATTEMPTS} attempts')
+
+    def _insert_empty(self, user_id, start, part):
+        values = {
+            'user_id': user_id, 'bucket_start': start, 'part': part, 'count': 0, 'last_at': start,
+            'version': 0, 'kinds': [], 'codes': b'', 'offsets': b'', 'confidences': b'', 'extras': None,
+        }
+        dialect = db.session.get_bind(SignalBucket).dialect.name
+        if dialect == 'postgresql':
+            from sqlalchemy.dialects.postgresql import insert as dialect_insert
+        elif dialect == 'sqlite':
+            from sqlalchemy.dialects.sqlite import insert as dialect_insert
+        else:
+            db.session.execute(insert(SignalBucket.__table__).values(**values))
+            return
+        # A concurrent request may have created it; either way it exists now
+        db.session.execute(dialect_insert(SignalBucket.__table__).values(**values).on_conflict_do_nothing())
+
+    @staticmethod
+    def _id_prefix(user_id, start, part):
+        base = uuid.uuid5(ID_NAMESPACE, f'{user_id}:{start.isoformat()}:{part}').hex
+        return f'{base[:8]}-{base[8:12]}-{base[12:16]}-{base[16:20]}-'
+
+    def decode(self, row):
+        """The signals packed in one signal_buckets row, in SIGNAL_SHAPE order"""
+        codes = _unpack('B', row.codes)
+        offsets = _unpack('I', row.offsets)
+        confidences = _unpack('H', row.confidences)
+        kinds = row.kinds
+        extras = row.extras or {}
+        prefix = self._id_prefix(row.user_id, row.bucket_start, row.part)
+        start = row.bucket_start
+        return [
+            (f'{prefix}{i:012x}', kinds[codes[i]][0], kinds[codes[i]][1], round(confidences[i] / 65535, 4),
+             extras.get(str(i)), start + timedelta(milliseconds=offsets[i]))
+            for i in range(row.count)
+        ]
+
+    def page(self, user_id, limit, position=None, shape=SIGNAL_SHAPE):
+        table = SignalBucket.__table__
+        stmt = select(table).where(table.c.user_id == user_id)
+        if position is not None:
+            # Every signal in a bucket is at or after its start
+            stmt = stmt.where(table.c.bucket_start <= position[0])
+        stmt = stmt.order_by(table.c.last_at.desc(), table.c.bucket_start.desc(), table.c.part.desc())
+
+        key = lambda signal: (signal[5], signal[0])
+        candidates = []
+        result = db.session.execute(stmt.execution_options(yield_per=8))
+        try:
+            for row in result:
+                if len(candidates) > limit:
+                    # Nothing in this or any later bucket is newer than row.last_at
+                    candidates = heapq.nlargest(limit + 1, candidates, key=key)
+                    if candidates[-1][5] > row.last_at:
+                        break
+                for signal in self.decode(row):
+                    if position is None or key(signal) < position:
+                        candidates.append(signal)
+        finally:
+            result.close()
+
+        rows = heapq.nlargest(limit + 1, candidates, key=key)
+        next_cursor = None
+        if len(rows) > limit:
+            rows = rows[:limit]
+            next_cursor = encode_cursor(rows[-1][5], rows[-1][0])
+        if shape is not SIGNAL_SHAPE:
+            # Signals are decoded whole; only the page itself is cut down
+            positions = [SIGNAL_SHAPE.keys.index(key) for key in shape.keys]
+            rows = [tuple(signal[i] for i in positions) for signal in rows]
+        return rows, next_cursor
+
+    def iter_user(self, user_id, chunk_size=1000, since=None):
+        table = SignalBucket.__table__
+        stmt = (
+            select(table)
+            .where(table.c.user_id == user_id)
+            .order_by(table.c.bucket_start, table.c.part)
+            .execution_options(yield_per=max(1, chunk_size // self.max_signals))
+        )
+        if since is not None:
+            stmt = stmt.where(table.c.last_at >= since)
+        group, group_start = [], None
+        for row in db.session.execute(stmt):
+            if row.bucket_start != group_start:
+                yield from sorted(group, key=lambda signal: (signal[5], signal[0]))
+                group, group_start = [], row.bucket_start
+            group += self.decode(row) if since is None else [
+                signal for signal in self.decode(row) if signal[5] >= since
+            ]
+        yield from sorted(group, key=lambda signal: (signal[5], signal[0]))
+
+    def user_ids(self, after=None, limit=100):
+        table = SignalBucket.__table__
+        stmt = select(table.c.user_id).distinct().order_by(table.c.user_id).limit(limit)
+        if after is not None:
+            stmt = stmt.where(table.c.user_id > after)
+        return db.session.execute(stmt).scalars().all()
+
+    def earliest(self):
+        table = SignalBucket.__table__
+        first = db.session.execute(select(func.min(table.c.bucket_start))).scalar()
+        if first is None:
+            return None
+        # Offsets are relative to the bucket start; the oldest bucket's parts hold the oldest signal
+        offsets = db.session.execute(select(table.c.offsets).where(table.c.bucket_start == first)).scalars()
+        return first + timedelta(milliseconds=min((min(_unpack('I', data), default=0) for data in offsets), default=0))
+
+    def scan(self, chunk_size=200000):
+        table = SignalBucket.__table__
+        stmt = select(table.c.user_id, table.c.bucket_start, table.c.count, table.c.kinds, table.c.codes,
+                      table.c.offsets, table.c.confidences)
+        epoch = datetime(1970, 1, 1)
+        chunk = []
+        result = db.session.connection(bind_arguments={'mapper': SignalBucket}).execution_options(stream_results=True).execute(stmt)
+        for row in result.yield_per(256):
+            base = (row.bucket_start - epoch).total_seconds()
+            codes = _unpack('B', row.codes)
+            offsets = _unpack('I', row.offsets)
+            confidences = _unpack('H', row.confidences)
+            categories = [kind[0] for kind in row.kinds]
+            chunk += [
+                (row.user_id, categories[codes[i]], round(confidences[i] / 65535, 4), base + offsets[i] / 1000.0)
+                for i in range(row.count)
+            ]
+            if len(chunk) >= chunk_size:
+                yield chunk
+                chunk = []
+        if chunk:
+            yield chunk
+
+    def insert_packed(self, user_id, signals):
+        """Bulk-insert (category, type, confidence, metadata, created_at) tuples as new bucket parts"""
+        table = SignalBucket.__table__
+        groups = {}
+        for signal in sorted(signals, key=lambda signal: signal[4]):
+            groups.setdefault(self.bucket_start(signal[4]), []).append(signal)
+        if not groups:
+            return 0
+        next_part = dict(db.session.execute(
+            select(table.c.bucket_start, func.max(table.c.part) + 1)
+            .where(table.c.user_id == user_id, table.c.bucket_start.in_(list(groups)))
+            .group_by(table.c.bucket_start)
+        ).all())
+
+        rows = []
+        for start, members in groups.items():
+            part = next_part.get(start, 0)
+            for taken in self._chunks(members, lambda signal: (signal[0], signal[1])):
+                kinds, index = [], {}
+                for signal in taken:
+                    if (signal[0], signal[1]) not in index:
+                        index[(signal[0], signal[1])] = len(kinds)
+                        kinds.append([signal[0], signal[1]])
+                offsets = [(signal[4] - start) // timedelta(milliseconds=1) for signal in taken]
+                rows.append({
+                    'user_id': user_id, 'bucket_start': start, 'part': part, 'count': len(taken),
+                    'last_at': start + timedelta(milliseconds=max(offsets)),
+                    'version': 0, 'kinds': kinds,
+                    'codes': _pack('B', [index[(signal[0], signal[1])] for signal in taken]),
+                    'offsets': _pack('I', offsets),
+                    'confidences': _pack('H', [round(min(max(signal[2] or 0.0, 0.0), 1.0) * 65535)
+                                               for signal in taken]),
+                    'extras': {str(i): signal[3] for i, signal in enumerate(taken) if signal[3] is not None} or None,
+                })
+                part += 1
+        db.session.execute(insert(table), rows)
+        return len(signals)
+
+    def purge_before(self, cutoff, batch_size=500, pause=0.0):
+        """Delete buckets whose newest signal is older than cutoff, batch_size rows per commit"""
+        table = SignalBucket.__table__
+        started = time.perf_counter()
+        deleted = batches = 0
+        while True:
+            rows = db.session.execute(
+                select(table.c.user_id, table.c.bucket_start, table.c.part, table.c.count)
+                .where(table.c.last_at < cutoff)
+                .order_by(table.c.last_at)
+                .limit(batch_size)
+            ).all()
+            if not rows:
+                break
+            db.session.execute(delete(table).where(
+                tuple_(table.c.user_id, table.c.bucket_start, table.c.part).in_(
+                    [(row.user_id, row.bucket_start, row.part) for row in rows]
+                )
+            ))
+            db.session.commit()
+            deleted += sum(row.count for row in rows)
+            batches += 1
+            if len(rows) < batch_size:
+                break
+            if pause:
+                time.sleep(pause)
+        return {'deleted': deleted, 'batches': batches, 'seconds': round(time.perf_counter() - started, 3)}
+
+
+def init_signal_store(app):
+    """Attach the signal store selected by SIGNAL_STORAGE to app"""
+    storage = app.config.get('SIGNAL_STORAGE', 'rows')
+    if storage == 'buckets':
+        store = BucketSignalStore(
+            bucket_seconds=app.config.get('SIGNAL_BUCKET_SECONDS', 3600),
+            max_signals=app.config.get('SIGNAL_BUCKET_MAX_SIGNALS', 2000),
+        )
+    elif storage == 'rows':
+        store = RowSignalStore()
+    else:
+        raise ValueError("SIGNAL_STORAGE must be 'rows' or 'buckets'")
+    app.extensions['signal_store'] = store
+    return store
+
+
+def signal_store():
+    return current_app.extensions['signal_store']
+
+
+def pack_signal_rows(store, users_per_batch=100, log=None):
+    """Move every signals row into store's buckets, one transaction per user; returns signals moved
+
+    Packed signals get new ids, so each user's 'signals' version is bumped
+    and cursors issued before the move no longer resolve.
+    """
+    moved = 0
+    while True:
+        user_ids = db.session.execute(select(Signal.user_id).distinct().limit(users_per_batch)).scalars().all()
+        if not user_ids:
+            return moved
+        for user_id in user_ids:
+            signals = db.session.execute(
+                select(Signal.category, Signal.signal_type, Signal.confidence, Signal.signal_metadata,
+                       Signal.created_at).where(Signal.user_id == user_id)
+            ).all()
+            store.insert_packed(user_id, signals)
+            db.session.execute(delete(Signal).where(Signal.user_id == user_id))
+            db.session.commit()
+            # Cached pages and cursors name ids that no longer exist
+            bump_versions(user_id, 'signals')
+            moved += len(signals)
+            if log:
+                log(f'Packed {len(signals)} signals for user {user_id}')
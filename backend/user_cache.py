@@ -0,0 +1,181 @@
+"""HavenApp Backend - Authenticated user cache
+
+get_current_user() runs on every protected request, and almost always only
+needs to confirm that the token's user still exists and is active. Each
+worker keeps a bounded LRU of active users' column values with a TTL, so
+the common case skips the primary-key SELECT.
+
+Writes that change a user (profile updates, deactivation, deletion) must
+call invalidate_user(). With USER_CACHE_BACKEND = 'redis' the invalidation
+is also published on REDIS_URL so every gunicorn worker evicts its copy;
+the TTL bounds staleness if a message is ever missed.
+"""
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from flask import current_app
+
+logger = logging.getLogger(__name__)
+
+# Columns kept in the cache; password_hash is deliberately left out and
+# lazy-loads from the database on the rare paths that need it
+CACHED_COLUMNS = ('id', 'email', 'name', 'created_at', 'updated_at', 'is_active', 'shard', 'shard_moving_to')
+
+INVALIDATION_CHANNEL = 'havenapp:user-cache:invalidate'
+
+
+class UserCache:
+    """Bounded LRU with per-entry TTL, safe to share between threads"""
+
+    def __init__(self, max_size=10000, ttl=60.0):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def get(self, user_id):
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if entry is None or entry[0] < now:
+                if entry is not None:
+                    del self._entries[user_id]
+                self.misses += 1
+                return None
+            self._entries.move_to_end(user_id)
+            self.hits += 1
+            return entry[1]
+
+    def put(self, user_id, values):
+        with self._lock:
+            self._entries[user_id] = (time.monotonic() + self.ttl, values)
+            self._entries.move_to_end(user_id)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def discard(self, user_id):
+        with self._lock:
+            if self._entries.pop(user_id, None) is not None:
+                self.invalidations += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'size': len(self._entries),
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_ratio': round(self.hits / lookups, 4) if lookups else 0.0,
+                'evictions': self.evictions,
+                'invalidations': self.invalidations,
+            }
+
+
+class RedisInvalidationBus:
+    """Fans invalidations out to every worker's UserCache over Redis pub/sub"""
+
+    def __init__(self, cache, redis_url, channel=INVALIDATION_CHANNEL):
+        import redis
+
+        self.cache = cache
+        self.channel = channel
+        self._client = redis.Redis.from_url(redis_url)
+        self._thread = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def ensure_listening(self):
+        # The subscriber thread does not survive a fork, so each worker starts its own
+        if self._thread is not None and self._pid == os.getpid() and self._thread.is_alive():
+            return
+        with self._lock:
+            if self._thread is not None and self._pid == os.getpid() and self._thread.is_alive():
+                return
+            # Entries cached before we were listening may have missed invalidations
+            self.cache.clear()
+            self._pid = os.getpid()
+            self._thread = threading.Thread(target=self._listen, name='user-cache-invalidation', daemon=True)
+            self._thread.start()
+
+    def _listen(self):
+        while True:
+            try:
+                pubsub = self._client.pubsub(ignore_subscribe_messages=True)
+                pubsub.subscribe(self.channel)
+                for message in pubsub.listen():
+                    user_id = message.get('data')
+                    if isinstance(user_id, bytes):
+                        user_id = user_id.decode('utf-8')
+                    self.cache.discard(user_id)
+            except Exception as e:
+                logger.warning(f'User cache invalidation listener reconnecting: {str(e)}')
+                self.cache.clear()
+                time.sleep(1.0)
+
+    def publish(self, user_id):
+        try:
+            self._client.publish(self.channel, user_id)
+        except Exception as e:
+            logger.error(f'Could not publish user cache invalidation: {str(e)}')
+
+
+def init_user_cache(app):
+    """Attach the user cache (and Redis invalidation bus, if configured) to app"""
+    cache = UserCache(
+        max_size=app.config.get('USER_CACHE_SIZE', 10000),
+        ttl=app.config.get('USER_CACHE_TTL', 60),
+    )
+    app.extensions['user_cache'] = cache
+
+    bus = None
+    if app.config.get('USER_CACHE_BACKEND', 'local') == 'redis':
+        bus = RedisInvalidationBus(cache, app.config['REDIS_URL'])
+    app.extensions['user_cache_bus'] = bus
+    return cache
+
+
+def _cache():
+    return current_app.extensions.get('user_cache') if current_app.config.get('USER_CACHE_ENABLED', True) else None
+
+
+def get_cached_user(user_id):
+    """Column values for user_id if cached, else None"""
+    cache = _cache()
+    if cache is None:
+        return None
+    bus = current_app.extensions.get('user_cache_bus')
+    if bus is not None:
+        bus.ensure_listening()
+    return cache.get(user_id)
+
+
+def cache_user(user):
+    cache = _cache()
+    if cache is not None and user.is_active:
+        cache.put(user.id, {column: getattr(user, column) for column in CACHED_COLUMNS})
+
+
+def invalidate_user(user_id):
+    """Drop user_id from this worker's cache and, with Redis, from every worker's"""
+    cache = current_app.extensions.get('user_cache')
+    if cache is not None:
+        cache.discard(user_id)
+    bus = current_app.extensions.get('user_cache_bus')
+    if bus is not None:
+        bus.publish(user_id)
+
+
+def user_cache_stats():
+    cache = current_app.extensions.get('user_cache')
+    return cache.stats() if cache else {}
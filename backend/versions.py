@@ -0,0 +1,198 @@
+"""HavenApp Backend - Per-user resource versions for conditional GETs
+
+Every write path bumps a counter for the (user, resource) it changed, after
+its commit. GET handlers derive a strong ETag from the current counter, so
+an If-None-Match that still matches is answered 304 before any resource
+table is queried or anything is serialized.
+
+With VERSION_STORE_BACKEND = 'redis' the counters live in REDIS_URL and
+every gunicorn worker hands out the same tags; 'local' keeps them in the
+process, which is only coherent for a single worker. With more than one
+(WORKER_PROCESSES) and no shared store, no store is attached: responses
+carry no ETag, and nothing that relies on versions (the consent snapshots,
+read-your-writes routing) trusts a stale view. Each store also has
+an epoch that is part of every tag: a fresh process (or bump_all(), used
+after bulk deletes) changes it, so tags issued before can never match.
+
+Because bumps mark every committed write, the stores also remember who
+wrote in the last write_window seconds; database.py uses that to keep
+those users' reads on the primary.
+"""
+import hashlib
+import logging
+import threading
+import time
+import uuid
+from flask import current_app, request
+
+logger = logging.getLogger(__name__)
+
+RESOURCES = ('alerts', 'signals', 'consent', 'user', 'contacts')
+
+REDIS_PREFIX = 'havenapp:version'
+
+
+class LocalVersionStore:
+    """Version counters held in this process"""
+
+    def __init__(self, write_window=0):
+        self._versions = {}
+        self._written = {}  # user_id -> monotonic time of last write
+        self._lock = threading.Lock()
+        self.write_window = write_window
+        self.epoch = uuid.uuid4().hex[:12]
+
+    def get(self, user_id, resource):
+        return self.epoch, self._versions.get((user_id, resource), 0)
+
+    def bump(self, user_id, resources):
+        with self._lock:
+            for resource in resources:
+                key = (user_id, resource)
+                self._versions[key] = self._versions.get(key, 0) + 1
+            if self.write_window:
+                now = time.monotonic()
+                self._written[user_id] = now
+                if len(self._written) > 10000:
+                    self._written = {u: t for u, t in self._written.items() if now - t < self.write_window}
+
+    def recently_written(self, user_id):
+        written = self._written.get(user_id)
+        return written is not None and time.monotonic() - written < self.write_window
+
+    def bump_all(self):
+        with self._lock:
+            self._versions.clear()
+            self.epoch = uuid.uuid4().hex[:12]
+
+
+class RedisVersionStore:
+    """Version counters shared by every worker through Redis"""
+
+    def __init__(self, redis_url, write_window=0, prefix=REDIS_PREFIX):
+        import redis
+
+        self._client = redis.Redis.from_url(redis_url)
+        self.write_window = write_window
+        self.prefix = prefix
+        self._epoch_key = f'{prefix}:epoch'
+
+    def _key(self, user_id, resource):
+        return f'{self.prefix}:{user_id}:{resource}'
+
+    def get(self, user_id, resource):
+        epoch, version = self._client.mget(self._epoch_key, self._key(user_id, resource))
+        if epoch is None:
+            # First use, or Redis lost its data: start an epoch no earlier tag can match
+            self._client.set(self._epoch_key, uuid.uuid4().hex[:12], nx=True)
+            epoch = self._client.get(self._epoch_key)
+        return epoch.decode('utf-8'), int(version or 0)
+
+    def bump(self, user_id, resources):
+        pipe = self._client.pipeline(transaction=False)
+        for resource in resources:
+            pipe.incr(self._key(user_id, resource))
+        if self.write_window:
+            pipe.set(f'{self.prefix}:{user_id}:written', 1, px=int(self.write_window * 1000))
+        pipe.execute()
+
+    def recently_written(self, user_id):
+        return bool(self.write_window) and self._client.exists(f'{self.prefix}:{user_id}:written') > 0
+
+    def bump_all(self):
+        self._client.set(self._epoch_key, uuid.uuid4().hex[:12])
+
+
+def init_versions(app):
+    """Attach the version store selected by VERSION_STORE_BACKEND to app"""
+    # Recent writers only matter when reads can go to a lagging replica
+    write_window = app.config.get('DB_READ_YOUR_WRITES_SECONDS', 5) if app.config.get('DATABASE_REPLICA_URL') else 0
+    if app.config.get('VERSION_STORE_BACKEND', 'local') == 'redis':
+        store = RedisVersionStore(app.config['REDIS_URL'], write_window)
+    elif app.config.get('WORKER_PROCESSES', 1) > 1:
+        # Other workers' writes would never bump this one's counters, and it
+        # would keep answering 304 for stale data
+        logger.warning(f"VERSION_STORE_BACKEND 'local' can't cover {app.config['WORKER_PROCESSES']} workers; "
+                       f"ETags are off until REDIS_URL is set")
+        return None
+    else:
+        store = LocalVersionStore(write_window)
+    app.extensions['version_store'] = store
+    return store
+
+
+def bump_versions(user_id, *resources):
+    """Invalidate ETags for user_id's resources; call after the change is committed"""
+    store = current_app.extensions.get('version_store')
+    if store is None:
+        return
+    try:
+        store.bump(user_id, resources)
+    except Exception as e:
+        logger.error(f'Could not bump versions {resources} for user {user_id}: {str(e)}')
+
+
+def bump_all_versions():
+    """Invalidate every ETag, e.g. after a bulk delete touching many users"""
+    store = current_app.extensions.get('version_store')
+    if store is not None:
+        try:
+            store.bump_all()
+        except Exception as e:
+            logger.error(f'Could not reset version epoch: {str(e)}')
+
+
+def recently_written(user_id):
+    """Whether user_id committed a write within the read-your-writes window"""
+    store = current_app.extensions.get('version_store')
+    if store is None:
+        # No shared record of anyone's writes: the primary is always safe
+        return True
+    try:
+        return store.recently_written(user_id)
+    except Exception as e:
+        logger.error(f'Could not check recent writes for user {user_id}: {str(e)}')
+        # Unknown: the primary is always safe
+        return True
+
+
+def resource_version(user_id, resource):
+    """(epoch, version) of user_id's resource, or None when it can't be read"""
+    store = current_app.extensions.get('version_store')
+    if store is None:
+        return None
+    try:
+        return store.get(user_id, resource)
+    except Exception as e:
+        logger.error(f'Could not read version of {resource} for user {user_id}: {str(e)}')
+        return None
+
+
+def resource_etag(user_id, resource, variant=''):
+    """Strong ETag for this request's representation of user_id's resource, or None
+
+    variant distinguishes representations the query string alone doesn't,
+    such as a default time window that moves with the clock.
+    """
+    current = resource_version(user_id, resource)
+    if current is None:
+        return None
+    epoch, version = current
+    # Query parameters (page size, cursor) select different representations
+    key = f'{epoch}:{user_id}:{resource}:{version}:{request.query_string.decode("latin-1")}:{variant}'
+    return hashlib.blake2b(key.encode('utf-8'), digest_size=12).hexdigest()
+
+
+def etag_headers(etag):
+    if etag is None:
+        return {}
+    # Clients may keep the body but must revalidate before using it
+    return {'ETag': f'"{etag}"', 'Cache-Control': 'private, no-cache', 'Vary': 'Authorization'}
+
+
+def not_modified(etag):
+    """A 304 response if the request's If-None-Match matches etag, else None"""
+    # Weak comparison (RFC 9110), so tags that compression.py weakened still match
+    if etag is not None and request.if_none_match.contains_weak(etag):
+        return '', 304, etag_headers(etag)
+    return None
@@ -0,0 +1,6 @@
+"""HavenApp Backend - WSGI entry point for gunicorn and the flask CLI"""
+import os
+
+from app import create_app
+
+app = create_app(os.getenv('FLASK_ENV', 'production'))